@@ -1,26 +1,135 @@
 """Script that automatically sets up azurite with the required blob containers and files.
-    Used in the azurite-setup container but can also be ran outside of the container."""
+    Used in the azurite-setup container but can also be ran outside of the container.
 
+    The containers, queues and seed blobs to create are listed in a manifest, azurite-manifest.json
+    by default. Each one is created on its own and at the same time as the others, so one that
+    already exists or fails does not stop the rest, and running the script again is safe.
+
+    Seed blobs are given as a file to upload or as content to write, for example:
+        "blobs": [
+            {"container": "inbound", "file": "BSS_20241201121212_n1.parquet"},
+            {"container": "nems-config", "name": "MeshState.json", "content": {"NextHandShakeTime": "2025-01-01T00:00:00"}, "overwrite": true}
+        ]
+    File paths are relative to the manifest. A blob that is already there with the same content is
+    left alone, and one with different content is only replaced when overwrite is true."""
+
+import argparse
+import hashlib
+import json
 import os
-from azure.storage.blob import BlobServiceClient, BlobClient
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from azure.storage.blob import BlobServiceClient, ContentSettings
 from azure.storage.queue import QueueServiceClient
-from azure.core.exceptions import ResourceExistsError
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError, ServiceRequestError
+
+MANIFEST = os.path.join(os.path.dirname(os.path.abspath(__file__)), "azurite-manifest.json")
+RETRIES = 5
+MAX_WORKERS = 8
+
+
+def with_retries(action):
+    # Azurite can still be starting when the setup container runs, so connection errors are retried
+    for attempt in range(RETRIES):
+        try:
+            return action()
+        except ServiceRequestError:
+            if attempt == RETRIES - 1:
+                raise
+            time.sleep(2 ** attempt)
+
+
+def ensure_container(blob_service_client, name):
+    try:
+        with_retries(lambda: blob_service_client.create_container(name))
+        return f"Container {name} created"
+    except ResourceExistsError:
+        return f"Container {name} already exists"
+
+
+def ensure_queue(queue_service_client, name):
+    try:
+        with_retries(lambda: queue_service_client.create_queue(name))
+        return f"Queue {name} created"
+    except ResourceExistsError:
+        return f"Queue {name} already exists"
+
+
+def blob_content(blob, manifest_directory):
+    if "file" in blob:
+        with open(os.path.join(manifest_directory, blob["file"]), "rb") as file:
+            return file.read()
+    content = blob["content"]
+    return (content if isinstance(content, str) else json.dumps(content, indent=2)).encode()
+
+
+def ensure_blob(blob_service_client, blob, manifest_directory):
+    name = blob.get("name") or os.path.basename(blob["file"])
+    blob_client = blob_service_client.get_blob_client(blob["container"], name)
+    data = blob_content(blob, manifest_directory)
+    content_md5 = hashlib.md5(data).digest()
+
+    try:
+        existing_md5 = with_retries(blob_client.get_blob_properties).content_settings.content_md5
+        if existing_md5 and bytes(existing_md5) == content_md5:
+            return f"Blob {blob['container']}/{name} is up to date"
+        if not blob.get("overwrite", False):
+            return f"Blob {blob['container']}/{name} already exists with different content, set overwrite to replace it"
+    except ResourceNotFoundError:
+        pass
+
+    with_retries(lambda: blob_client.upload_blob(data, overwrite=True,
+                                                 content_settings=ContentSettings(content_md5=bytearray(content_md5))))
+    return f"Blob {blob['container']}/{name} uploaded"
+
+
+def run_all(executor, tasks):
+    # Run every task, reporting each failure without stopping the others
+    futures = [(description, executor.submit(task)) for description, task in tasks]
+    failures = 0
+    for description, future in futures:
+        try:
+            print(future.result())
+        except Exception as e:
+            print(f"Failed to set up {description}: {e}")
+            failures += 1
+    return failures
+
+
+def setup_azurite(manifest_path=MANIFEST):
+    with open(manifest_path, "r") as file:
+        manifest = json.load(file)
+    manifest_directory = os.path.dirname(os.path.abspath(manifest_path))
 
-def setup_azurite():
     connect_str = os.getenv("AZURITE_CONNECTION_STRING")
     blob_service_client = BlobServiceClient.from_connection_string(connect_str)
     queue_service_client = QueueServiceClient.from_connection_string(connect_str)
     print("Connected to Azurite")
 
-    try:
-        blob_service_client.create_container("inbound")
-        blob_service_client.create_container("file-exceptions")
-        blob_service_client.create_container("nems-updates")
-        blob_service_client.create_container("nems-config")
-        queue_service_client.create_queue("add-participant-queue")
-        queue_service_client.create_queue("add-participant-queue-poison")
-        print("Queues & blob containers created")
-    except ResourceExistsError:
-        print("Queues & blob containers already exist")
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        failures = run_all(executor, [
+            *[(f"container {name}", lambda name=name: ensure_container(blob_service_client, name))
+              for name in manifest.get("containers", [])],
+            *[(f"queue {name}", lambda name=name: ensure_queue(queue_service_client, name))
+              for name in manifest.get("queues", [])],
+        ])
+
+        # Seed blobs go in once their containers have been created
+        failures += run_all(executor, [
+            (f"blob {blob['container']}/{blob.get('name') or blob.get('file')}",
+             lambda blob=blob: ensure_blob(blob_service_client, blob, manifest_directory))
+            for blob in manifest.get("blobs", [])
+        ])
+
+    if failures:
+        sys.exit(f"{failures} resource(s) could not be set up")
+    print("Queues & blob containers created")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Set up the blob containers, queues and seed blobs in azurite")
+    parser.add_argument("--manifest", default=MANIFEST, help="The manifest of resources to create (default: azurite-manifest.json)")
+    args = parser.parse_args()
 
-setup_azurite()
+    setup_azurite(args.manifest)
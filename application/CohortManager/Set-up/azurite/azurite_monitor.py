@@ -0,0 +1,206 @@
+"""Monitors the queues and blob containers in azurite while the functions are running
+    Polls the queue depths and container contents, and reports how fast the queues fill and
+    drain, how fast the poison queues grow and how fast blobs arrive, as a live view in the
+    terminal. Each poll can also be written as a JSON line or to a Prometheus text file.
+    Requirements:
+        python-dotenv
+        azure-storage-blob
+        azure-storage-queue"""
+
+try:
+    import argparse
+    import json
+    import os
+    import sys
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+    from datetime import datetime, timezone
+    from azure.core.exceptions import ResourceNotFoundError
+    from azure.storage.blob import BlobServiceClient
+    from azure.storage.queue import QueueServiceClient
+    from send_sample_file import get_connection_string
+except ModuleNotFoundError:
+    sys.exit("Requirements not installed, please run 'pip install azure-storage-blob azure-storage-queue python-dotenv'")
+
+QUEUES = ["add-participant-queue", "add-participant-queue-poison"]
+CONTAINERS = ["inbound", "file-exceptions"]
+
+
+class QueueMonitor:
+    def __init__(self, queue_client):
+        self.queue_client = queue_client
+        self.name = queue_client.queue_name
+        self.first_depth = None
+        self.previous = None
+
+    def poll(self, now):
+        try:
+            depth = self.queue_client.get_queue_properties().approximate_message_count
+        except ResourceNotFoundError:
+            return {'queue': self.name, 'exists': False}
+
+        # The oldest visible message shows how far behind the consumers are
+        oldest = list(self.queue_client.peek_messages(max_messages=1))
+        oldest_age = (datetime.now(timezone.utc) - oldest[0].inserted_on).total_seconds() if oldest else 0.0
+
+        if self.first_depth is None:
+            self.first_depth = depth
+        net_rate = (depth - self.previous[1]) / (now - self.previous[0]) if self.previous else 0.0
+        self.previous = (now, depth)
+
+        return {
+            'queue': self.name,
+            'exists': True,
+            'messages': depth,
+            'net_rate': net_rate,
+            'growth': depth - self.first_depth,
+            'oldest_message_age_seconds': oldest_age,
+            'seconds_to_drain': depth / -net_rate if net_rate < 0 else None,
+        }
+
+
+class ContainerMonitor:
+    def __init__(self, container_client):
+        self.container_client = container_client
+        self.name = container_client.container_name
+        self.seen = None
+        self.arrivals = 0
+        self.previous_time = None
+
+    def poll(self, now):
+        try:
+            names = {blob.name for blob in self.container_client.list_blobs()}
+        except ResourceNotFoundError:
+            return {'container': self.name, 'exists': False}
+
+        # Blobs already there when monitoring started are not counted as arrivals
+        new = len(names - self.seen) if self.seen is not None else 0
+        arrival_rate = new / (now - self.previous_time) if self.previous_time else 0.0
+        self.arrivals += new
+        self.seen = names
+        self.previous_time = now
+
+        return {
+            'container': self.name,
+            'exists': True,
+            'blobs': len(names),
+            'new_blobs': new,
+            'arrivals': self.arrivals,
+            'arrival_rate': arrival_rate,
+        }
+
+
+def render(sample):
+    lines = [f"Azurite monitor - {sample['time']}", "",
+             f"{'Queue':<34}{'Messages':>10}{'Net/s':>10}{'Growth':>10}{'Oldest':>10}{'Drained in':>12}"]
+    for queue in sample['queues']:
+        if not queue['exists']:
+            lines.append(f"{queue['queue']:<34}{'missing':>10}")
+            continue
+        drained_in = f"{queue['seconds_to_drain']:.0f}s" if queue['seconds_to_drain'] is not None else '-'
+        lines.append(f"{queue['queue']:<34}{queue['messages']:>10}{queue['net_rate']:>10.1f}"
+                     f"{queue['growth']:>+10}{queue['oldest_message_age_seconds']:>9.0f}s{drained_in:>12}")
+
+    lines += ["", f"{'Container':<34}{'Blobs':>10}{'New':>10}{'Arrived':>10}{'Arrivals/s':>12}"]
+    for container in sample['containers']:
+        if not container['exists']:
+            lines.append(f"{container['container']:<34}{'missing':>10}")
+            continue
+        lines.append(f"{container['container']:<34}{container['blobs']:>10}{container['new_blobs']:>10}"
+                     f"{container['arrivals']:>10}{container['arrival_rate']:>12.2f}")
+    return "\n".join(lines)
+
+
+def prometheus_metrics(sample):
+    metrics = {
+        'azurite_queue_messages': ('gauge', 'Approximate number of messages in the queue', 'queue', 'messages'),
+        'azurite_queue_net_rate': ('gauge', 'Change in queue depth per second since the last poll', 'queue', 'net_rate'),
+        'azurite_queue_growth': ('gauge', 'Change in queue depth since monitoring started', 'queue', 'growth'),
+        'azurite_queue_oldest_message_age_seconds': ('gauge', 'Age of the oldest visible message', 'queue', 'oldest_message_age_seconds'),
+        'azurite_container_blobs': ('gauge', 'Number of blobs in the container', 'container', 'blobs'),
+        'azurite_container_blob_arrivals_total': ('counter', 'Blobs that arrived since monitoring started', 'container', 'arrivals'),
+        'azurite_container_blob_arrival_rate': ('gauge', 'Blobs arriving per second since the last poll', 'container', 'arrival_rate'),
+    }
+
+    lines = []
+    for name, (metric_type, description, label, key) in metrics.items():
+        lines += [f"# HELP {name} {description}", f"# TYPE {name} {metric_type}"]
+        for resource in sample[f"{label}s"]:
+            if resource['exists']:
+                lines.append(f'{name}{{{label}="{resource[label]}"}} {resource[key]}')
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path, sample):
+    # Replace the file in one step so a scraper never reads a half written file
+    with open(f"{path}.tmp", 'w') as file:
+        file.write(prometheus_metrics(sample))
+    os.replace(f"{path}.tmp", path)
+
+
+def monitor(queues, containers, interval, polls=None, jsonl=None, prometheus=None, quiet=False):
+    connection_string = get_connection_string()
+    queue_service_client = QueueServiceClient.from_connection_string(connection_string)
+    blob_service_client = BlobServiceClient.from_connection_string(connection_string)
+
+    queue_monitors = [QueueMonitor(queue_service_client.get_queue_client(queue)) for queue in queues]
+    container_monitors = [ContainerMonitor(blob_service_client.get_container_client(container)) for container in containers]
+    live = not quiet and sys.stdout.isatty()
+
+    jsonl_file = open(jsonl, 'a') if jsonl else None
+    poll = 0
+    try:
+        with ThreadPoolExecutor(max_workers=len(queue_monitors) + len(container_monitors)) as executor:
+            while polls is None or poll < polls:
+                started = time.monotonic()
+                queue_results = executor.map(lambda monitor: monitor.poll(started), queue_monitors)
+                container_results = executor.map(lambda monitor: monitor.poll(started), container_monitors)
+                sample = {
+                    'time': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                    'queues': list(queue_results),
+                    'containers': list(container_results),
+                }
+
+                if jsonl_file:
+                    jsonl_file.write(json.dumps(sample) + "\n")
+                    jsonl_file.flush()
+                if prometheus:
+                    write_prometheus(prometheus, sample)
+                if live:
+                    print("\x1b[2J\x1b[H" + render(sample), flush=True)
+                elif not quiet:
+                    print(render(sample) + "\n", flush=True)
+
+                poll += 1
+                if polls is None or poll < polls:
+                    time.sleep(max(0.0, interval - (time.monotonic() - started)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if jsonl_file:
+            jsonl_file.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Monitor the queues and blob containers in azurite',
+                                     formatter_class=argparse.RawTextHelpFormatter,
+                                     epilog="""Examples:
+    python azurite_monitor.py
+    python azurite_monitor.py --interval 5 --jsonl monitor.jsonl
+    python azurite_monitor.py --prometheus azurite.prom --quiet
+    python azurite_monitor.py --queues add-participant-queue --containers inbound --polls 60""")
+
+    parser.add_argument('--queues', nargs='+', default=QUEUES, help=f"Queues to monitor (default: {' '.join(QUEUES)})")
+    parser.add_argument('--containers', nargs='+', default=CONTAINERS, help=f"Blob containers to monitor (default: {' '.join(CONTAINERS)})")
+    parser.add_argument('--interval', type=float, default=2.0, help='Seconds between polls (default: 2)')
+    parser.add_argument('--polls', type=int, help='(OPTIONAL) Stop after this many polls, runs until stopped with Ctrl+C by default')
+    parser.add_argument('--jsonl', help='(OPTIONAL) Append every poll to this file as a JSON line')
+    parser.add_argument('--prometheus', help='(OPTIONAL) Write the latest poll to this file in the Prometheus text format')
+    parser.add_argument('--quiet', action='store_true', help='(OPTIONAL) Do not print the live view')
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    monitor(args.queues, args.containers, args.interval, args.polls, args.jsonl, args.prometheus, args.quiet)
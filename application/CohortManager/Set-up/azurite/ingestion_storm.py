@@ -0,0 +1,176 @@
+"""A load driver that uploads a timed schedule of CAAS files to the inbound container in azurite
+    Uploads arrive at a fixed rate or as a Poisson process and run concurrently with the async
+    blob client. Every upload gets a unique CAAS file name, and its scheduled, start and finish
+    times are written to a CSV so ingestion latency can be matched against the function logs.
+    Requirements:
+        python-dotenv
+        azure-storage-blob
+        aiohttp
+        numpy and pyarrow, to generate files with --generate"""
+
+try:
+    import argparse
+    import asyncio
+    import csv
+    import os
+    import random
+    import re
+    import sys
+    import time
+    from datetime import datetime, timezone
+    from azure.storage.blob.aio import BlobServiceClient
+    from send_sample_file import SAMPLE_FILES, get_connection_string
+except ModuleNotFoundError:
+    sys.exit("Requirements not installed, please run 'pip install azure-storage-blob aiohttp python-dotenv'")
+
+# Matches the file names receiveCaasFile accepts, the second group is the screening workflow
+FILE_NAME_REGEX = re.compile(r'^(.+)_-_(\w+)\.parquet$', re.IGNORECASE)
+DEFAULT_WORKFLOW = 'CAAS_BREAST_SCREENING_COHORT'
+
+CSV_COLUMNS = ['upload', 'blob_name', 'source_file', 'size_bytes', 'scheduled_at', 'started_at', 'finished_at',
+               'duration_seconds', 'status', 'error']
+
+
+def generate_files(count, rows, work_directory, seed):
+    # Each generated file gets its own block of NHS numbers, and files from an earlier run with
+    # the same settings are reused, so generating does not get in the way of the storm
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts', 'caas-cohort-generator'))
+    try:
+        from caas_cohort_generator import generate_cohort
+    except ModuleNotFoundError:
+        sys.exit("Requirements not installed, please run 'pip install numpy pyarrow'")
+
+    os.makedirs(work_directory, exist_ok=True)
+    files = []
+    for i in range(count):
+        file_name = os.path.join(work_directory, f"storm_{rows}_{seed}_{i}_-_{DEFAULT_WORKFLOW}.parquet")
+        if not os.path.exists(file_name):
+            generate_cohort(f"{file_name}.tmp", rows, seed=seed + i, first_row=i * rows)
+            os.replace(f"{file_name}.tmp", file_name)
+        files.append(file_name)
+    return files
+
+
+def arrival_offsets(count, rate, arrival, seed):
+    # Seconds from the start of the storm at which each upload is due
+    if arrival == 'fixed':
+        return [i / rate for i in range(count)]
+
+    rng = random.Random(seed)
+    offsets = [0.0]
+    for _ in range(count - 1):
+        offsets.append(offsets[-1] + rng.expovariate(rate))
+    return offsets
+
+
+def blob_name(source_file, run_id, upload):
+    # A new CAAS file name for every upload, so receiveCaasFile sees each one as a new file
+    match = FILE_NAME_REGEX.match(os.path.basename(source_file))
+    workflow = match.group(2) if match else DEFAULT_WORKFLOW
+    extension = os.path.splitext(source_file)[1] or '.parquet'
+    timestamp = datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S%f')
+    return f"{timestamp}_{run_id}{upload:05d}_-_{workflow}{extension}"
+
+
+def utc_now():
+    return datetime.now(timezone.utc).isoformat(timespec='milliseconds')
+
+
+async def upload(container_client, semaphore, upload_number, source_file, run_id, scheduled_at, max_concurrency):
+    async with semaphore:
+        name = blob_name(source_file, run_id, upload_number)
+        row = {'upload': upload_number, 'blob_name': name, 'source_file': source_file,
+               'size_bytes': os.path.getsize(source_file), 'scheduled_at': scheduled_at, 'started_at': utc_now()}
+        start = time.perf_counter()
+        try:
+            with open(source_file, 'rb') as data:
+                await container_client.get_blob_client(name).upload_blob(
+                    data, length=row['size_bytes'], overwrite=True, max_concurrency=max_concurrency)
+            row['status'] = 'uploaded'
+        except Exception as e:
+            row['status'] = 'failed'
+            row['error'] = str(e)
+        row['finished_at'] = utc_now()
+        row['duration_seconds'] = round(time.perf_counter() - start, 3)
+        print(f"Upload {upload_number} {row['status']}: {name} in {row['duration_seconds']}s")
+        return row
+
+
+async def run_storm(source_files, count, rate, arrival, container, output, max_in_flight, max_concurrency, seed):
+    offsets = arrival_offsets(count, rate, arrival, seed)
+    run_id = datetime.now(timezone.utc).strftime('ST%H%M%S')
+    semaphore = asyncio.Semaphore(max_in_flight)
+
+    async with BlobServiceClient.from_connection_string(get_connection_string()) as blob_service_client:
+        container_client = blob_service_client.get_container_client(container)
+        print(f"Connected to Azurite, sending {count} uploads to {container} over {offsets[-1]:.1f}s")
+
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        tasks = []
+        for i, offset in enumerate(offsets):
+            await asyncio.sleep(max(0.0, start + offset - loop.time()))
+            tasks.append(asyncio.create_task(upload(container_client, semaphore, i, source_files[i % len(source_files)],
+                                                    run_id, utc_now(), max_concurrency)))
+        rows = await asyncio.gather(*tasks)
+        elapsed = loop.time() - start
+
+    with open(output, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=CSV_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+    uploaded = [row for row in rows if row['status'] == 'uploaded']
+    durations = sorted(row['duration_seconds'] for row in uploaded) or [0]
+    size = sum(row['size_bytes'] for row in uploaded)
+    print(f"Uploaded {len(uploaded)} of {count} files ({size / 1024 / 1024:.1f} MB) in {elapsed:.1f}s, "
+          f"{len(uploaded) / elapsed:.2f} files/s, {size / 1024 / 1024 / elapsed:.1f} MB/s")
+    print(f"Upload duration p50 {durations[len(durations) // 2]:.2f}s "
+          f"p95 {durations[min(int(len(durations) * 0.95), len(durations) - 1)]:.2f}s max {durations[-1]:.2f}s")
+    print(f"Upload timings written to {output}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Upload a timed schedule of CAAS files to azurite to load test receiveCaasFile',
+                                     formatter_class=argparse.RawTextHelpFormatter,
+                                     epilog="""Examples:
+    python ingestion_storm.py --generate 500000 --count 20 --rate 4
+    python ingestion_storm.py --files 1 cohort.parquet --count 100 --rate 2 --arrival poisson --seed 7
+    python ingestion_storm.py --files cohort.parquet --count 10 --rate 0.5 --output storm-timings.csv""")
+
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--files', nargs='+', help='Sample files to upload in turn, 1, 10 and 100 are the sample files known to send_sample_file.py')
+    source.add_argument('--generate', type=int, metavar='ROWS', help='Generate a CAAS cohort file of this many rows for each upload')
+    parser.add_argument('--count', type=int, required=True, help='The number of uploads')
+    parser.add_argument('--rate', type=float, required=True, help='Uploads per second')
+    parser.add_argument('--arrival', choices=['fixed', 'poisson'], default='fixed', help="'fixed' spaces uploads evenly, 'poisson' spaces them at random around the rate (default: fixed)")
+    parser.add_argument('--seed', type=int, default=0, help='Seed for Poisson arrivals and generated files (default: 0)')
+    parser.add_argument('--container', default='inbound', help='The container to upload to (default: inbound)')
+    parser.add_argument('--max-in-flight', type=int, default=16, help='Uploads running at the same time, later uploads wait and start late (default: 16)')
+    parser.add_argument('--max-concurrency', type=int, default=4, help='Blocks of each upload sent at the same time (default: 4)')
+    parser.add_argument('--work-dir', default='.ingestion_storm', help='Where generated files are kept between runs (default: .ingestion_storm)')
+    parser.add_argument('--output', default='ingestion_storm.csv', help='CSV file to write upload timings to (default: ingestion_storm.csv)')
+
+    if len(sys.argv) == 1:
+        parser.print_help()
+        sys.exit()
+
+    args = parser.parse_args()
+    if args.count < 1 or args.rate <= 0:
+        parser.error("--count and --rate must be greater than 0")
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    if args.generate:
+        source_files = generate_files(args.count, args.generate, args.work_dir, args.seed)
+    else:
+        source_files = [SAMPLE_FILES.get(file, file) for file in args.files]
+        missing = [file for file in source_files if not os.path.isfile(file)]
+        if missing:
+            sys.exit(f"File(s) {', '.join(missing)} could not been found, please download the files from confluence and put them in the azurite directory")
+
+    asyncio.run(run_storm(source_files, args.count, args.rate, args.arrival, args.container, args.output,
+                          args.max_in_flight, args.max_concurrency, args.seed))
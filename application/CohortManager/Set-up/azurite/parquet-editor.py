@@ -1,21 +1,66 @@
 import argparse
+import csv
+import os
 import sys
 from send_sample_file import send_sample_file
+from parquet_patch import check_writer, find_row_group, patch_row_groups, read_footer
+from parquet_lookup import build_index, find_matching_rows, indexed_columns, refresh_index
 import pandas as pd
 import numpy as np
 from fastparquet import write
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+from caas_cohort_schema import PANDAS_DTYPES
+
 parser = argparse.ArgumentParser(description='An script that allows you to edit parquet files',
                                 formatter_class=argparse.RawTextHelpFormatter,
                                 epilog="""Examples:
     python parquet-editor.py -f BSS_20241201121212_n1.parquet -c nhs_number given_name -v 9442788159 bob -s
-    python parquet-editor.py -f BSS_20241201121212_n1.parquet -c family_name -r 0 -v booble""")
+    python parquet-editor.py -f BSS_20241201121212_n1.parquet -c family_name -r 0 -v booble
+    python parquet-editor.py -f BSS_20241201121212_n1000000.parquet -c family_name -r 523001 -v booble -p
+    python parquet-editor.py -f BSS_20241201121212_n1000000.parquet -c family_name -v booble --nhs-number 9000000009
+    python parquet-editor.py -f BSS_20241201121212_n1000000.parquet -c record_type -v DEL --where primary_care_provider=A81001 --where gender=1
+    python parquet-editor.py -f BSS_20241201121212_n1000000.parquet --build-index nhs_number
+    python parquet-editor.py -f BSS_20241201121212_n1000000.parquet --rules rules.yaml -o regression.parquet
+
+Rules files:
+    Each rule sets one or more columns on the rows matched by all of its conditions,
+    and rules are applied in order. A rule with no conditions applies to every row.
+
+    YAML, a list of rules:
+        - set: {family_name: Smith}
+          where: {nhs_number: [9000000009, 9000000017]}
+        - set: {date_of_death: null}
+          fraction: 0.05
+          seed: 1
+        - set: {record_type: AMENDED}
+          rows: 1000-2000
+
+    CSV, one column to set per line:
+        column,value,rows,where_column,where_values,fraction,seed
+        family_name,Smith,,nhs_number,9000000009;9000000017,,
+        date_of_death,null,,,,0.05,1
+        record_type,AMENDED,1000-2000,,,,
+
+    rows is an inclusive range of row indexes, where matches rows with any of the values
+    and fraction picks that fraction of the matching rows at random.
+
+Selecting rows by value:
+    --nhs-number and --where only read the row groups whose statistics show they can hold
+    the value, and only patch the row groups that do. --build-index writes a sidecar index of
+    a column next to the file, which is then used to go straight to the row groups holding
+    a value. Indexes are kept up to date by edits that do not change the indexed column.""")
 
 parser.add_argument('-f', nargs=1, help='The filename of the parquet file you would like to edit', required=True)
 parser.add_argument('-o', nargs=1, help='(OPTIONAL) The output filename', required=False)
-parser.add_argument('-c', nargs='+', help='The column(s) to be edited, in snake_case format, separated by spaces', required=True)
+parser.add_argument('-c', nargs='+', help='The column(s) to be edited, in snake_case format, separated by spaces', required=False)
 parser.add_argument('-r', nargs=1, type=int, help='(Optional) The index of the row to be edited (will overwrite the entire row if left blank)', required=False)
-parser.add_argument('-v', nargs='+', help='The value(s) of to set the corresponding column(s) to, separated by spaces', required=True)
+parser.add_argument('-v', nargs='+', help='The value(s) of to set the corresponding column(s) to, separated by spaces', required=False)
+parser.add_argument('-p', '--patch', action='store_true', help='(OPTIONAL) Only decode and rewrite the row group holding the row given with -r, copying the rest of the file as it is')
+parser.add_argument('--nhs-number', nargs=1, help='(OPTIONAL) Edit the rows with this NHS number, instead of giving the row with -r', required=False)
+parser.add_argument('--where', action='append', metavar='COLUMN=VALUE', help='(OPTIONAL) Edit the rows where the column has the value, can be given more than once', required=False)
+parser.add_argument('--build-index', nargs=1, metavar='COLUMN', help='(OPTIONAL) Build a sidecar index of the column, used to find rows by value', required=False)
+parser.add_argument('--rules', nargs=1, help='(OPTIONAL) A YAML or CSV file of edits to apply in one pass, instead of -c and -v', required=False)
 parser.add_argument('-s', action='store_true', help='(OPTIONAL) Send the file to azurite')
 
 if len(sys.argv) == 1:
@@ -24,81 +69,170 @@ if len(sys.argv) == 1:
 
 args = parser.parse_args()
 
+selecting = args.nhs_number or args.where
+
+if args.rules and (args.c or args.v or args.r or args.patch or selecting):
+    parser.error("--rules cannot be used with -c, -v, -r, --patch, --nhs-number or --where")
+if selecting and args.r:
+    parser.error("-r cannot be used with --nhs-number or --where")
+if not args.rules and not args.build_index and not (args.c and args.v):
+    parser.error("-c and -v are required unless --rules or --build-index is used")
+if args.patch and not args.r:
+    parser.error("--patch needs the row to edit, given with -r")
+
 file_name = args.f[0]
 
-schema = {
-    "record_type": "string",
-    "change_time_stamp": "Int64",
-    "serial_change_number": "Int64",
-    "nhs_number": "Int64",
-    "superseded_by_nhs_number": "Int64",
-    "primary_care_provider": "string",
-    "primary_care_effective_from_date": "string",
-    "current_posting": "string",
-    "current_posting_effective_from_date": "string",
-    "name_prefix": "string",
-    "given_name": "string",
-    "other_given_name": "string",
-    "family_name": "string",
-    "previous_family_name": "string",
-    "date_of_birth": "string",
-    "gender": "Int64",
-    "address_line_1": "string",
-    "address_line_2": "string",
-    "address_line_3": "string",
-    "address_line_4": "string",
-    "address_line_5": "string",
-    "postcode": "string",
-    "paf_key": "string",
-    "address_effective_from_date": "string",
-    "reason_for_removal": "string",
-    "reason_for_removal_effective_from_date": "string",
-    "date_of_death": "string",
-    "death_status": "Int32",
-    "home_telephone_number": "string",
-    "home_telephone_effective_from_date": "string",
-    "mobile_telephone_number": "string",
-    "mobile_telephone_effective_from_date": "string",
-    "email_address": "string",
-    "email_address_effective_from_date": "string",
-    "preferred_language": "string",
-    "is_interpreter_required": "boolean",
-    "invalid_flag": "boolean",
-    "eligibility": "boolean"
-}
-
-df = pd.read_parquet(file_name, engine='fastparquet').astype(schema, errors="ignore")
-
-for i in range(len(args.c)):
-    column_name = args.c[i]
-    value = args.v[i]
-    column_type = df[column_name].dtype
-
-
-    if column_name not in df.columns:
-        sys.exit(f"Column {column_name} not in schema, exiting")
-
-    if value == "null":
-        value = ""
-    else:
-        match schema[column_name]:
-            case "Int64":
-                value = int(value)
-            case "boolean":
-                value = value.lower() == "true"
-
-    if args.r:
-        df.at[args.r[0], column_name] = value
-    else:
-        df[column_name] = value
+schema = PANDAS_DTYPES
+
 
+def convert_value(column_name, value):
+    match schema[column_name]:
+        case "Int64" | "Int32":
+            return int(value)
+        case "boolean":
+            return value if isinstance(value, bool) else str(value).lower() == "true"
+        case _:
+            return str(value)
 
-    print(f"Column {column_name} value changed to {value}")
 
-if args.o:
-    file_name = args.o[0]
+def read_rules(rules_file):
+    if rules_file.endswith(('.yaml', '.yml')):
+        try:
+            import yaml
+        except ModuleNotFoundError:
+            sys.exit("Requirements not installed, please run 'pip install pyyaml'")
+        with open(rules_file, 'r') as file:
+            return yaml.safe_load(file) or []
+
+    # Each CSV line sets one column, so it becomes a rule of its own
+    rules = []
+    with open(rules_file, 'r', newline='') as file:
+        for line in csv.DictReader(file):
+            rule = {'set': {line['column']: None if line['value'] == 'null' else line['value']}}
+            if line.get('rows'):
+                rule['rows'] = line['rows']
+            if line.get('where_column'):
+                rule['where'] = {line['where_column']: line['where_values'].split(';')}
+            if line.get('fraction'):
+                rule['fraction'] = float(line['fraction'])
+            if line.get('seed'):
+                rule['seed'] = int(line['seed'])
+            rules.append(rule)
+    return rules
+
+
+def rule_mask(df, rule):
+    mask = np.ones(len(df), dtype=bool)
+
+    if 'rows' in rule:
+        first, _, last = str(rule['rows']).partition('-')
+        row_indexes = np.arange(len(df))
+        mask &= (row_indexes >= int(first)) & (row_indexes <= int(last or first))
+
+    for column_name, values in rule.get('where', {}).items():
+        if column_name not in df.columns:
+            sys.exit(f"Column {column_name} not in schema, exiting")
+        values = values if isinstance(values, list) else [values]
+        mask &= df[column_name].isin([convert_value(column_name, value) for value in values]).to_numpy(dtype=bool, na_value=False)
+
+    if 'fraction' in rule:
+        rng = np.random.default_rng(rule.get('seed'))
+        mask &= rng.random(len(df)) < float(rule['fraction'])
+
+    return mask
+
+
+def apply_rules(df, rules):
+    for i, rule in enumerate(rules):
+        if not rule.get('set'):
+            sys.exit(f"Rule {i + 1} has nothing to set, exiting")
+
+        mask = rule_mask(df, rule)
+        for column_name, value in rule['set'].items():
+            if column_name not in df.columns:
+                sys.exit(f"Column {column_name} not in schema, exiting")
+            value = pd.NA if value is None else convert_value(column_name, value)
+            df.loc[mask, column_name] = value
+
+        print(f"Rule {i + 1}: {', '.join(rule['set'])} changed on {mask.sum()} rows")
+
+
+def edit_columns(df, row):
+    for i in range(len(args.c)):
+        column_name = args.c[i]
+        value = args.v[i]
+
+
+        if column_name not in df.columns:
+            sys.exit(f"Column {column_name} not in schema, exiting")
+
+        value = "" if value == "null" else convert_value(column_name, value)
+
+        if row is not None:
+            df.loc[row, column_name] = value
+        else:
+            df[column_name] = value
+
+
+        print(f"Column {column_name} value changed to {value}")
+    return df
+
+
+def parse_conditions():
+    conditions = {}
+    if args.nhs_number:
+        conditions['nhs_number'] = args.nhs_number[0]
+    for condition in args.where or []:
+        column_name, separator, value = condition.partition('=')
+        if not separator:
+            parser.error(f"--where {condition} should be in the form COLUMN=VALUE")
+        conditions[column_name] = value
+
+    for column_name, value in conditions.items():
+        if column_name not in schema:
+            sys.exit(f"Column {column_name} not in schema, exiting")
+        conditions[column_name] = convert_value(column_name, value)
+    return conditions
+
+
+output_file = args.o[0] if args.o else file_name
+
+if args.build_index:
+    build_index(file_name, args.build_index[0])
+    if not (args.c and args.v):
+        sys.exit(0)
+
+if selecting:
+    # Only the row groups holding matching rows are decoded, the rest of the file is copied as it is,
+    # so the file has to be one its row groups can be encoded again for
+    check_writer(file_name)
+    matches = find_matching_rows(file_name, parse_conditions())
+    if not matches:
+        sys.exit("No rows match, exiting")
+    print(f"Found {sum(len(rows) for rows in matches.values())} matching rows in {len(matches)} row group(s)")
+    patch_row_groups(file_name, lambda i, df: edit_columns(df.astype(schema, errors="ignore"), matches[i]), list(matches), output_file)
+
+    if output_file == file_name:
+        for column_name in indexed_columns(file_name):
+            if column_name not in args.c:
+                refresh_index(file_name, column_name)
+elif args.patch:
+    # Only the row group holding the row is decoded, the rest of the file is copied as it is
+    with open(file_name, 'rb') as file:
+        file_metadata, _ = read_footer(file)
+    check_writer(file_name, file_metadata)
+    row_group, row = find_row_group(file_metadata, args.r[0])
+    print(f"Row {args.r[0]} is row {row} of row group {row_group}")
+    patch_row_groups(file_name, lambda _, df: edit_columns(df.astype(schema, errors="ignore"), row), [row_group], output_file)
+else:
+    df = pd.read_parquet(file_name, engine='fastparquet').astype(schema, errors="ignore")
+
+    if args.rules:
+        apply_rules(df, read_rules(args.rules[0]))
+    else:
+        edit_columns(df, args.r[0] if args.r else None)
 
-df.to_parquet(path=file_name, engine='fastparquet', index=False)
+    df.to_parquet(path=output_file, engine='fastparquet', index=False)
 
 if args.s:
-    send_sample_file(file_name)
+    send_sample_file(output_file)
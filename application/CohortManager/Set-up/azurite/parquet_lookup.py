@@ -0,0 +1,135 @@
+"""Finds the rows of a parquet file that match column values without reading the whole file.
+    The min and max statistics of each row group rule out the row groups that cannot hold
+    a value, and an optional sidecar index of the sorted values of a column narrows this
+    down to the row groups that do hold it. Only the matched columns of the remaining
+    row groups are read.
+    Requirements:
+        numpy
+        pyarrow"""
+
+import glob
+import os
+import sys
+
+try:
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ModuleNotFoundError:
+    sys.exit("Requirements not installed, please run 'pip install numpy pyarrow'")
+
+
+def index_path(file_name, column_name):
+    return f"{file_name}.{column_name}.index.npz"
+
+
+def indexed_columns(file_name):
+    # The columns with a sidecar index next to the file
+    prefix, suffix = index_path(file_name, '')[:-len('.index.npz')], '.index.npz'
+    return [path[len(prefix):-len(suffix)] for path in glob.glob(f"{glob.escape(prefix)}*{suffix}")]
+
+
+def file_signature(file_name):
+    stat = os.stat(file_name)
+    return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+
+def build_index(file_name, column_name):
+    """Build a sidecar index of the sorted values of a column and the row groups they are in.
+
+    Args:
+        file_name (str): The parquet file to index
+        column_name (str): The column to index
+    """
+    parquet_file = pq.ParquetFile(file_name)
+    values = []
+    row_groups = []
+    for i in range(parquet_file.num_row_groups):
+        column = parquet_file.read_row_group(i, columns=[column_name]).column(column_name)
+        column = column.filter(pc.is_valid(column))
+        values.append(column.to_numpy(zero_copy_only=False))
+        row_groups.append(np.full(len(column), i, dtype=np.int32))
+
+    values = np.concatenate(values) if values else np.empty(0)
+    if values.dtype == object:
+        # Strings are stored as a fixed width array so the index can be loaded without pickle
+        values = values.astype(str)
+    row_groups = np.concatenate(row_groups) if row_groups else np.empty(0, dtype=np.int32)
+    order = np.argsort(values, kind='stable')
+
+    with open(index_path(file_name, column_name), 'wb') as file:
+        np.savez(file, values=values[order], row_groups=row_groups[order], signature=file_signature(file_name))
+    print(f"Indexed {len(values)} {column_name} values in {index_path(file_name, column_name)}")
+
+
+def refresh_index(file_name, column_name):
+    # Patching keeps the rows in their row groups, so an index is still right after an edit
+    # that did not change the indexed column and only needs to be marked as current again
+    path = index_path(file_name, column_name)
+    if os.path.exists(path):
+        with np.load(path) as index:
+            values, row_groups = index['values'], index['row_groups']
+        with open(path, 'wb') as file:
+            np.savez(file, values=values, row_groups=row_groups, signature=file_signature(file_name))
+
+
+def indexed_row_groups(file_name, column_name, value):
+    # The row groups holding the value according to the sidecar index, or None if the
+    # column has no index or the file has changed since it was built
+    path = index_path(file_name, column_name)
+    if not os.path.exists(path):
+        return None
+
+    with np.load(path) as index:
+        if not np.array_equal(index['signature'], file_signature(file_name)):
+            print(f"Warning: {path} is out of date, rebuild it with --build-index {column_name}")
+            return None
+        values = index['values']
+        first = np.searchsorted(values, value, side='left')
+        last = np.searchsorted(values, value, side='right')
+        return set(np.unique(index['row_groups'][first:last]).tolist())
+
+
+def may_contain(statistics, value):
+    if statistics is None or not statistics.has_min_max:
+        return True
+    return statistics.min <= value <= statistics.max
+
+
+def find_matching_rows(file_name, conditions):
+    """Find the rows matching every one of a set of column values.
+
+    Args:
+        file_name (str): The parquet file to search
+        conditions (dict): The value to match for each column, already converted to the column type
+
+    Returns:
+        dict: The row indexes within each row group that match, keyed on the row group index
+    """
+    parquet_file = pq.ParquetFile(file_name)
+    metadata = parquet_file.metadata
+    column_indexes = {metadata.schema.column(i).name: i for i in range(metadata.num_columns)}
+    for column_name in conditions:
+        if column_name not in column_indexes:
+            sys.exit(f"Column {column_name} not in schema, exiting")
+
+    candidates = set(range(metadata.num_row_groups))
+    for column_name, value in conditions.items():
+        candidates = {i for i in candidates
+                      if may_contain(metadata.row_group(i).column(column_indexes[column_name]).statistics, value)}
+        indexed = indexed_row_groups(file_name, column_name, value)
+        if indexed is not None:
+            candidates &= indexed
+    print(f"Reading {len(candidates)} of {metadata.num_row_groups} row groups")
+
+    matches = {}
+    for i in sorted(candidates):
+        table = parquet_file.read_row_group(i, columns=list(conditions))
+        mask = pa.array(np.ones(table.num_rows, dtype=bool))
+        for column_name, value in conditions.items():
+            mask = pc.and_(mask, pc.fill_null(pc.equal(table.column(column_name), value), False))
+        rows = pc.indices_nonzero(mask).to_numpy()
+        if len(rows):
+            matches[i] = rows
+    return matches
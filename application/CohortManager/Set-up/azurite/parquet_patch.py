@@ -0,0 +1,424 @@
+"""Patches single row groups of a parquet file without rewriting the rest of the file.
+    Only the row groups being edited are decoded and encoded again, with the same writer that
+    wrote the file, pyarrow or fastparquet, so every row group keeps the same physical layout.
+    Every other row group is either left where it is, when the file is patched in place, or
+    copied byte for byte as raw column chunks, when the patched file is written somewhere else.
+    The patched row groups are read back with both pyarrow and fastparquet before the patched
+    file is kept.
+    Requirements:
+        fastparquet
+        pyarrow"""
+
+import io
+import os
+import struct
+import sys
+import tempfile
+
+try:
+    import fastparquet
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ModuleNotFoundError:
+    sys.exit("Requirements not installed, please run 'pip install fastparquet pyarrow'")
+
+MAGIC = b'PAR1'
+
+# Parquet compression codec numbers and the pyarrow names used to encode them
+CODECS = {0: 'none', 1: 'snappy', 2: 'gzip', 4: 'brotli', 5: 'lz4', 6: 'zstd', 7: 'lz4'}
+
+# The start of the created_by of the writers whose files can be patched
+PYARROW = 'parquet-cpp-arrow'
+FASTPARQUET = 'fastparquet-python'
+
+# Thrift compact protocol types, which the parquet footer is encoded with
+STOP, TRUE, FALSE, BYTE, I16, I32, I64, DOUBLE, BINARY, LIST, SET, MAP, STRUCT = range(13)
+
+# Field ids from parquet.thrift
+FILE_ROW_GROUPS, FILE_CREATED_BY = 4, 6
+GROUP_COLUMNS, GROUP_NUM_ROWS, GROUP_FILE_OFFSET, GROUP_ORDINAL = 1, 3, 5, 7
+CHUNK_FILE_OFFSET, CHUNK_META_DATA = 2, 3
+CHUNK_INDEXES = (4, 5, 6, 7)
+META_CODEC, META_TOTAL_COMPRESSED_SIZE = 4, 7
+META_DATA_PAGE_OFFSET, META_INDEX_PAGE_OFFSET, META_DICTIONARY_PAGE_OFFSET = 9, 10, 11
+META_BLOOM_FILTER = (14, 15)
+
+
+class ThriftReader:
+    """Reads thrift compact protocol structs as dicts of field id to (type, value)"""
+
+    def __init__(self, data):
+        self.data = data
+        self.position = 0
+
+    def byte(self):
+        value = self.data[self.position]
+        self.position += 1
+        return value
+
+    def varint(self):
+        result = shift = 0
+        while True:
+            value = self.byte()
+            result |= (value & 0x7f) << shift
+            shift += 7
+            if not value & 0x80:
+                return result
+
+    def zigzag(self):
+        value = self.varint()
+        return (value >> 1) ^ -(value & 1)
+
+    def value(self, type_id):
+        if type_id in (TRUE, FALSE):
+            # Booleans in lists and maps take a byte each
+            return self.byte() == TRUE
+        if type_id == BYTE:
+            return self.byte()
+        if type_id in (I16, I32, I64):
+            return self.zigzag()
+        if type_id == DOUBLE:
+            self.position += 8
+            return struct.unpack_from('<d', self.data, self.position - 8)[0]
+        if type_id == BINARY:
+            length = self.varint()
+            self.position += length
+            return bytes(self.data[self.position - length:self.position])
+        if type_id in (LIST, SET):
+            header = self.byte()
+            size = header >> 4 if header >> 4 != 15 else self.varint()
+            return header & 0x0f, [self.value(header & 0x0f) for _ in range(size)]
+        if type_id == MAP:
+            size = self.varint()
+            if not size:
+                return STOP, STOP, []
+            types = self.byte()
+            return types >> 4, types & 0x0f, [(self.value(types >> 4), self.value(types & 0x0f)) for _ in range(size)]
+        if type_id == STRUCT:
+            return self.struct()
+        sys.exit(f"Unknown thrift type {type_id} in the parquet footer")
+
+    def struct(self):
+        fields = {}
+        field_id = 0
+        while (header := self.byte()) != STOP:
+            type_id = header & 0x0f
+            field_id = field_id + (header >> 4) if header >> 4 else self.zigzag()
+            # Boolean fields carry their value in the type
+            fields[field_id] = (TRUE, type_id == TRUE) if type_id in (TRUE, FALSE) else (type_id, self.value(type_id))
+        return fields
+
+
+def write_varint(out, value):
+    while value > 0x7f:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def write_value(out, type_id, value):
+    if type_id in (TRUE, FALSE):
+        out.append(TRUE if value else FALSE)
+    elif type_id == BYTE:
+        out.append(value & 0xff)
+    elif type_id in (I16, I32, I64):
+        write_varint(out, (value << 1) ^ (value >> 63))
+    elif type_id == DOUBLE:
+        out += struct.pack('<d', value)
+    elif type_id == BINARY:
+        write_varint(out, len(value))
+        out += value
+    elif type_id in (LIST, SET):
+        element_type, items = value
+        if len(items) < 15:
+            out.append(len(items) << 4 | element_type)
+        else:
+            out.append(0xf0 | element_type)
+            write_varint(out, len(items))
+        for item in items:
+            write_value(out, element_type, item)
+    elif type_id == MAP:
+        key_type, value_type, items = value
+        write_varint(out, len(items))
+        if items:
+            out.append(key_type << 4 | value_type)
+        for key, item in items:
+            write_value(out, key_type, key)
+            write_value(out, value_type, item)
+    elif type_id == STRUCT:
+        write_struct(out, value)
+
+
+def write_struct(out, fields):
+    last_id = 0
+    for field_id in sorted(fields):
+        type_id, value = fields[field_id]
+        if type_id in (TRUE, FALSE):
+            type_id = TRUE if value else FALSE
+        if 0 < field_id - last_id <= 15:
+            out.append((field_id - last_id) << 4 | type_id)
+        else:
+            out.append(type_id)
+            write_varint(out, (field_id << 1) ^ (field_id >> 15))
+        if type_id not in (TRUE, FALSE):
+            write_value(out, type_id, value)
+        last_id = field_id
+    out.append(STOP)
+
+
+def get_field(fields, field_id, default=None):
+    return fields[field_id][1] if field_id in fields else default
+
+
+def set_field(fields, field_id, type_id, value):
+    fields[field_id] = (type_id, value)
+
+
+def row_groups_of(file_metadata):
+    # The list of row group structs, which can be changed in place
+    return get_field(file_metadata, FILE_ROW_GROUPS, (STRUCT, []))[1]
+
+
+def columns_of(row_group):
+    return get_field(row_group, GROUP_COLUMNS)[1]
+
+
+def created_by(file_metadata):
+    return get_field(file_metadata, FILE_CREATED_BY, b'').decode('utf-8', errors='replace')
+
+
+def row_group_starts(file_metadata):
+    # The index of the first row of each row group, followed by the total number of rows
+    starts = [0]
+    for row_group in row_groups_of(file_metadata):
+        starts.append(starts[-1] + get_field(row_group, GROUP_NUM_ROWS))
+    return starts
+
+
+def find_row_group(file_metadata, row):
+    starts = row_group_starts(file_metadata)
+    if not 0 <= row < starts[-1]:
+        sys.exit(f"Row {row} is not in the file, it has {starts[-1]} rows")
+    for i in range(len(starts) - 1):
+        if row < starts[i + 1]:
+            return i, row - starts[i]
+
+
+def check_writer(file_name, file_metadata=None):
+    """Exit unless the file was written by a writer its row groups can be encoded with again,
+    returning the writer"""
+    if file_metadata is None:
+        with open(file_name, 'rb') as file:
+            file_metadata, _ = read_footer(file)
+    writer = created_by(file_metadata)
+    if not writer.startswith((PYARROW, FASTPARQUET)):
+        sys.exit(f"{file_name} was written by {writer or 'an unknown writer'}, only files written by pyarrow or "
+                 "fastparquet can be patched. Edit it once without selecting rows or patching, which rewrites it "
+                 "with fastparquet, and then patch it")
+    return writer
+
+
+def chunk_range(column):
+    meta_data = get_field(column, CHUNK_META_DATA)
+    start = get_field(meta_data, META_DICTIONARY_PAGE_OFFSET) or get_field(meta_data, META_DATA_PAGE_OFFSET)
+    return start, get_field(meta_data, META_TOTAL_COMPRESSED_SIZE)
+
+
+def relocate_column(column, shift):
+    # Page indexes and bloom filters are not moved with the column chunks, so their
+    # offsets are dropped
+    meta_data = get_field(column, CHUNK_META_DATA)
+    for field_id in (META_DATA_PAGE_OFFSET, META_INDEX_PAGE_OFFSET, META_DICTIONARY_PAGE_OFFSET):
+        if get_field(meta_data, field_id):
+            set_field(meta_data, field_id, I64, get_field(meta_data, field_id) + shift)
+    for field_id in META_BLOOM_FILTER:
+        meta_data.pop(field_id, None)
+    if get_field(column, CHUNK_FILE_OFFSET):
+        set_field(column, CHUNK_FILE_OFFSET, I64, get_field(column, CHUNK_FILE_OFFSET) + shift)
+    for field_id in CHUNK_INDEXES:
+        column.pop(field_id, None)
+
+
+def relocate(row_group, new_start):
+    # Move every column chunk of a contiguous row group so the first one starts at new_start
+    shift = new_start - min(chunk_range(column)[0] for column in columns_of(row_group))
+    for column in columns_of(row_group):
+        relocate_column(column, shift)
+    set_field(row_group, GROUP_FILE_OFFSET, I64, new_start)
+
+
+def copy_row_group(source, destination, row_group):
+    # Copy the column chunks of a row group as raw bytes and point the metadata at the copy
+    set_field(row_group, GROUP_FILE_OFFSET, I64, destination.tell())
+    for column in sorted(columns_of(row_group), key=lambda column: chunk_range(column)[0]):
+        start, length = chunk_range(column)
+        shift = destination.tell() - start
+        source.seek(start)
+        copied = 0
+        while copied < length:
+            data = source.read(min(length - copied, 16 * 1024 * 1024))
+            if not data:
+                sys.exit("The parquet file ended in the middle of a column chunk")
+            destination.write(data)
+            copied += len(data)
+        relocate_column(column, shift)
+
+
+def read_footer(file):
+    file.seek(-8, os.SEEK_END)
+    footer_length, magic = struct.unpack('<i4s', file.read(8))
+    if magic != MAGIC:
+        sys.exit("Not a parquet file, or the file is encrypted")
+    footer_start = file.seek(-8 - footer_length, os.SEEK_END)
+    return ThriftReader(file.read(footer_length)).struct(), footer_start
+
+
+def write_footer(file, file_metadata):
+    footer = bytearray()
+    write_struct(footer, file_metadata)
+    file.write(footer)
+    file.write(struct.pack('<i', len(footer)))
+    file.write(MAGIC)
+
+
+def encode_row_group(df, writer, arrow_schema, compression):
+    # Encode the edited rows as a single row group file with the writer of the file being
+    # patched, and return the bytes of the file
+    if writer.startswith(FASTPARQUET):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'row_group.parquet')
+            fastparquet.write(path, df, compression=None if compression == 'none' else compression.upper(),
+                              row_group_offsets=[0], write_index=False)
+            with open(path, 'rb') as file:
+                return file.read()
+
+    buffer = io.BytesIO()
+    table = pa.Table.from_pandas(df, schema=arrow_schema, preserve_index=False)
+    pq.write_table(table, buffer, compression=compression, row_group_size=max(len(df), 1))
+    return buffer.getvalue()
+
+
+def split_row_group(encoded, schema):
+    # The row group metadata and the bytes of the column chunks of a single row group file,
+    # which must have the same physical schema as the file being patched
+    if not pq.ParquetFile(io.BytesIO(encoded)).schema.equals(schema):
+        sys.exit("The edited rows cannot be encoded with the same physical schema as the file, "
+                 "edit it without selecting rows or patching instead")
+    buffer = io.BytesIO(encoded)
+    file_metadata, footer_start = read_footer(buffer)
+    return row_groups_of(file_metadata)[0], encoded[len(MAGIC):footer_start]
+
+
+def read_row_group(file_name, writer, i):
+    # The rows of a row group, read with the writer's own library so the edited rows encode
+    # the same way as the rest of the file
+    if writer.startswith(FASTPARQUET):
+        return fastparquet.ParquetFile(file_name)[i].to_pandas()
+    return pq.ParquetFile(file_name).read_row_group(i).to_pandas()
+
+
+def check_readable(file_name, row_groups, file_metadata):
+    """Read the patched row groups back with both pyarrow and fastparquet, returning the error
+    if either cannot read them"""
+    try:
+        parquet_file = pq.ParquetFile(file_name)
+        fastparquet_file = fastparquet.ParquetFile(file_name)
+        for i in row_groups:
+            expected = get_field(row_groups_of(file_metadata)[i], GROUP_NUM_ROWS)
+            for engine, rows in [('pyarrow', parquet_file.read_row_group(i).num_rows),
+                                 ('fastparquet', len(fastparquet_file[i].to_pandas()))]:
+                if rows != expected:
+                    return f"{engine} read {rows} rows from row group {i} instead of {expected}"
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
+    return None
+
+
+def patch_row_groups(file_name, edit, row_groups, output_file=None):
+    """Decode, edit and re-encode some row groups of a parquet file.
+
+    Args:
+        file_name (str): The parquet file to patch
+        edit (callable): Called with the index of each row group and its rows as a DataFrame, and
+            returns the edited DataFrame, which must have the same number of rows
+        row_groups (list): The indexes of the row groups to edit
+        output_file (str, optional): Where to write the patched file. Defaults to patching
+            file_name in place
+    """
+    with open(file_name, 'rb') as file:
+        file_metadata, _ = read_footer(file)
+    writer = check_writer(file_name, file_metadata)
+    groups = row_groups_of(file_metadata)
+    compression = CODECS.get(get_field(get_field(columns_of(groups[0])[0], CHUNK_META_DATA), META_CODEC), 'snappy') if groups else 'snappy'
+
+    parquet_file = pq.ParquetFile(file_name)
+    patched = {}
+    for i in sorted(set(row_groups)):
+        num_rows = get_field(groups[i], GROUP_NUM_ROWS)
+        df = edit(i, read_row_group(file_name, writer, i))
+        if len(df) != num_rows:
+            sys.exit(f"Row group {i} changed from {num_rows} to {len(df)} rows, "
+                     "patching cannot add or remove rows")
+        patched[i] = split_row_group(encode_row_group(df, writer, parquet_file.schema_arrow, compression), parquet_file.schema)
+    parquet_file.close()
+
+    if output_file is None or os.path.abspath(output_file) == os.path.abspath(file_name):
+        patch_in_place(file_name, file_metadata, patched)
+    else:
+        patch_to_copy(file_name, output_file, file_metadata, patched)
+
+
+def patch_in_place(file_name, file_metadata, patched):
+    # Append the new row groups and a new footer to the end of the file. The old column
+    # chunks and footer stay in the file but are no longer referenced, so nothing else moves
+    original_size = os.path.getsize(file_name)
+    with open(file_name, 'r+b') as file:
+        try:
+            file.seek(0, os.SEEK_END)
+            row_groups = row_groups_of(file_metadata)
+            for i, (row_group, chunks) in patched.items():
+                relocate(row_group, file.tell())
+                file.write(chunks)
+                set_field(row_group, GROUP_ORDINAL, I16, i)
+                row_groups[i] = row_group
+            write_footer(file, file_metadata)
+        except BaseException:
+            file.truncate(original_size)
+            raise
+
+    # Cutting the file back to its old size brings back the old footer
+    error = check_readable(file_name, patched, file_metadata)
+    if error:
+        with open(file_name, 'r+b') as file:
+            file.truncate(original_size)
+        sys.exit(f"The patched file could not be read back, so {file_name} has been left as it was: {error}")
+
+    growth = os.path.getsize(file_name) - original_size
+    print(f"Patched {len(patched)} row group(s) in place, the file has grown by {growth} bytes "
+          "(edit without patching to compact it)")
+
+
+def patch_to_copy(file_name, output_file, file_metadata, patched):
+    temp_file = f"{output_file}.tmp"
+    with open(file_name, 'rb') as source, open(temp_file, 'wb') as destination:
+        destination.write(MAGIC)
+        row_groups = row_groups_of(file_metadata)
+        for i, row_group in enumerate(row_groups):
+            if i in patched:
+                row_group, chunks = patched[i]
+                relocate(row_group, destination.tell())
+                destination.write(chunks)
+                set_field(row_group, GROUP_ORDINAL, I16, i)
+                row_groups[i] = row_group
+            else:
+                copy_row_group(source, destination, row_group)
+        write_footer(destination, file_metadata)
+
+    error = check_readable(temp_file, patched, file_metadata)
+    if error:
+        os.remove(temp_file)
+        sys.exit(f"The patched file could not be read back, so {output_file} has not been written: {error}")
+    os.replace(temp_file, output_file)
+
+    print(f"Patched {len(patched)} row group(s), copied {len(row_groups) - len(patched)} "
+          f"row group(s) unchanged to {output_file}")
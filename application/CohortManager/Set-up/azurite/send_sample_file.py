@@ -1,66 +1,182 @@
 """A simple scipt to send sample files to azurite
+    Files are uploaded in blocks, several at a time, and files that are already in the
+    container with the same content MD5 are skipped.
     Requirements:
         python-dotenv
         azure-storage-blob"""
 
 try:
-    import sys
+    import argparse
+    import base64
+    import hashlib
     import os
-    from azure.storage.blob import BlobServiceClient
+    import sys
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+    from azure.core.exceptions import ResourceNotFoundError
+    from azure.storage.blob import BlobBlock, BlobServiceClient, ContentSettings
     from dotenv  import load_dotenv
 except ModuleNotFoundError:
     sys.exit("Requirements not installed, please run 'pip install azure-storage-blob python-dotenv'")
 
-def send_sample_file(sample_file):
+SAMPLE_FILES = {
+    "1": "BSS_20241201121212_n1.parquet",
+    "10": "BSS_20240601121212_n10.csv",
+    "100": "BSS_20240628191800_n100.csv",
+}
+
+BLOCK_SIZE = 8 * 1024 * 1024
+MAX_CONCURRENCY = 4
+
+
+def get_connection_string():
     try:
         load_dotenv(dotenv_path="../../.env")
         connection_string = os.getenv('AZURITE_CONNECTION_STRING')
-        connection_string = connection_string.replace('azurite', 'localhost')
-        blob_service_client = BlobServiceClient.from_connection_string(connection_string)
-        print("Connected to Azurite")
+        return connection_string.replace('azurite', 'localhost')
     except FileNotFoundError:
         sys.exit(".env file not found, please follow the instructions in the docs to create one.")
+    except AttributeError:
+        sys.exit("Could not find the azurite connection string in the .env file, please make sure you have the correct one")
+
+
+def connect():
+    try:
+        blob_service_client = BlobServiceClient.from_connection_string(get_connection_string())
+        print("Connected to Azurite")
     except ValueError:
         sys.exit("Could not find the azurite connection string in the .env file, please make sure you have the correct one")
+    return blob_service_client
+
+
+def file_md5(sample_file):
+    md5 = hashlib.md5()
+    with open(sample_file, "rb") as data:
+        while chunk := data.read(BLOCK_SIZE):
+            md5.update(chunk)
+    return md5.digest()
 
-    inbound_client = blob_service_client.get_container_client("inbound")
-    blob_client = inbound_client.get_blob_client(sample_file)
-    print("blob client established")
 
+def existing_md5(blob_client):
     try:
+        content_md5 = blob_client.get_blob_properties().content_settings.content_md5
+    except ResourceNotFoundError:
+        return None
+    return bytes(content_md5) if content_md5 else None
+
+
+def upload_block(blob_client, sample_file, block_id, offset, length):
+    with open(sample_file, "rb") as data:
+        data.seek(offset)
+        block = data.read(length)
+    start = time.perf_counter()
+    blob_client.stage_block(block_id, block, length=len(block))
+    return time.perf_counter() - start
+
+
+def upload_file(blob_client, sample_file, content_md5, executor, block_size):
+    # Small files go up in a single request, larger ones are staged a block at a time on the
+    # executor and committed once every block is in
+    size = os.path.getsize(sample_file)
+    content_settings = ContentSettings(content_md5=bytearray(content_md5))
+
+    if size <= block_size:
+        start = time.perf_counter()
         with open(sample_file, "rb") as data:
-            blob_client.upload_blob(data, overwrite=True)
-    except FileNotFoundError:
-        sys.exit(f"File {sample_file} could not been found, please download the files from confluence and put them in the azurite directory")
+            blob_client.upload_blob(data, overwrite=True, content_settings=content_settings)
+        return [time.perf_counter() - start]
+
+    block_ids = [base64.b64encode(f"{i:08d}".encode()).decode() for i in range((size + block_size - 1) // block_size)]
+    latencies = list(executor.map(
+        lambda block: upload_block(blob_client, sample_file, block[1], block[0] * block_size, block_size),
+        enumerate(block_ids)))
+    blob_client.commit_block_list([BlobBlock(block_id=block_id) for block_id in block_ids], content_settings=content_settings)
+    return latencies
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def send_sample_files(sample_files, container="inbound", block_size=BLOCK_SIZE, max_concurrency=MAX_CONCURRENCY,
+                      force=False, blob_service_client=None):
+    """Upload files to a container, skipping any that are already there with the same content.
+
+    Args:
+        sample_files (list): Paths of the files to upload, each is uploaded under the path it is given
+        container (str): The container to upload to
+        block_size (int): The size of each block of a file uploaded in blocks
+        max_concurrency (int): The number of blocks uploaded at the same time
+        force (bool): Upload files even when they are unchanged
+        blob_service_client (BlobServiceClient, optional): The client to use, defaults to connecting
+            to Azurite with the connection string in the .env file
+    """
+    blob_service_client = blob_service_client or connect()
+    container_client = blob_service_client.get_container_client(container)
+    print("blob client established")
+
+    uploaded = skipped = total_size = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        for sample_file in sample_files:
+            if not os.path.isfile(sample_file):
+                sys.exit(f"File {sample_file} could not been found, please download the files from confluence and put them in the azurite directory")
+
+            blob_client = container_client.get_blob_client(sample_file)
+            content_md5 = file_md5(sample_file)
+            if not force and existing_md5(blob_client) == content_md5:
+                print(f"{sample_file} is unchanged, skipping")
+                skipped += 1
+                continue
+
+            size = os.path.getsize(sample_file)
+            file_start = time.perf_counter()
+            latencies = upload_file(blob_client, sample_file, content_md5, executor, block_size)
+            elapsed = max(time.perf_counter() - file_start, 1e-6)
+
+            print(f"{sample_file} uploaded: {size / 1024 / 1024:.2f} MB in {elapsed:.2f}s "
+                  f"({size / 1024 / 1024 / elapsed:.2f} MB/s), {len(latencies)} block(s), block latency "
+                  f"p50 {percentile(latencies, 0.5) * 1000:.0f}ms p95 {percentile(latencies, 0.95) * 1000:.0f}ms "
+                  f"max {max(latencies) * 1000:.0f}ms")
+            uploaded += 1
+            total_size += size
+
+    elapsed = max(time.perf_counter() - start, 1e-6)
+    print(f"Uploaded {uploaded} file(s), skipped {skipped} unchanged file(s), "
+          f"{total_size / 1024 / 1024:.2f} MB in {elapsed:.2f}s ({total_size / 1024 / 1024 / elapsed:.2f} MB/s)")
+
+
+def send_sample_file(sample_file):
+    send_sample_files([sample_file])
 
-    print("Sample file uploaded")
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("""Description:
-        A script to send sample files to azurite
-    Usage:
-        python send-sample-file.py file
-    Arguments:
-        file  The file to be sent to azurite
-    Options:
-        1  The BSS_20241201121212_n1.parquet sample file
-        10  The BSS_20240601121212_n10.csv sample file
-        100  The BSS_20240628191800_n100.csv sample file
-        <other file> Any argument not in the list above will be treated as a path to a custom file
-    Examples:
-        python send-sample-file.py 100
-        python send-sample-file.py custom-file.csv""")
+    parser = argparse.ArgumentParser(description='A script to send sample files to azurite',
+                                     formatter_class=argparse.RawTextHelpFormatter,
+                                     epilog="""Options:
+    1  The BSS_20241201121212_n1.parquet sample file
+    10  The BSS_20240601121212_n10.csv sample file
+    100  The BSS_20240628191800_n100.csv sample file
+    <other file> Any argument not in the list above will be treated as a path to a custom file
+Examples:
+    python send_sample_file.py 100
+    python send_sample_file.py custom-file.csv
+    python send_sample_file.py cohort-1.parquet cohort-2.parquet --block-size 16 --max-concurrency 8""")
+
+    parser.add_argument('files', nargs='+', help='The file(s) to be sent to azurite')
+    parser.add_argument('--container', default='inbound', help='The container to send the files to (default: inbound)')
+    parser.add_argument('--block-size', type=int, default=BLOCK_SIZE // 1024 // 1024, help=f'Block size in MB (default: {BLOCK_SIZE // 1024 // 1024})')
+    parser.add_argument('--max-concurrency', type=int, default=MAX_CONCURRENCY, help=f'Blocks uploaded at the same time (default: {MAX_CONCURRENCY})')
+    parser.add_argument('--force', action='store_true', help='(OPTIONAL) Upload files even when the blob already has the same content')
+
+    if len(sys.argv) == 1:
+        parser.print_help()
         sys.exit()
-    elif len(sys.argv) > 2:
-        sys.exit("This script accepts only one argument, run the command with no arguments to view the help page")
-    elif sys.argv[1] == "1":
-        sample_file = "BSS_20241201121212_n1.parquet"
-    elif sys.argv[1] == "10":
-        sample_file = "BSS_20240601121212_n10.csv"
-    elif sys.argv[1] == "100":
-        sample_file = "BSS_20240628191800_n100.csv"
-    else:
-        sample_file = sys.argv[1]
-
-    send_sample_file(sample_file)
+
+    args = parser.parse_args()
+    send_sample_files([SAMPLE_FILES.get(file, file) for file in args.files],
+                      container=args.container,
+                      block_size=args.block_size * 1024 * 1024,
+                      max_concurrency=args.max_concurrency,
+                      force=args.force)
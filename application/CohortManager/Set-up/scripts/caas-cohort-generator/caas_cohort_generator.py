@@ -0,0 +1,293 @@
+# caas_cohort_generator.py
+#
+# Generates synthetic CAAS cohort parquet files for load testing receiveCaasFile.
+#
+# Every column is generated with vectorised NumPy and pyarrow operations, one row group
+# at a time. Row groups are generated in parallel on a thread pool and written in order,
+# each from its own random stream derived from the seed. Dates are counted back from a
+# fixed reference date rather than today, so the same seed and reference date always give
+# the same file whatever the number of workers or the day it is run.
+#
+# The data is drawn from the reference data the database is seeded with:
+#   - GP practice codes from BS_SELECT_GP_PRACTICE_LKP
+#   - postcode outcodes from BS_SELECT_OUTCODE_MAPPING_LKP
+#   - current postings from CURRENT_POSTING_LKP
+#   - language codes from LANGUAGE_CODES
+# NHS numbers are unique and have valid Modulus 11 check digits, apart from rows that are
+# deliberately made invalid with --invalid-rate.
+#
+# Run with -h to see the options.
+
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from caas_cohort_schema import SCHEMA
+
+
+seed_data_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                   '..', '..', '..', 'src', 'Functions', 'Shared', 'DataServices.Migrations', 'SeedData')
+
+given_names = ['Olivia', 'Amelia', 'Isla', 'Ava', 'Mia', 'Ivy', 'Lily', 'Isabella', 'Rosie', 'Sophia',
+               'Grace', 'Freya', 'Florence', 'Willow', 'Emily', 'Ella', 'Poppy', 'Evie', 'Elsie', 'Charlotte',
+               'Margaret', 'Susan', 'Patricia', 'Linda', 'Elizabeth', 'Barbara', 'Karen', 'Sarah', 'Helen', 'Janet',
+               'Oliver', 'George', 'Noah', 'Arthur', 'Harry', 'Leo', 'Muhammad', 'Jack', 'Charlie', 'Oscar']
+family_names = ['Smith', 'Jones', 'Taylor', 'Brown', 'Williams', 'Wilson', 'Johnson', 'Davies', 'Patel', 'Robinson',
+                'Wright', 'Thompson', 'Evans', 'Walker', 'White', 'Roberts', 'Green', 'Hall', 'Thomas', 'Clarke',
+                'Jackson', 'Wood', 'Harris', 'Edwards', 'Turner', 'Martin', 'Cooper', 'Hill', 'Ward', 'Hughes',
+                'Moore', 'Clark', 'King', 'Harrison', 'Lewis', 'Baker', 'Lee', 'Allen', 'Morris', 'Khan']
+name_prefixes = ['MRS', 'MS', 'MISS', 'DR', 'MR']
+street_names = ['High Street', 'Station Road', 'Main Street', 'Park Road', 'Church Road', 'Church Street',
+                'London Road', 'Victoria Road', 'Green Lane', 'Manor Road', 'Church Lane', 'Park Avenue',
+                'The Avenue', 'The Crescent', 'Queens Road', 'New Road', 'Grange Road', 'Kings Road']
+towns = ['Leeds', 'Manchester', 'Birmingham', 'Bristol', 'Sheffield', 'Liverpool', 'Newcastle', 'Nottingham',
+         'Leicester', 'Coventry', 'Bradford', 'Plymouth', 'Reading', 'Derby', 'Norwich', 'Exeter', 'York', 'Bath']
+
+# Letters that can appear in the inward part of a postcode
+inward_letters = list('ABDEFGHJLNPQRSTUWXYZ')
+alphanumeric = list('ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789')
+
+# The date that generated dates are counted back from, see --reference-date
+REFERENCE_DATE = '20260101'
+
+
+def load_reference_data():
+    def load(file_name):
+        with open(os.path.join(seed_data_directory, file_name), 'r') as file:
+            return json.load(file)
+
+    return {
+        'gp_practices': [row['GpPracticeCode'] for row in load('BsSelectGpPractice.json')],
+        'outcodes': [row['Outcode'] for row in load('BsSelectOutCode.json')],
+        'postings': [row['Posting'] for row in load('CurrentPosting.json')
+                     if row['InUse'] == 'Y' and row['IncludedInCohort'] == 'Y'],
+        'languages': [row['LanguageCodeId'] for row in load('LanguageCode.json')],
+    }
+
+
+def check_digits(bases):
+    # Modulus 11 check digit of each 9 digit base, 10 marks a base with no valid check digit
+    digits = (bases[:, None] // 10 ** np.arange(8, -1, -1, dtype=np.int64)) % 10
+    check = 11 - (digits @ np.arange(10, 1, -1, dtype=np.int64)) % 11
+    check[check == 11] = 0
+    return check
+
+
+def nhs_numbers(first_row, rows):
+    # Each row group draws from its own block of bases, twice its size, so numbers never
+    # repeat across row groups and there are always enough bases with a valid check digit
+    bases = np.arange(900_000_000 + 2 * first_row, 900_000_000 + 2 * (first_row + rows), dtype=np.int64)
+    check = check_digits(bases)
+    valid = check != 10
+    return (bases[valid] * 10 + check[valid])[:rows]
+
+
+def choice(rng, values, rows, p=None):
+    return pa.array(values).take(pa.array(rng.choice(len(values), size=rows, p=p)))
+
+
+def digits(rng, rows, width):
+    return pc.utf8_lpad(pc.cast(pa.array(rng.integers(0, 10 ** width, size=rows)), pa.string()), width, padding='0')
+
+
+def characters(rng, alphabet, rows, width):
+    codes = np.frombuffer(''.join(alphabet).encode('ascii'), dtype=np.uint8)
+    return pa.array(codes[rng.integers(0, len(codes), size=(rows, width))].view(f'S{width}').ravel()).cast(pa.string())
+
+
+def dates(rng, rows, oldest_days, newest_days, reference_date):
+    # Dates between oldest_days and newest_days before the reference date, as YYYYMMDD strings
+    days = reference_date - rng.integers(newest_days, oldest_days, size=rows).astype('timedelta64[D]')
+
+    # Build the dates as YYYYMMDD numbers, which is much faster than strftime
+    years = days.astype('datetime64[Y]')
+    months = days.astype('datetime64[M]')
+    number = ((years.astype(np.int64) + 1970) * 10000
+              + (months - years).astype(np.int64) * 100 + 100
+              + (days - months).astype(np.int64) + 1)
+    return pc.cast(pa.array(number), pa.string())
+
+
+def with_nulls(rng, values, rate):
+    return pc.if_else(pa.array(rng.random(len(values)) < rate), pa.scalar(None, values.type), values)
+
+
+def join(*parts, separator=''):
+    return pc.binary_join_element_wise(*parts, separator)
+
+
+def make_invalid(rng, columns, invalid, rows):
+    # Give each invalid row one of the problems receiveCaasFile and the validation rules reject
+    problem = np.where(invalid, rng.integers(1, 6, size=rows), 0)
+
+    nhs_number = columns['nhs_number'].to_numpy()
+    last_digit = nhs_number % 10
+    columns['nhs_number'] = pa.array(np.where(problem == 1, nhs_number - last_digit + (last_digit + 1) % 10, nhs_number))
+    columns['postcode'] = pc.if_else(pa.array(problem == 2), pa.scalar('INVALID'), columns['postcode'])
+    columns['family_name'] = pc.if_else(pa.array(problem == 3), pa.scalar(None, pa.string()), columns['family_name'])
+    columns['date_of_birth'] = pc.if_else(pa.array(problem == 4), pa.scalar('21000101'), columns['date_of_birth'])
+    columns['gender'] = pc.if_else(pa.array(problem == 5), pa.scalar(7), columns['gender'])
+
+
+def generate_row_group(seed, first_row, rows, reference_data, amend_rate, delete_rate, invalid_rate, reference_date):
+    rng = np.random.default_rng(seed)
+
+    given_name = choice(rng, given_names, rows)
+    family_name = choice(rng, family_names, rows)
+    record_type = choice(rng, ['ADD', 'AMENDED', 'DEL'], rows, p=[1 - amend_rate - delete_rate, amend_rate, delete_rate])
+    is_deleted = pc.equal(record_type, 'DEL')
+
+    columns = {
+        'record_type': record_type,
+        'change_time_stamp': pa.nulls(rows, pa.int64()),
+        'serial_change_number': pa.array(np.arange(first_row + 1, first_row + rows + 1, dtype=np.int64)),
+        'nhs_number': pa.array(rng.permutation(nhs_numbers(first_row, rows))),
+        'superseded_by_nhs_number': pa.nulls(rows, pa.int64()),
+        'primary_care_provider': choice(rng, reference_data['gp_practices'], rows),
+        'primary_care_effective_from_date': dates(rng, rows, 30 * 365, 30, reference_date),
+        'current_posting': choice(rng, reference_data['postings'], rows),
+        'current_posting_effective_from_date': dates(rng, rows, 30 * 365, 30, reference_date),
+        'name_prefix': with_nulls(rng, choice(rng, name_prefixes, rows, p=[0.45, 0.25, 0.15, 0.05, 0.1]), 0.2),
+        'given_name': given_name,
+        'other_given_name': with_nulls(rng, choice(rng, given_names, rows), 0.6),
+        'family_name': family_name,
+        'previous_family_name': with_nulls(rng, choice(rng, family_names, rows), 0.8),
+        # Ages 50 to 71, the breast screening age range
+        'date_of_birth': dates(rng, rows, 71 * 365, 50 * 365, reference_date),
+        'gender': pa.array(rng.choice([2, 1, 9, 0], size=rows, p=[0.95, 0.04, 0.005, 0.005])),
+        'address_line_1': join(pc.cast(pa.array(rng.integers(1, 300, size=rows)), pa.string()),
+                               choice(rng, street_names, rows), separator=' '),
+        'address_line_2': with_nulls(rng, choice(rng, towns, rows), 0.3),
+        'address_line_3': pa.nulls(rows, pa.string()),
+        'address_line_4': choice(rng, towns, rows),
+        'address_line_5': with_nulls(rng, choice(rng, ['United Kingdom'], rows), 0.5),
+        'postcode': join(choice(rng, reference_data['outcodes'], rows),
+                         join(digits(rng, rows, 1), characters(rng, inward_letters, rows, 2)), separator=' '),
+        'paf_key': characters(rng, alphanumeric, rows, 8),
+        'address_effective_from_date': dates(rng, rows, 30 * 365, 30, reference_date),
+        'reason_for_removal': pc.if_else(is_deleted, pa.scalar('D'), pa.scalar(None, pa.string())),
+        'reason_for_removal_effective_from_date': pc.if_else(is_deleted, dates(rng, rows, 365, 1, reference_date), pa.scalar(None, pa.string())),
+        'date_of_death': pa.nulls(rows, pa.string()),
+        'death_status': pa.nulls(rows, pa.int32()),
+        'home_telephone_number': with_nulls(rng, join(pa.scalar('01'), digits(rng, rows, 9)), 0.4),
+        'home_telephone_effective_from_date': dates(rng, rows, 10 * 365, 30, reference_date),
+        'mobile_telephone_number': with_nulls(rng, join(pa.scalar('07'), digits(rng, rows, 9)), 0.2),
+        'mobile_telephone_effective_from_date': dates(rng, rows, 10 * 365, 30, reference_date),
+        'email_address': with_nulls(rng, pc.utf8_lower(join(given_name, pa.scalar('.'), family_name,
+                                                            digits(rng, rows, 3), pa.scalar('@example.com'))), 0.3),
+        'email_address_effective_from_date': dates(rng, rows, 10 * 365, 30, reference_date),
+        'preferred_language': pc.if_else(pa.array(rng.random(rows) < 0.95), pa.scalar('en'),
+                                         choice(rng, reference_data['languages'], rows)),
+        'is_interpreter_required': pa.array(rng.random(rows) < 0.02),
+        'invalid_flag': pa.array(np.zeros(rows, dtype=bool)),
+        'eligibility': pa.array(np.ones(rows, dtype=bool)),
+    }
+
+    make_invalid(rng, columns, rng.random(rows) < invalid_rate, rows)
+
+    return pa.table(columns).cast(SCHEMA)
+
+
+def generate_cohort(parquet_file, rows, row_group_size=100_000, seed=0, amend_rate=0.0, delete_rate=0.0,
+                    invalid_rate=0.0, workers=None, compression='snappy', first_row=0, reference_date=REFERENCE_DATE):
+    # NHS numbers are drawn from 900000000x upwards, two bases per row
+    if 2 * (first_row + rows) > 100_000_000:
+        sys.exit("Cannot generate more than 50,000,000 rows of unique NHS numbers")
+
+    reference_data = load_reference_data()
+    reference_date = np.datetime64(datetime.strptime(reference_date, '%Y%m%d').date(), 'D')
+    last_row = first_row + rows
+    row_groups = [(start, min(row_group_size, last_row - start)) for start in range(first_row, last_row, row_group_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(row_groups))
+    workers = workers or os.cpu_count()
+
+    start = time.perf_counter()
+    written = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor, \
+            pq.ParquetWriter(parquet_file, SCHEMA, compression=compression) as parquet_writer:
+        # Only keep a few row groups ahead of the writer, so memory use stays bounded
+        pending = deque()
+        for (first_row, group_rows), group_seed in zip(row_groups, seeds):
+            pending.append(executor.submit(generate_row_group, group_seed, first_row, group_rows, reference_data,
+                                           amend_rate, delete_rate, invalid_rate, reference_date))
+            if len(pending) >= workers * 2:
+                written += write_row_group(parquet_writer, pending.popleft().result(), written, rows)
+        while pending:
+            written += write_row_group(parquet_writer, pending.popleft().result(), written, rows)
+
+    elapsed = time.perf_counter() - start
+    size = os.path.getsize(parquet_file)
+    print(f"Wrote {written} rows to {parquet_file} in {elapsed:.2f}s ({written / elapsed:,.0f} rows/s), "
+          f"{size / 1024 / 1024:.2f} MB")
+
+
+def write_row_group(parquet_writer, table, written, rows):
+    parquet_writer.write_table(table, row_group_size=table.num_rows)
+    print(f"Row group - {written + table.num_rows}/{rows} rows")
+    return table.num_rows
+
+
+def date(value):
+    try:
+        datetime.strptime(value, '%Y%m%d')
+    except ValueError:
+        raise argparse.ArgumentTypeError("must be a date in YYYYMMDD format")
+    return value
+
+
+def rate(value):
+    value = float(value)
+    if not 0 <= value <= 1:
+        raise argparse.ArgumentTypeError("must be between 0 and 1")
+    return value
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Generate a synthetic CAAS cohort parquet file for load testing',
+                                     formatter_class=argparse.RawTextHelpFormatter,
+                                     epilog="""Examples:
+    python caas_cohort_generator.py 1000000
+    python caas_cohort_generator.py 5000000 --seed 42 --amend-rate 0.1 --delete-rate 0.01 --invalid-rate 0.005
+    python caas_cohort_generator.py 1000000 --first-row 1000000""")
+
+    parser.add_argument('rows', type=int, help='The number of rows to generate')
+    parser.add_argument('-o', '--output', help='(OPTIONAL) The output filename (default: a CAAS breast screening cohort filename for the current time)')
+    parser.add_argument('--first-row', type=int, default=0, help='Rows generated in earlier files, so files with different first rows never share NHS numbers (default: 0)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the random data, the same seed and reference date always give the same file (default: 0)')
+    parser.add_argument('--reference-date', type=date, default=REFERENCE_DATE, help=f'Date in YYYYMMDD format that dates of birth and effective dates are counted back from (default: {REFERENCE_DATE})')
+    parser.add_argument('--amend-rate', type=rate, default=0.0, help='Fraction of rows with an AMENDED record type (default: 0)')
+    parser.add_argument('--delete-rate', type=rate, default=0.0, help='Fraction of rows with a DEL record type (default: 0)')
+    parser.add_argument('--invalid-rate', type=rate, default=0.0, help='Fraction of rows given an invalid NHS number, postcode, family name, date of birth or gender (default: 0)')
+    parser.add_argument('--row-group-size', type=int, default=100_000, help='Rows per row group (default: 100000)')
+    parser.add_argument('--workers', type=int, help='(OPTIONAL) Row groups to generate in parallel (default: number of CPUs)')
+    parser.add_argument('--compression', choices=['snappy', 'zstd', 'lz4', 'gzip', 'none'], default='snappy', help='Compression codec (default: snappy)')
+
+    args = parser.parse_args()
+    if args.amend_rate + args.delete_rate > 1:
+        parser.error("--amend-rate and --delete-rate cannot add up to more than 1")
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    output = args.output or f"{time.strftime('%Y%m%d%H%M%S')}000000_GEN{args.seed}_-_CAAS_BREAST_SCREENING_COHORT.parquet"
+    generate_cohort(output, args.rows,
+                    row_group_size=args.row_group_size,
+                    seed=args.seed,
+                    amend_rate=args.amend_rate,
+                    delete_rate=args.delete_rate,
+                    invalid_rate=args.invalid_rate,
+                    workers=args.workers,
+                    compression=args.compression,
+                    first_row=args.first_row,
+                    reference_date=args.reference_date)
@@ -0,0 +1,71 @@
+"""The schema of the CAAS cohort parquet files read by receiveCaasFile.
+    Shared by the scripts that create and edit sample cohort files, so the column names
+    and types are only defined once.
+    Requirements:
+        pyarrow"""
+
+import pyarrow as pa
+
+# CSV header, parquet column name and type of each column, in file order
+COLUMNS = [
+    ('Record Type', 'record_type', pa.string()),
+    ('Change Time Stamp', 'change_time_stamp', pa.int64()),
+    ('Serial Change Number', 'serial_change_number', pa.int64()),
+    ('NHS Number', 'nhs_number', pa.int64()),
+    ('Superseded by NHS number', 'superseded_by_nhs_number', pa.int64()),
+    ('Primary Care Provider ', 'primary_care_provider', pa.string()),
+    ('Primary Care Provider Business Effective From Date', 'primary_care_effective_from_date', pa.string()),
+    ('Current Posting', 'current_posting', pa.string()),
+    ('Current Posting Business Effective From Date', 'current_posting_effective_from_date', pa.string()),
+    ('Name Prefix', 'name_prefix', pa.string()),
+    ('Given Name ', 'given_name', pa.string()),
+    ('Other Given Name(s) ', 'other_given_name', pa.string()),
+    ('Family Name ', 'family_name', pa.string()),
+    ('Previous Family Name ', 'previous_family_name', pa.string()),
+    ('Date of Birth', 'date_of_birth', pa.string()),
+    ('Gender', 'gender', pa.int64()),
+    ('Address line 1', 'address_line_1', pa.string()),
+    ('Address line 2', 'address_line_2', pa.string()),
+    ('Address line 3', 'address_line_3', pa.string()),
+    ('Address line 4', 'address_line_4', pa.string()),
+    ('Address line 5', 'address_line_5', pa.string()),
+    ('Postcode', 'postcode', pa.string()),
+    ('PAF key', 'paf_key', pa.string()),
+    ('Usual Address Business Effective From Date', 'address_effective_from_date', pa.string()),
+    ('Reason for Removal', 'reason_for_removal', pa.string()),
+    ('Reason for Removal Business Effective From Date', 'reason_for_removal_effective_from_date', pa.string()),
+    ('Date of Death', 'date_of_death', pa.string()),
+    ('Death Status', 'death_status', pa.int32()),
+    ('Telephone Number (Home)', 'home_telephone_number', pa.string()),
+    ('Telephone Number (Home) Business Effective From Date', 'home_telephone_effective_from_date', pa.string()),
+    ('Telephone Number (Mobile)', 'mobile_telephone_number', pa.string()),
+    ('Telephone Number (Mobile) Business Effective From Date', 'mobile_telephone_effective_from_date', pa.string()),
+    ('E-mail address (Home)', 'email_address', pa.string()),
+    ('E-mail address (Home) Business Effective From Date', 'email_address_effective_from_date', pa.string()),
+    ('Preferred Language', 'preferred_language', pa.string()),
+    ('Interpreter required', 'is_interpreter_required', pa.bool_()),
+    ('Invalid Flag', 'invalid_flag', pa.bool_()),
+    ('Eligibility', 'eligibility', pa.bool_()),
+]
+
+SCHEMA = pa.schema([pa.field(name, arrow_type) for _, name, arrow_type in COLUMNS])
+
+# Maps CSV headers to parquet column names
+COLUMN_NAMES = {csv_header: name for csv_header, name, _ in COLUMNS}
+
+# The pyarrow CSV reader types, keyed on both the CSV header and the parquet column name
+# as sample CSVs use either
+CSV_COLUMN_TYPES = {
+    **{csv_header: arrow_type for csv_header, _, arrow_type in COLUMNS},
+    **{name: arrow_type for _, name, arrow_type in COLUMNS},
+}
+
+_PANDAS_DTYPES = {
+    pa.string(): 'string',
+    pa.int64(): 'Int64',
+    pa.int32(): 'Int32',
+    pa.bool_(): 'boolean',
+}
+
+# The nullable pandas dtype of each parquet column
+PANDAS_DTYPES = {name: _PANDAS_DTYPES[arrow_type] for _, name, arrow_type in COLUMNS}
@@ -1,116 +1,154 @@
 # csv_to_parquet.py
+#
+# Converts a CAAS cohort CSV into a parquet file as a three stage pipeline:
+#   1. parse   - pyarrow's multithreaded CSV reader parses the file into record batches
+#   2. convert - batches are gathered into row groups, renamed and cast to the parquet schema
+#   3. encode  - row groups are encoded and compressed by the parquet writer
+# Each stage runs on its own thread and hands work to the next through a bounded queue,
+# so parsing, conversion and encoding overlap while memory use stays capped.
+#
+# The column names and types come from the shared CAAS cohort schema in
+# ../caas_cohort_schema.py. Run with -h to see the options for tuning the output file.
 
-import pandas as pd
+import argparse
+import os
+import queue
+import sys
+import threading
+import time
 import pyarrow as pa
+import pyarrow.csv as pacsv
 import pyarrow.parquet as pq
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from caas_cohort_schema import COLUMN_NAMES, CSV_COLUMN_TYPES, SCHEMA
 
-csv_file = 'template.csv'
-parquet_file = 'BSS_21241009115301_n1.parquet'
-parquet_schema = 'cohort_dtos_no_index.parquet'
-chunksize = 100_000
-
-csv_stream = pd.read_csv(csv_file, sep=',', chunksize=chunksize, low_memory=False, dtype ={
-'Record Type': 'string',
-'Change Time Stamp': 'Int64',
-'Serial Change Number': 'int64',
-'NHS Number': 'int64',
-'Superseded by NHS number': 'Int64',
-'Primary Care Provider ': 'string',
-'Primary Care Provider Business Effective From Date': 'string',
-'Current Posting': 'string',
-'Current Posting Business Effective From Date': 'string',
-'Name Prefix': 'string',
-'Given Name ': 'string',
-'Other Given Name(s) ': 'string',
-'Family Name ': 'string',
-'Previous Family Name ': 'string',
-'Date of Birth': 'string',
-'Gender': 'int64',
-'Address line 1': 'string',
-'Address line 2': 'string',
-'Address line 3': 'string',
-'Address line 4': 'string',
-'Address line 5': 'string',
-'Postcode': 'string',
-'PAF key': 'string',
-'Usual Address Business Effective From Date': 'string',
-'Reason for Removal': 'string',
-'Reason for Removal Business Effective From Date': 'string',
-'Date of Death': 'string',
-'Telephone Number (Home)': 'string',
-'Telephone Number (Home) Business Effective From Date': 'string',
-'Telephone Number (Mobile)': 'string',
-'Telephone Number (Mobile) Business Effective From Date': 'string',
-'E-mail address (Home)': 'string',
-'E-mail address (Home) Business Effective From Date': 'string',
-'Preferred Language': 'string',
-'Interpreter required': 'bool',
-'Invalid Flag': 'bool',
-'Eligibility' : 'bool',
-})
-
-
-for i, chunk in enumerate(csv_stream):
-    print("Chunk", i)
-    if i == 0:
-        schema = pa.parquet.read_schema(parquet_schema, memory_map=True)
-        schema = schema.set(4,pa.field('superseded_by_nhs_number',pa.int64()))
-        schema = schema.set(27,pa.field('death_status',pa.int32()))
-
-        pdschema = pd.DataFrame(({"column": name, "pa_dtype": str(pa_dtype)} for name, pa_dtype in zip(schema.names, schema.types)))
-        pdschema = pdschema.reindex(columns=["column", "pa_dtype"], fill_value=pd.NA)
-        print(pdschema)
-        parquet_writer = pq.ParquetWriter(parquet_file, schema, compression='snappy')
-
-    # Write CSV chunk to the parquet file
-
-    chunk = chunk.rename(columns = {
-    'Record Type': 'record_type',
-    'Change Time Stamp': 'change_time_stamp',
-    'Serial Change Number': 'serial_change_number',
-    'NHS Number': 'nhs_number',
-    'Superseded by NHS number': 'superseded_by_nhs_number',
-    'Primary Care Provider ': 'primary_care_provider',
-    'Primary Care Provider Business Effective From Date': 'primary_care_effective_from_date',
-    'Current Posting': 'current_posting',
-    'Current Posting Business Effective From Date': 'current_posting_effective_from_date',
-    'Name Prefix': 'name_prefix',
-    'Given Name ': 'given_name',
-    'Other Given Name(s) ': 'other_given_name',
-    'Family Name ': 'family_name',
-    'Previous Family Name ': 'previous_family_name',
-    'Date of Birth': 'date_of_birth',
-    'Gender': 'gender',
-    'Address line 1': 'address_line_1',
-    'Address line 2': 'address_line_2',
-    'Address line 3': 'address_line_3',
-    'Address line 4': 'address_line_4',
-    'Address line 5': 'address_line_5',
-    'Postcode': 'postcode',
-    'PAF key': 'paf_key',
-    'Usual Address Business Effective From Date': 'address_effective_from_date',
-    'Reason for Removal': 'reason_for_removal',
-    'Reason for Removal Business Effective From Date': 'reason_for_removal_effective_from_date',
-    'Date of Death': 'date_of_death',
-    'Death Status': 'death_status',
-    'Telephone Number (Home)': 'home_telephone_number',
-    'Telephone Number (Home) Business Effective From Date': 'home_telephone_effective_from_date',
-    'Telephone Number (Mobile)': 'mobile_telephone_number',
-    'Telephone Number (Mobile) Business Effective From Date': 'mobile_telephone_effective_from_date',
-    'E-mail address (Home)': 'email_address',
-    'E-mail address (Home) Business Effective From Date': 'email_address_effective_from_date',
-    'Preferred Language': 'preferred_language',
-    'Interpreter required': 'is_interpreter_required',
-    'Invalid Flag': 'invalid_flag',
-    'Eligibility':'eligibility'})
-
-    print(chunk.head())
-    chunk['primary_care_effective_from_date'] = chunk['primary_care_effective_from_date'].astype('str')
-    chunk['current_posting_effective_from_date'] = chunk['current_posting_effective_from_date'].astype('str')
-    chunk['date_of_birth'] = chunk['date_of_birth'].astype('str')
-    chunk['paf_key'] = chunk['paf_key'].astype('str')
-    table = pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
-    parquet_writer.write_table(table)
-
-parquet_writer.close()
+
+# Marks the end of the stream on a queue
+end_of_stream = object()
+
+
+def parse(output_queue, csv_file):
+    # Typing the columns up front stops pyarrow inferring them, which also keeps
+    # zero padded values such as dates and phone numbers as strings
+    convert_options = pacsv.ConvertOptions(column_types=CSV_COLUMN_TYPES, strings_can_be_null=True)
+    read_options = pacsv.ReadOptions(use_threads=True)
+
+    with pacsv.open_csv(csv_file, read_options=read_options, convert_options=convert_options) as reader:
+        for batch in reader:
+            output_queue.put(batch)
+
+
+def convert(input_queue, output_queue, row_group_size):
+    pending = SCHEMA.empty_table()
+
+    while (batch := input_queue.get()) is not end_of_stream:
+        if isinstance(batch, BaseException):
+            raise batch
+
+        table = pa.Table.from_batches([batch])
+        table = table.rename_columns([COLUMN_NAMES.get(name, name) for name in table.column_names])
+        pending = pa.concat_tables([pending, table.select(SCHEMA.names).cast(SCHEMA)])
+
+        # Hand on whole row groups, keeping any remainder for the next batch
+        while pending.num_rows >= row_group_size:
+            output_queue.put(pending.slice(0, row_group_size).combine_chunks())
+            pending = pending.slice(row_group_size)
+
+    if pending.num_rows > 0:
+        output_queue.put(pending.combine_chunks())
+
+
+def run_stage(stage, input_queue, output_queue, *args):
+    # Errors are passed down the pipeline to be raised by the writer, and the end of the
+    # stream is always passed on so a failed stage cannot leave the others waiting
+    try:
+        if input_queue is None:
+            stage(output_queue, *args)
+        else:
+            stage(input_queue, output_queue, *args)
+    except BaseException as e:
+        output_queue.put(e)
+    finally:
+        output_queue.put(end_of_stream)
+
+
+def dictionary_columns(value):
+    if value == 'all':
+        return True
+    if value == 'none':
+        return False
+
+    columns = value.split(',')
+    unknown = [column for column in columns if column not in SCHEMA.names]
+    if unknown:
+        raise argparse.ArgumentTypeError(f"Unknown column(s): {', '.join(unknown)}")
+    return columns
+
+
+def convert_csv_to_parquet(csv_file, parquet_file, row_group_size=100_000, compression='snappy',
+                           compression_level=None, use_dictionary=True, data_page_size=None, queue_size=4):
+    print(SCHEMA)
+    start = time.perf_counter()
+
+    parsed = queue.Queue(maxsize=queue_size)
+    converted = queue.Queue(maxsize=queue_size)
+
+    stages = [
+        threading.Thread(target=run_stage, args=(parse, None, parsed, csv_file), daemon=True),
+        threading.Thread(target=run_stage, args=(convert, parsed, converted, row_group_size), daemon=True),
+    ]
+    for stage in stages:
+        stage.start()
+
+    rows = 0
+    with pq.ParquetWriter(parquet_file, SCHEMA,
+                          compression=compression,
+                          compression_level=compression_level,
+                          use_dictionary=use_dictionary,
+                          data_page_size=data_page_size) as parquet_writer:
+        for i, table in enumerate(iter(converted.get, end_of_stream)):
+            if isinstance(table, BaseException):
+                raise table
+            print("Row group", i, "-", table.num_rows, "rows")
+            parquet_writer.write_table(table, row_group_size=row_group_size)
+            rows += table.num_rows
+
+    for stage in stages:
+        stage.join()
+
+    elapsed = time.perf_counter() - start
+    size = os.path.getsize(parquet_file)
+    print(f"Wrote {rows} rows to {parquet_file} in {elapsed:.2f}s ({rows / elapsed:,.0f} rows/s), "
+          f"{size / 1024 / 1024:.2f} MB, {size / max(rows, 1):.1f} bytes/row")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Convert a CAAS cohort CSV file to parquet',
+                                     formatter_class=argparse.RawTextHelpFormatter,
+                                     epilog="""Examples:
+    python csv_to_parquet.py
+    python csv_to_parquet.py cohort.csv BSS_20241201121212_n1000000.parquet --row-group-size 500000 --compression zstd
+    python csv_to_parquet.py cohort.csv out.parquet --dictionary record_type,gender,primary_care_provider""")
+
+    parser.add_argument('csv_file', nargs='?', default='template.csv', help='The CSV file to convert (default: template.csv)')
+    parser.add_argument('parquet_file', nargs='?', default='BSS_21241009115301_n1.parquet', help='The parquet file to write (default: BSS_21241009115301_n1.parquet)')
+    parser.add_argument('--row-group-size', type=int, default=100_000, help='Rows per row group (default: 100000)')
+    parser.add_argument('--compression', choices=['snappy', 'zstd', 'lz4', 'gzip', 'brotli', 'none'], default='snappy', help='Compression codec (default: snappy)')
+    parser.add_argument('--compression-level', type=int, help='(OPTIONAL) Compression level, for codecs that support one')
+    parser.add_argument('--dictionary', type=dictionary_columns, default=True, help="Columns to dictionary encode: 'all', 'none' or a comma separated list (default: all)")
+    parser.add_argument('--page-size', type=int, help='(OPTIONAL) Target data page size in bytes')
+    parser.add_argument('--queue-size', type=int, default=4, help='Row groups buffered between pipeline stages (default: 4)')
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    convert_csv_to_parquet(args.csv_file, args.parquet_file,
+                           row_group_size=args.row_group_size,
+                           compression=args.compression,
+                           compression_level=args.compression_level,
+                           use_dictionary=args.dictionary,
+                           data_page_size=args.page_size,
+                           queue_size=args.queue_size)
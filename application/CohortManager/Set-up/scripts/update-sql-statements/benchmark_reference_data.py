@@ -0,0 +1,96 @@
+# Times reading a reference data extract the old way, with the csv module and strptime for each
+# timestamp, against the columnar reader in generate_inserts.py.
+#
+# Without a file it writes an outcode mapping extract of --rows rows, a few of them with malformed
+# timestamps, and times that. Both readers produce the same rows, which is checked before timing.
+#
+# Requirements:
+#   pyarrow
+#
+# Run with -h to see the options.
+
+import argparse
+import csv
+import datetime
+import os
+import random
+import sys
+import time
+from itertools import islice
+
+from generate_inserts import TABLES, read_rows
+
+
+def write_outcode_extract(filepath, rows, seed=0):
+  rng = random.Random(seed)
+  start = datetime.datetime(2015, 1, 1)
+  with open(filepath, mode='w', newline='') as output_file:
+    writer = csv.writer(output_file, lineterminator='\n')
+    writer.writerow(['OUTCODE', 'BSO', 'AUDIT_ID', 'AUDIT_CREATED_TIMESTAMP', 'AUDIT_LAST_MODIFIED_TIMESTAMP', 'AUDIT_TEXT'])
+    for i in range(rows):
+      created = start + datetime.timedelta(seconds=rng.randrange(300_000_000))
+      modified = created + datetime.timedelta(seconds=rng.randrange(10_000_000))
+      # About one row in ten thousand has a timestamp that cannot be read
+      modified_text = '31/02/2024 10:00:00' if rng.random() < 0.0001 else modified.strftime('%d/%m/%Y %H:%M:%S.000')
+      writer.writerow([f"{chr(65 + i % 26)}{i}", f"B{i % 80:02d}", i, created.strftime('%d/%m/%Y %H:%M:%S.000'),
+                       modified_text, 'Outcode mapping'])
+
+
+def read_rows_by_row(table, filepath, rejects):
+  # How the converters read extracts before, one row and one strptime at a time
+  columns = TABLES[table]['columns']
+  with open(filepath, mode='r', newline='') as input_file:
+    csv_file = csv.reader(input_file)
+    next(csv_file)
+    for schema in csv_file:
+      try:
+        yield tuple(datetime.datetime.strptime(value[0:19], '%d/%m/%Y %H:%M:%S') if column_type == 'timestamp' else value
+                    for value, (_, column_type) in zip(schema, columns))
+      except ValueError:
+        rejects.append(schema)
+
+
+def time_reader(reader, table, filepath):
+  rejects = []
+  start = time.perf_counter()
+  count = sum(1 for _ in reader(table, filepath, rejects))
+  return count, len(rejects), time.perf_counter() - start
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Compare reading a reference data extract row by row and by column',
+                                   formatter_class=argparse.RawTextHelpFormatter,
+                                   epilog="""Examples:
+    python benchmark_reference_data.py
+    python benchmark_reference_data.py --rows 100000
+    python benchmark_reference_data.py --table gp_practice --file gp_practices.csv""")
+
+  parser.add_argument('--table', choices=TABLES, default='outcode_mapping', help='The lookup table the extract is for (default: outcode_mapping)')
+  parser.add_argument('--file', help='(OPTIONAL) The extract to read, one is generated if it is left out')
+  parser.add_argument('--rows', type=int, default=1_000_000, help='Rows in the generated extract (default: 1000000)')
+  args = parser.parse_args()
+
+  filepath = args.file
+  if filepath is None:
+    filepath = f"benchmark_outcodes_{args.rows}.csv"
+    if not os.path.exists(filepath):
+      print(f"Writing {args.rows} rows to {filepath}")
+      write_outcode_extract(filepath, args.rows)
+
+  # Check both readers agree on the timestamps before timing them
+  timestamps = [i for i, (_, column_type) in enumerate(TABLES[args.table]['columns']) if column_type == 'timestamp']
+  by_row, by_column = [[tuple(row[i] for i in timestamps) for row in islice(reader(args.table, filepath, []), 10000)]
+                       for reader in (read_rows_by_row, read_rows)]
+  if by_row != by_column:
+    sys.exit("The readers do not agree on the timestamps")
+
+  results = {}
+  for name, reader in [('row by row', read_rows_by_row), ('columnar', read_rows)]:
+    count, rejects, elapsed = time_reader(reader, args.table, filepath)
+    results[name] = elapsed
+    print(f"{name:<12}{count:>10} rows {rejects:>6} rejects {elapsed:>8.2f}s {count / elapsed:>12,.0f} rows/s")
+  print(f"Columnar reading is {results['row by row'] / results['columnar']:.1f}x faster")
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,301 @@
+# Generates the statements that load a reference data extract into its lookup table.
+#
+# Works with the GP practice, outcode mapping and current posting extracts, in the column
+# order of the tables below. The output is one of:
+#   sql - INSERT statements of at most 1000 rows each, the most SQL Server allows in one VALUES list
+#   csv - a quoted CSV with a header row, for BULK INSERT ... WITH (FORMAT = 'CSV')
+#   bcp - a tab separated file for bcp in character mode
+# The statement or command that loads a csv or bcp file is printed once it has been written,
+# BULK INSERT reads the file from the database server so copy it there first.
+#
+# Timestamps are read as dd/mm/yyyy hh:mm:ss. Rows with a value that cannot be read are written to a
+# rejects file, <output>.rejects.csv by default, and the rest are still converted.
+#
+# Requirements:
+#   pyarrow
+#
+# Run with -h to see the options.
+
+import argparse
+import csv
+import datetime
+import os
+import sys
+from decimal import Decimal, InvalidOperation
+
+try:
+  import pyarrow as pa
+  import pyarrow.compute as pc
+  from pyarrow import csv as pa_csv
+except ModuleNotFoundError:
+  sys.exit("Requirements not installed, please run 'pip install pyarrow'")
+
+MAX_ROWS_PER_INSERT = 1000
+TIMESTAMP_FORMAT = '%d/%m/%Y %H:%M:%S'
+BLOCK_SIZE = 16 * 1024 * 1024
+
+# The lookup tables and the type of each column, in the column order of the extracts
+TABLES = {
+  'gp_practice': {
+    'table': 'dbo.BS_SELECT_GP_PRACTICE_LKP',
+    'output': 'bs_select_gp_practice_lpk',
+    'columns': [
+      ('GP_PRACTICE_CODE', 'text'),
+      ('BSO', 'text'),
+      ('COUNTRY_CATEGORY', 'text'),
+      ('AUDIT_ID', 'number'),
+      ('AUDIT_CREATED_TIMESTAMP', 'timestamp'),
+      ('AUDIT_LAST_MODIFIED_TIMESTAMP', 'timestamp'),
+      ('AUDIT_TEXT', 'text'),
+    ],
+  },
+  'outcode_mapping': {
+    'table': 'dbo.BS_SELECT_OUTCODE_MAPPING_LKP',
+    'output': 'select_outcode_mapping_lkp_output',
+    'columns': [
+      ('OUTCODE', 'text'),
+      ('BSO', 'text'),
+      ('AUDIT_ID', 'number'),
+      ('AUDIT_CREATED_TIMESTAMP', 'timestamp'),
+      ('AUDIT_LAST_MODIFIED_TIMESTAMP', 'timestamp'),
+      ('AUDIT_TEXT', 'text'),
+    ],
+  },
+  'current_posting': {
+    'table': 'dbo.CURRENT_POSTING_LKP',
+    'output': 'current_posting',
+    'columns': [
+      ('POSTING', 'text'),
+      ('IN_USE', 'text'),
+      ('INCLUDED_IN_COHORT', 'text'),
+      ('POSTING_CATEGORY', 'text'),
+    ],
+  },
+}
+
+EXTENSIONS = {'sql': 'sql', 'csv': 'csv', 'bcp': 'tsv'}
+
+
+def strict_timestamp(value):
+  try:
+    return datetime.datetime.strptime(value, TIMESTAMP_FORMAT)
+  except ValueError:
+    return None
+
+
+def timestamp_conversion(times):
+  # Parses a whole column at once, anything after the seconds is ignored. Returns the timestamps and
+  # the rows with a value that could not be parsed
+  date_strs = pc.utf8_slice_codeunits(times, 0, 19)
+  parsed = pc.strptime(date_strs, format=TIMESTAMP_FORMAT, unit='s', error_is_null=True)
+  timestamps = parsed.to_numpy(zero_copy_only=False).astype(object)
+
+  # Arrow rolls a day past the end of the month, or a 60th or 61st second, over into the next one.
+  # Those land on day 1 to 3 or second 0 or 1, so only values there and ones Arrow could not parse are
+  # formatted back to check them, and the ones that do not match are parsed again one at a time
+  suspect = pc.fill_null(pc.or_(pc.less_equal(pc.day(parsed), 3), pc.less_equal(pc.second(parsed), 1)), True)
+  suspect = pc.indices_nonzero(pc.and_(suspect, pc.is_valid(date_strs)))
+  suspect_strs = pc.take(date_strs, suspect)
+  mismatched = pc.fill_null(pc.not_equal(pc.strftime(pc.take(parsed, suspect), format=TIMESTAMP_FORMAT), suspect_strs), True)
+
+  invalid = []
+  for i in pc.indices_nonzero(mismatched).to_pylist():
+    row = suspect[i].as_py()
+    timestamps[row] = strict_timestamp(suspect_strs[i].as_py())
+    if timestamps[row] is None:
+      invalid.append(row)
+  return timestamps, invalid
+
+
+def number_conversion(values):
+  numbers = values.to_pylist()
+  invalid = []
+  for row, value in enumerate(numbers):
+    if value is not None:
+      try:
+        numbers[row] = Decimal(value)
+      except InvalidOperation:
+        invalid.append(row)
+        continue
+      # Decimal reads NaN and Infinity, which SQL Server has no literal for
+      if not numbers[row].is_finite():
+        invalid.append(row)
+  return numbers, invalid
+
+
+def read_rows(table, filepath, rejects):
+  # Reads the extract a block at a time, converting each column in one go. Empty values are None, and
+  # rows that cannot be read are added to rejects, as their values followed by the reason
+  columns = TABLES[table]['columns']
+
+  def invalid_row(row):
+    values = next(csv.reader([row.text]))
+    values += [''] * (len(columns) - len(values))
+    rejects.append(values + [f"Expected {row.expected_columns} columns, found {row.actual_columns}"])
+    return 'skip'
+
+  reader = pa_csv.open_csv(
+    filepath,
+    read_options=pa_csv.ReadOptions(block_size=BLOCK_SIZE, skip_rows=1, autogenerate_column_names=True),
+    parse_options=pa_csv.ParseOptions(invalid_row_handler=invalid_row),
+    convert_options=pa_csv.ConvertOptions(column_types={f"f{i}": pa.string() for i in range(len(columns))},
+                                          null_values=[''], strings_can_be_null=True))
+  if len(reader.schema) < len(columns):
+    raise ValueError(f"{filepath} has {len(reader.schema)} columns, expected {len(columns)}")
+
+  for batch in reader:
+    converted = []
+    errors = {}
+    for i, (_, column_type) in enumerate(columns):
+      values = batch.column(i)
+      if column_type == 'timestamp':
+        values, invalid = timestamp_conversion(values)
+      elif column_type == 'number':
+        values, invalid = number_conversion(values)
+      else:
+        values, invalid = values.to_pylist(), []
+      converted.append(values)
+      for row in invalid:
+        errors.setdefault(row, []).append(f"'{batch.column(i)[row].as_py()}' is not a {column_type}")
+
+    rows = zip(*converted)
+    if not errors:
+      yield from rows
+      continue
+    for row, values in enumerate(rows):
+      if row in errors:
+        rejects.append([batch.column(j)[row].as_py() for j in range(len(columns))] + ['; '.join(errors[row])])
+      else:
+        yield values
+
+
+def write_rejects(table, rejects, rejects_path):
+  # The rejects have the columns of the extract, so once they are fixed they can be run again as they are
+  with open(rejects_path, mode='w', newline='', encoding='utf-8') as rejects_file:
+    writer = csv.writer(rejects_file, lineterminator='\n')
+    writer.writerow([name for name, _ in TABLES[table]['columns']] + ['REJECT_REASON'])
+    writer.writerows(rejects)
+  print(f"{len(rejects)} rows could not be read, they have been written to {rejects_path}")
+
+
+def sql_literal(value):
+  if value is None:
+    return 'NULL'
+  if isinstance(value, datetime.datetime):
+    # ISO 8601 with a T is read the same whatever the language and date format of the session
+    return "'" + value.isoformat(timespec='seconds') + "'"
+  if isinstance(value, Decimal):
+    return str(value)
+  return "N'" + value.replace("'", "''") + "'"
+
+
+def file_value(value):
+  if value is None:
+    return ''
+  if isinstance(value, datetime.datetime):
+    return value.isoformat(' ', timespec='seconds')
+  return str(value)
+
+
+def write_sql(table, rows, output_file, chunk_size=MAX_ROWS_PER_INSERT):
+  definition = TABLES[table]
+  insert = f"INSERT INTO {definition['table']} ({', '.join(name for name, _ in definition['columns'])}) VALUES\n"
+
+  count = 0
+  chunk = []
+  for row in rows:
+    chunk.append('\t(' + ', '.join(sql_literal(value) for value in row) + ')')
+    count += 1
+    if len(chunk) == chunk_size:
+      output_file.write(insert + ',\n'.join(chunk) + ';\n\n')
+      chunk = []
+  if chunk:
+    output_file.write(insert + ',\n'.join(chunk) + ';\n')
+  return count
+
+
+def write_csv(table, rows, output_file):
+  writer = csv.writer(output_file, quoting=csv.QUOTE_MINIMAL, lineterminator='\n')
+  writer.writerow(name for name, _ in TABLES[table]['columns'])
+  count = 0
+  for row in rows:
+    writer.writerow(file_value(value) for value in row)
+    count += 1
+  return count
+
+
+def write_bcp(table, rows, output_file):
+  count = 0
+  for row in rows:
+    values = [file_value(value) for value in row]
+    if any('\t' in value or '\n' in value or '\r' in value for value in values):
+      raise ValueError(f"Row {count + 1} has a tab or line break, which bcp character format cannot hold, use --format csv")
+    output_file.write('\t'.join(values) + '\n')
+    count += 1
+  return count
+
+
+def load_command(table, output_format, output_path):
+  table_name = TABLES[table]['table']
+  full_path = os.path.abspath(output_path)
+  if output_format == 'csv':
+    return (f"BULK INSERT {table_name} FROM '{full_path}'\n"
+            f"  WITH (FORMAT = 'CSV', FIRSTROW = 2, FIELDQUOTE = '\"', CODEPAGE = '65001', KEEPNULLS, TABLOCK);")
+  return f"bcp {table_name} in \"{full_path}\" -c -C 65001 -t \"\\t\" -k -S <server> -d <database> -U <user>"
+
+
+def generate(table, filepath, output_path=None, output_format='sql', chunk_size=MAX_ROWS_PER_INSERT, rejects_path=None):
+  output_path = output_path or f"{TABLES[table]['output']}.{EXTENSIONS[output_format]}"
+  rejects_path = rejects_path or f"{output_path}.rejects.csv"
+  if os.path.exists(output_path):
+    sys.exit(f"{output_path} already exists, remove it or choose another file with -o")
+  rejects = []
+  rows = read_rows(table, filepath, rejects)
+
+  # Mode 'x' stops an earlier output being overwritten by mistake
+  with open(output_path, mode='x', newline='', encoding='utf-8') as output_file:
+    try:
+      if output_format == 'sql':
+        count = write_sql(table, rows, output_file, chunk_size)
+      elif output_format == 'csv':
+        count = write_csv(table, rows, output_file)
+      else:
+        count = write_bcp(table, rows, output_file)
+    except ValueError as e:
+      output_file.close()
+      os.remove(output_path)
+      sys.exit(f"Could not read {filepath}: {e}")
+
+  print(f"File created! {count} rows written to {output_path}")
+  if rejects:
+    write_rejects(table, rejects, rejects_path)
+  if output_format != 'sql':
+    print("Load it with:\n" + load_command(table, output_format, output_path))
+
+
+def main(table=None):
+  parser = argparse.ArgumentParser(description='Generate the statements or bulk load file for a reference data extract',
+                                   formatter_class=argparse.RawTextHelpFormatter,
+                                   epilog="""Examples:
+    python generate_inserts.py gp_practice gp_practices.csv
+    python generate_inserts.py outcode_mapping outcodes.csv --format csv -o outcodes.csv
+    python bs_select_gp_practice_lpk.py gp_practices.csv --format bcp""")
+
+  if table is None:
+    parser.add_argument('table', choices=TABLES, help='The lookup table the extract is for')
+  parser.add_argument('filepath', nargs='?', help='The extract to convert, you are asked for it if it is left out')
+  parser.add_argument('-o', '--output', help='(OPTIONAL) The output file (default: named after the table)')
+  parser.add_argument('--format', choices=['sql', 'csv', 'bcp'], default='sql', help='The output format (default: sql)')
+  parser.add_argument('--rejects', help='(OPTIONAL) Where to write rows that cannot be read (default: <output>.rejects.csv)')
+  parser.add_argument('--chunk-size', type=int, default=MAX_ROWS_PER_INSERT, help=f'Rows per INSERT statement, at most {MAX_ROWS_PER_INSERT} (default: {MAX_ROWS_PER_INSERT})')
+
+  args = parser.parse_args()
+  if not 1 <= args.chunk_size <= MAX_ROWS_PER_INSERT:
+    parser.error(f"--chunk-size must be between 1 and {MAX_ROWS_PER_INSERT}")
+
+  filepath = args.filepath or input("Enter your file path: ")
+  generate(table or args.table, filepath, args.output, args.format, args.chunk_size, args.rejects)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,148 @@
+# Loads a reference data extract straight into its lookup table, without going through a SQL file.
+#
+# Works with the same extracts and tables as generate_inserts.py. Rows are read as a stream and
+# sent in batches with executemany, all in one transaction, so a load that fails part way leaves
+# the table as it was. With --replace the rows already in the table are deleted first, which
+# makes a reference data refresh repeatable. Rows that cannot be read are left out and written to
+# <filepath>.rejects.csv.
+#
+# The database is the local SQL Server container by default, using PASSWORD and DB_NAME from the
+# .env file, or the connection string in SQL_CONNECTION_STRING. --sqlite loads into a SQLite file
+# instead, creating the table if it is missing, to try a load without SQL Server.
+#
+# Requirements:
+#   pyodbc and the Microsoft ODBC Driver for SQL Server, for SQL Server
+#   python-dotenv
+#   pyarrow
+#
+# Run with -h to see the options.
+
+import argparse
+import datetime
+import os
+import sqlite3
+import sys
+import time
+from decimal import Decimal
+from itertools import islice
+
+from generate_inserts import TABLES, read_rows, write_rejects
+
+BATCH_SIZE = 5000
+ODBC_DRIVER = 'ODBC Driver 18 for SQL Server'
+SQLITE_TYPES = {'text': 'TEXT', 'number': 'NUMERIC', 'timestamp': 'TEXT'}
+
+
+def get_connection_string(server):
+  try:
+    from dotenv import load_dotenv
+  except ModuleNotFoundError:
+    sys.exit("Requirements not installed, please run 'pip install python-dotenv'")
+
+  load_dotenv(dotenv_path=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', '.env'))
+  if os.getenv('SQL_CONNECTION_STRING'):
+    return os.getenv('SQL_CONNECTION_STRING')
+  if not os.getenv('PASSWORD'):
+    sys.exit("Could not find PASSWORD in the .env file, please follow the instructions in the docs to create one, or set SQL_CONNECTION_STRING")
+  return (f"DRIVER={{{ODBC_DRIVER}}};SERVER={server};DATABASE={os.getenv('DB_NAME', 'DToSDB')};"
+          f"UID=SA;PWD={os.getenv('PASSWORD')};TrustServerCertificate=yes")
+
+
+def connect_sql_server(connection_string):
+  try:
+    import pyodbc
+  except ModuleNotFoundError:
+    sys.exit("Requirements not installed, please run 'pip install pyodbc'")
+
+  # Connections are pooled by the driver manager, so loading several tables in one run reuses one
+  pyodbc.pooling = True
+  connection = pyodbc.connect(connection_string, autocommit=False)
+  cursor = connection.cursor()
+  # Sends each batch as one parameter array instead of a round trip for every row
+  cursor.fast_executemany = True
+  return connection, cursor
+
+
+def connect_sqlite(path):
+  sqlite3.register_adapter(Decimal, str)
+  sqlite3.register_adapter(datetime.datetime, lambda value: value.isoformat(' '))
+
+  # The file is attached as dbo so the table names are the same as in SQL Server
+  connection = sqlite3.connect(':memory:')
+  connection.execute('ATTACH DATABASE ? AS dbo', (path,))
+  cursor = connection.cursor()
+  for definition in TABLES.values():
+    columns = ', '.join(f"{name} {SQLITE_TYPES[column_type]}" for name, column_type in definition['columns'])
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS {definition['table']} ({columns}, PRIMARY KEY ({definition['columns'][0][0]}))")
+  return connection, cursor
+
+
+def batches(rows, batch_size):
+  rows = iter(rows)
+  while batch := list(islice(rows, batch_size)):
+    yield batch
+
+
+def load(cursor, table, filepath, rejects, batch_size=BATCH_SIZE, replace=False):
+  definition = TABLES[table]
+  names = [name for name, _ in definition['columns']]
+  insert = f"INSERT INTO {definition['table']} ({', '.join(names)}) VALUES ({', '.join('?' for _ in names)})"
+
+  if replace:
+    cursor.execute(f"DELETE FROM {definition['table']}")
+
+  count = 0
+  start = time.perf_counter()
+  for batch in batches(read_rows(table, filepath, rejects), batch_size):
+    cursor.executemany(insert, batch)
+    count += len(batch)
+    if sys.stdout.isatty():
+      print(f"{count} rows loaded into {definition['table']}, {count / (time.perf_counter() - start):,.0f} rows/s", end='\r')
+  return count, time.perf_counter() - start
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Load a reference data extract into its lookup table',
+                                   formatter_class=argparse.RawTextHelpFormatter,
+                                   epilog="""Examples:
+    python load_reference_data.py gp_practice gp_practices.csv --replace
+    python load_reference_data.py outcode_mapping outcodes.csv --batch-size 10000
+    python load_reference_data.py current_posting postings.csv --sqlite reference.db""")
+
+  parser.add_argument('table', choices=TABLES, help='The lookup table the extract is for')
+  parser.add_argument('filepath', help='The extract to load')
+  parser.add_argument('--replace', action='store_true', help='(OPTIONAL) Delete the rows already in the table first')
+  parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help=f'Rows sent to the database at a time (default: {BATCH_SIZE})')
+  parser.add_argument('--rejects', help='(OPTIONAL) Where to write rows that cannot be read (default: <filepath>.rejects.csv)')
+  parser.add_argument('--server', default='localhost,1433', help='(OPTIONAL) The SQL Server to connect to (default: localhost,1433)')
+  parser.add_argument('--sqlite', metavar='PATH', help='(OPTIONAL) Load into this SQLite file instead of SQL Server')
+
+  args = parser.parse_args()
+  if args.batch_size < 1:
+    parser.error("--batch-size must be greater than 0")
+
+  if args.sqlite:
+    connection, cursor = connect_sqlite(args.sqlite)
+  else:
+    connection, cursor = connect_sql_server(get_connection_string(args.server))
+
+  rejects = []
+  try:
+    count, elapsed = load(cursor, args.table, args.filepath, rejects, args.batch_size, args.replace)
+    connection.commit()
+  except ValueError as e:
+    connection.rollback()
+    sys.exit(f"\nCould not read {args.filepath}, nothing was loaded: {e}")
+  except Exception as e:
+    connection.rollback()
+    sys.exit(f"\nCould not load {args.filepath}, nothing was loaded: {e}")
+  finally:
+    connection.close()
+
+  print(f"\nLoaded {count} rows into {TABLES[args.table]['table']} in {elapsed:.2f}s, {count / max(elapsed, 1e-9):,.0f} rows/s")
+  if rejects:
+    write_rejects(args.table, rejects, args.rejects or f"{args.filepath}.rejects.csv")
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+Blob Source
+
+Lets the NHS Record Extractor read parquet files in place from an Azure blob container,
+such as the inbound container in Azurite, instead of downloading whole files first.
+
+Blobs are read with ranged requests, so only the parts of a file that are needed are
+downloaded: the footer, the nhs_number column of the row groups that may hold the NHS
+numbers, and the row groups holding the winning records. Every block that is downloaded
+is cached on disk under the container, name and etag of the blob, so later runs against
+unchanged blobs are served from the cache.
+
+The cache is never evicted. Blocks of blobs that have changed or been deleted stay on disk
+until the cache directory is removed.
+"""
+
+import io
+import os
+import sys
+import threading
+from collections import OrderedDict
+from urllib.parse import quote
+import pyarrow as pa
+import pyarrow.fs as pafs
+
+try:
+    from azure.core import MatchConditions
+    from azure.core.exceptions import ResourceNotFoundError
+    from azure.storage.blob import ContainerClient
+except ModuleNotFoundError:
+    sys.exit("Requirements not installed, please run 'pip install azure-storage-blob'")
+
+BLOCK_SIZE = 256 * 1024
+MEMORY_BLOCKS = 64
+CACHE_DIRECTORY = '.blob_cache'
+
+class TransferStats:
+    """
+    Counts the bytes read from blob storage and from the local block cache.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.downloaded = 0
+        self.cached = 0
+        self.requests = 0
+
+    def record_download(self, size):
+        with self._lock:
+            self.downloaded += size
+            self.requests += 1
+
+    def record_cache_hit(self, size):
+        with self._lock:
+            self.cached += size
+
+class BlobFile(io.RawIOBase):
+    """
+    A seekable, read only file over a blob that downloads blocks on demand.
+
+    Reads are rounded out to whole blocks. The most recently used blocks are kept in
+    memory, blocks already in the cache are read from disk and each run of missing
+    blocks is fetched with a single ranged request.
+    """
+
+    def __init__(self, blob_client, size, etag, cache_directory, stats, block_size=BLOCK_SIZE):
+        super().__init__()
+        self._blob_client = blob_client
+        self._size = size
+        self._etag = etag
+        # Etags are only unique for one blob, so the container and blob name are part of the key
+        self._cache_directory = os.path.join(
+            cache_directory,
+            quote(blob_client.container_name, safe=''),
+            quote(blob_client.blob_name, safe=''),
+            etag.strip('"'))
+        self._stats = stats
+        self._block_size = block_size
+        self._position = 0
+        self._memory = OrderedDict()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._position = offset
+        elif whence == io.SEEK_CUR:
+            self._position += offset
+        elif whence == io.SEEK_END:
+            self._position = self._size + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        return self._position
+
+    def readinto(self, buffer):
+        length = min(len(buffer), self._size - self._position)
+        if length <= 0:
+            return 0
+
+        first_block = self._position // self._block_size
+        last_block = (self._position + length - 1) // self._block_size
+        data = b''.join(self._read_blocks(first_block, last_block))
+
+        start = self._position - first_block * self._block_size
+        buffer[:length] = data[start:start + length]
+        self._position += length
+        return length
+
+    def _block_path(self, block):
+        return os.path.join(self._cache_directory, str(block))
+
+    def _read_blocks(self, first_block, last_block):
+        blocks = {}
+        missing = []
+        for block in range(first_block, last_block + 1):
+            if block in self._memory:
+                self._memory.move_to_end(block)
+                blocks[block] = self._memory[block]
+                continue
+            try:
+                with open(self._block_path(block), 'rb') as file:
+                    blocks[block] = file.read()
+                self._stats.record_cache_hit(len(blocks[block]))
+            except FileNotFoundError:
+                missing.append(block)
+
+        for run_first, run_last in consecutive_runs(missing):
+            offset = run_first * self._block_size
+            length = min((run_last + 1) * self._block_size, self._size) - offset
+
+            # Fail rather than mix blocks from two versions of the blob
+            data = self._blob_client.download_blob(
+                offset=offset,
+                length=length,
+                etag=self._etag,
+                match_condition=MatchConditions.IfNotModified).readall()
+            self._stats.record_download(len(data))
+
+            os.makedirs(self._cache_directory, exist_ok=True)
+            for block in range(run_first, run_last + 1):
+                start = (block - run_first) * self._block_size
+                blocks[block] = data[start:start + self._block_size]
+                temp_path = f"{self._block_path(block)}.{threading.get_ident()}.tmp"
+                with open(temp_path, 'wb') as file:
+                    file.write(blocks[block])
+                os.replace(temp_path, self._block_path(block))
+
+        for block in range(first_block, last_block + 1):
+            self._memory[block] = blocks[block]
+            self._memory.move_to_end(block)
+        while len(self._memory) > MEMORY_BLOCKS:
+            self._memory.popitem(last=False)
+
+        return [blocks[block] for block in range(first_block, last_block + 1)]
+
+def consecutive_runs(blocks):
+    """
+    Group sorted block numbers into runs of consecutive blocks.
+
+    Args:
+        blocks (list): Sorted block numbers
+
+    Returns:
+        list: (first block, last block) of each run
+    """
+    runs = []
+    for block in blocks:
+        if runs and runs[-1][1] == block - 1:
+            runs[-1] = (runs[-1][0], block)
+        else:
+            runs.append((block, block))
+    return runs
+
+class BlobFileSystemHandler(pafs.FileSystemHandler):
+    """
+    A read only pyarrow filesystem over the blobs in a container.
+    """
+
+    def __init__(self, container_client, cache_directory=CACHE_DIRECTORY, block_size=BLOCK_SIZE):
+        self.container_client = container_client
+        self.cache_directory = cache_directory
+        self.block_size = block_size
+        self.stats = TransferStats()
+        self._properties = {}
+
+    def _blob_properties(self, path):
+        if path not in self._properties:
+            self._properties[path] = self.container_client.get_blob_client(path).get_blob_properties()
+        return self._properties[path]
+
+    def get_type_name(self):
+        return "azure-blob"
+
+    def normalize_path(self, path):
+        return path.lstrip('/')
+
+    def get_file_info(self, paths):
+        infos = []
+        for path in paths:
+            try:
+                properties = self._blob_properties(path)
+            except ResourceNotFoundError:
+                infos.append(pafs.FileInfo(path, pafs.FileType.NotFound))
+                continue
+            infos.append(pafs.FileInfo(path, pafs.FileType.File, size=properties.size, mtime=properties.last_modified))
+        return infos
+
+    def get_file_info_selector(self, selector):
+        prefix = selector.base_dir.strip('/')
+        prefix = f"{prefix}/" if prefix else ""
+
+        infos = []
+        for blob in self.container_client.list_blobs(name_starts_with=prefix or None):
+            if not selector.recursive and '/' in blob.name[len(prefix):]:
+                continue
+            self._properties[blob.name] = blob
+            infos.append(pafs.FileInfo(blob.name, pafs.FileType.File, size=blob.size, mtime=blob.last_modified))
+        return infos
+
+    def open_input_file(self, path):
+        properties = self._blob_properties(path)
+        blob_file = BlobFile(
+            self.container_client.get_blob_client(path),
+            properties.size,
+            properties.etag,
+            self.cache_directory,
+            self.stats,
+            self.block_size)
+        return pa.PythonFile(blob_file, mode='r')
+
+    def open_input_stream(self, path):
+        return self.open_input_file(path)
+
+    def _read_only(self, *args, **kwargs):
+        raise PermissionError("The blob source is read only")
+
+    create_dir = _read_only
+    delete_dir = _read_only
+    delete_dir_contents = _read_only
+    delete_root_dir_contents = _read_only
+    delete_file = _read_only
+    move = _read_only
+    copy_file = _read_only
+    open_output_stream = _read_only
+    open_append_stream = _read_only
+
+def connect(container, connection_string=None, cache_directory=CACHE_DIRECTORY):
+    """
+    Connect to a blob container as a pyarrow filesystem.
+
+    Args:
+        container (str): Container URL (including any SAS token) or container name
+        connection_string (str, optional): Storage connection string, used when container is a name.
+            Defaults to the AZURITE_CONNECTION_STRING environment variable
+        cache_directory (str): Directory to cache downloaded blocks in
+
+    Returns:
+        PyFileSystem: Filesystem reading the blobs in the container
+    """
+    if container.startswith(('http://', 'https://')):
+        container_client = ContainerClient.from_container_url(container)
+    else:
+        connection_string = connection_string or os.getenv('AZURITE_CONNECTION_STRING')
+        if not connection_string:
+            sys.exit("A connection string is needed to connect to a container by name, "
+                     "pass --connection-string or set AZURITE_CONNECTION_STRING")
+        container_client = ContainerClient.from_connection_string(connection_string, container)
+
+    print(f"Connected to blob container {container_client.container_name}")
+    return pafs.PyFileSystem(BlobFileSystemHandler(container_client, cache_directory))
+
+def find_blob_parquet_files(filesystem):
+    """
+    Find all parquet blobs at the top level of the container.
+
+    Args:
+        filesystem (PyFileSystem): Filesystem returned by connect
+
+    Returns:
+        list: List of blob names of parquet files
+    """
+    selector = pafs.FileSelector('', recursive=False)
+    return [info.path for info in filesystem.get_file_info(selector) if info.path.endswith('.parquet')]
+
+def print_transfer_stats(filesystem):
+    """
+    Print how much data was downloaded compared to the size of the files read.
+
+    Args:
+        filesystem (PyFileSystem): Filesystem returned by connect
+    """
+    stats = filesystem.handler.stats
+    print(f"Downloaded {stats.downloaded / 1024 / 1024:.1f} MB in {stats.requests} ranged requests, "
+          f"read {stats.cached / 1024 / 1024:.1f} MB from the block cache")
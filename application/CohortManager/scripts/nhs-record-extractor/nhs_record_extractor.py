@@ -7,20 +7,19 @@ from parquet files in the current directory and saves them to a new parquet file
 The most recent record is determined by the date in the filename.
 """
 
-from pandas.core.frame import DataFrame
-
-
-from typing import Any
-
-
 import os
 import sys
 import glob
-import pandas as pd
-import pyarrow
+import argparse
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
 import pyarrow.parquet as pq
-from datetime import datetime
 import re
+from concurrent.futures import ThreadPoolExecutor
+
+NHS_NUMBER_COLUMN = 'nhs_number'
 
 def extract_date_from_filename(filename):
     """
@@ -59,181 +58,527 @@ def find_parquet_files(directory='.'):
     """
     return glob.glob(os.path.join(directory, '*.parquet'))
 
+def valid_nhs_numbers(nhs_numbers):
+    """
+    Check the Modulus 11 check digit of each NHS number.
+
+    Args:
+        nhs_numbers (ndarray): 10 digit NHS numbers as int64
+
+    Returns:
+        ndarray: True for each NHS number with a valid check digit
+    """
+    digits = (nhs_numbers[:, None] // 10 ** np.arange(9, -1, -1, dtype=np.int64)) % 10
+    check_digit = 11 - (digits[:, :9] @ np.arange(10, 1, -1, dtype=np.int64)) % 11
+    check_digit[check_digit == 11] = 0
+
+    # A check digit of 10 means the NHS number is invalid, and can never match the last digit
+    return check_digit == digits[:, 9]
+
+def parse_nhs_numbers(lines):
+    """
+    Parse NHS numbers into an int64 array, rejecting any that are not valid.
+
+    Args:
+        lines (list): NHS numbers as strings, one per line of the input
+
+    Returns:
+        tuple: (sorted ndarray of the unique valid NHS numbers as int64,
+            list of (line number, value, reason) for each rejected line)
+    """
+    rejected = []
+    line_numbers = []
+    values = []
+    for line_number, line in enumerate(lines, start=1):
+        value = line.strip()
+        if not value:
+            continue
+        if len(value) != 10 or not value.isascii() or not value.isdigit():
+            rejected.append((line_number, value, "not a 10 digit number"))
+            continue
+        line_numbers.append(line_number)
+        values.append(value)
+
+    nhs_numbers = np.array(values, dtype=np.int64)
+    valid = valid_nhs_numbers(nhs_numbers)
+    for index in np.flatnonzero(~valid):
+        rejected.append((line_numbers[index], values[index], "invalid check digit"))
+
+    rejected.sort()
+    return np.unique(nhs_numbers[valid]), rejected
+
 def read_nhs_numbers(file_path=None):
     """
     Read NHS numbers from a file or use example numbers.
 
+    Any line that is not a valid NHS number is reported and left out.
+
     Args:
         file_path (str, optional): Path to file containing NHS numbers
 
     Returns:
-        list: List of NHS numbers
+        ndarray: Sorted unique NHS numbers as int64
     """
     if file_path:
         try:
             with open(file_path, 'r') as file:
-                nhs_numbers = [line.strip() for line in file if line.strip()]
-            return nhs_numbers
+                lines = file.readlines()
         except FileNotFoundError:
             print(f"Error: File '{file_path}' not found.")
             sys.exit(1)
     else:
         # Example NHS numbers if no file is provided
         print('using default nhs numbers from code not from the file.')
-        return ['9999987109', '1234567890']
+        lines = ['9999987109', '9000000009']
+
+    nhs_numbers, rejected = parse_nhs_numbers(lines)
+    if rejected:
+        print(f"Warning: Rejected {len(rejected)} lines that are not valid NHS numbers:")
+        for line_number, value, reason in rejected:
+            print(f"  Line {line_number}: '{value}' ({reason})")
+    return nhs_numbers
+
+def nhs_number_values(nhs_numbers, field_type):
+    """
+    Convert NHS numbers to an Arrow array matching the type of the nhs_number column.
+
+    Args:
+        nhs_numbers (ndarray): NHS numbers as int64
+        field_type (pyarrow.DataType): Type of the nhs_number column in the parquet file
+
+    Returns:
+        pyarrow.Array: NHS numbers that can be compared directly with the column
+    """
+    if pa.types.is_integer(field_type):
+        return pa.array(nhs_numbers, type=pa.int64()).cast(field_type)
+    # NHS numbers stored as text keep any leading zeros
+    return pa.array([f"{nhs:010d}" for nhs in nhs_numbers.tolist()], type=field_type)
+
+def scan_parquet_file(file_path, nhs_numbers, filesystem=None):
+    """
+    Find the rows in a parquet file that match any of the NHS numbers.
+
+    Only the nhs_number column is read, and row groups whose min/max statistics
+    show they cannot contain any of the NHS numbers are skipped without being read.
+
+    Args:
+        file_path (str): Path to the parquet file
+        nhs_numbers (ndarray): NHS numbers to search for as int64
+        filesystem (FileSystem, optional): Filesystem to read the file from, the local disk if not given
+
+    Returns:
+        Table: Matches with the columns nhs_number, row_group and row_index,
+            or None if the file does not have an nhs_number column
+    """
+    dataset = ds.dataset(file_path, format='parquet', filesystem=filesystem)
+
+    if NHS_NUMBER_COLUMN not in dataset.schema.names:
+        print(f"Warning: File {file_path} does not have an '{NHS_NUMBER_COLUMN}' column. Skipping.")
+        return None
+
+    values = nhs_number_values(nhs_numbers, dataset.schema.field(NHS_NUMBER_COLUMN).type)
+    nhs_filter = ds.field(NHS_NUMBER_COLUMN).isin(values)
+
+    matches = []
+    for fragment in dataset.get_fragments():
+        # Splitting with the filter drops row groups the statistics rule out
+        for row_group_fragment in fragment.split_by_row_group(nhs_filter, schema=dataset.schema):
+            column = row_group_fragment.to_table(columns=[NHS_NUMBER_COLUMN]).column(NHS_NUMBER_COLUMN)
+            row_indexes = pc.indices_nonzero(pc.is_in(column, value_set=values))
+            if len(row_indexes) == 0:
+                continue
+
+            matches.append(pa.table({
+                NHS_NUMBER_COLUMN: pc.cast(column.take(row_indexes), pa.int64()),
+                'row_group': pa.repeat(row_group_fragment.row_groups[0].id, len(row_indexes)).cast(pa.int32()),
+                'row_index': row_indexes.cast(pa.int64()),
+            }))
+
+    if not matches:
+        return pa.table({
+            NHS_NUMBER_COLUMN: pa.array([], pa.int64()),
+            'row_group': pa.array([], pa.int32()),
+            'row_index': pa.array([], pa.int64()),
+        })
+    return pa.concat_tables(matches)
+
+def select_most_recent(candidates):
+    """
+    Pick the most recent match for each NHS number.
+
+    The match from the file with the latest date wins. When several files share a date,
+    or a file holds the NHS number more than once, the first match scanned wins.
+
+    Args:
+        candidates (Table): Matches with nhs_number, file_date, file_index, row_group and row_index columns
+
+    Returns:
+        Table: One row per NHS number with the same columns as candidates
+    """
+    columns = ['file_date', 'file_index', 'row_group', 'row_index']
+    ordered = candidates.sort_by([
+        ('file_date', 'descending'),
+        ('file_index', 'ascending'),
+        ('row_group', 'ascending'),
+        ('row_index', 'ascending'),
+    ])
+    winners = ordered.group_by(NHS_NUMBER_COLUMN, use_threads=False).aggregate(
+        [(column, 'first') for column in columns])
+    return winners.select([NHS_NUMBER_COLUMN] + [f'{column}_first' for column in columns]) \
+        .rename_columns([NHS_NUMBER_COLUMN] + columns)
+
+def read_winning_rows(winners, filesystem=None):
+    """
+    Read the full rows for the winning matches, one row group at a time.
+
+    Only one row group is held in memory at a time, whatever the number of winners.
+
+    Args:
+        winners (Table): Output of select_most_recent with a file_path column
+        filesystem (FileSystem, optional): Filesystem to read the files from, the local disk if not given
 
-def find_most_recent_records(nhs_numbers, parquet_files) -> tuple[DataFrame, Any | None, dict[Any, Any]]:
+    Yields:
+        Table: The winning rows from one row group
+    """
+    for file_path in pc.unique(winners.column('file_path')).to_pylist():
+        file_winners = winners.filter(pc.equal(winners.column('file_path'), file_path))
+        parquet_file = pq.ParquetFile(file_path, filesystem=filesystem)
+
+        for row_group in pc.unique(file_winners.column('row_group')).to_pylist():
+            row_group_winners = file_winners.filter(pc.equal(file_winners.column('row_group'), row_group))
+            yield parquet_file.read_row_group(row_group).take(row_group_winners.column('row_index'))
+
+def scan_file(file_index, file_path, nhs_numbers, filesystem=None):
+    """
+    Scan one parquet file for the NHS numbers and tag the matches with the file they came from.
+
+    Args:
+        file_index (int): Position of the file in the list of parquet files
+        file_path (str): Path to the parquet file
+        nhs_numbers (ndarray): NHS numbers to search for as int64
+        filesystem (FileSystem, optional): Filesystem to read the file from, the local disk if not given
+
+    Returns:
+        Table: Matches with nhs_number, row_group, row_index, file_date and file_index columns,
+            or None if the file was skipped
+    """
+    print(f"Processing file: {file_path}")
+
+    # Extract date from filename
+    file_date_str = extract_date_from_filename(file_path)
+
+    if not file_date_str:
+        print(f"Warning: Could not extract date from filename {file_path}. Skipping.")
+        return None
+
+    try:
+        matches = scan_parquet_file(file_path, nhs_numbers, filesystem)
+        if matches is None:
+            return None
+
+        return matches \
+            .append_column('file_date', pa.repeat(file_date_str, len(matches)).cast(pa.string())) \
+            .append_column('file_index', pa.repeat(file_index, len(matches)).cast(pa.int32()))
+
+    except Exception as e:
+        print(f"Error processing file {file_path}: {e}")
+        return None
+
+def sort_newest_first(parquet_files):
+    """
+    Sort parquet files by the date in their filename, newest first.
+
+    Files with the same date keep their original order, and files without a date go last.
+
+    Args:
+        parquet_files (list): List of parquet file paths
+
+    Returns:
+        list: The parquet file paths in newest first order
+    """
+    return sorted(parquet_files, key=extract_date_from_filename, reverse=True)
+
+def find_most_recent_records(nhs_numbers, parquet_files, workers=1, index=None, filesystem=None) -> tuple[pa.Table, pa.Schema | None]:
     """
     Find the most recent record for each NHS number from the parquet files.
     The most recent record is determined by the date in the filename.
 
+    Each file is first scanned for matching NHS numbers using only the nhs_number column,
+    the winning match for each NHS number is then picked, and only then are the full
+    rows read from the row groups that hold them.
+
+    Files are scanned newest first, so once every NHS number has been found no older
+    file can hold a more recent record and the remaining files are skipped.
+
+    Files are independent until the winning matches are picked, so with more than one
+    worker they are scanned concurrently. The results are merged in file order, so the
+    output is the same whatever the number of workers.
+
+    When an index is given, the matches in files that are in the index and unchanged
+    are looked up in the index, and only the remaining files are scanned.
+
     Args:
-        nhs_numbers (list): List of NHS numbers to search for
+        nhs_numbers (ndarray): NHS numbers to search for as int64
         parquet_files (list): List of parquet file paths
+        workers (int): Number of files to scan at the same time
+        index (NhsRecordIndex, optional): Index of the NHS numbers in the parquet files
+        filesystem (FileSystem, optional): Filesystem to read the files from, the local disk if not given
 
     Returns:
-        tuple: (DataFrame of most recent records, schema of the parquet files)
+        tuple: (Table with the nhs_number, file_date, file_path, row_group and row_index
+            of the most recent record for each NHS number, schema of the parquet files)
     """
-    # Convert NHS numbers to a set for faster lookup
-    nhs_set = set(nhs_numbers)
-
-    # Dictionary to store the most recent record for each NHS number
-    most_recent_records = {}
+    workers = max(workers, 1)
+    parquet_files = sort_newest_first(parquet_files)
+    files_to_scan = list(enumerate(parquet_files))
+    unresolved = set(nhs_numbers.tolist())
 
     # Store the schema from the first valid parquet file
-    schema = None
+    schema_file_index = None
+    candidates = []
+
+    if index is not None:
+        indexed_matches = index.lookup(nhs_numbers, parquet_files)
+        files_to_scan = [(file_index, file_path) for file_index, file_path in files_to_scan
+                         if not index.is_current(os.path.basename(file_path))]
+        print(f"Found {len(indexed_matches)} matches in the index, "
+              f"{len(files_to_scan)} files are not in the index and will be scanned.")
+
+        candidates.append(indexed_matches)
+        indexed_file_indexes = [file_index for file_index in range(len(parquet_files))
+                                if index.is_current(os.path.basename(parquet_files[file_index]))]
+        if indexed_file_indexes:
+            schema_file_index = indexed_file_indexes[0]
+
+        # A newer unindexed file may hold any of the NHS numbers, so every one of them is scanned
+        unresolved = None
+
+    # pyarrow releases the GIL while decoding, so threads scan files in parallel
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for batch_start in range(0, len(files_to_scan), workers):
+            batch = files_to_scan[batch_start:batch_start + workers]
+            results = executor.map(lambda indexed_file: scan_file(*indexed_file, nhs_numbers, filesystem), batch)
+
+            for (file_index, _), matches in zip(batch, results):
+                if matches is None:
+                    continue
+                if schema_file_index is None or file_index < schema_file_index:
+                    schema_file_index = file_index
+                candidates.append(matches)
+                if unresolved is not None:
+                    unresolved.difference_update(matches.column(NHS_NUMBER_COLUMN).to_pylist())
+
+            skipped_files = len(files_to_scan) - (batch_start + len(batch))
+            if not unresolved and unresolved is not None and skipped_files > 0:
+                print(f"All NHS numbers found, skipped {skipped_files} older files.")
+                break
+
+    schema = pq.read_schema(parquet_files[schema_file_index], filesystem=filesystem) if schema_file_index is not None else None
+
+    candidates = [matches for matches in candidates if len(matches) > 0]
+    if not candidates:
+        return pa.table({}), schema
+
+    winners = select_most_recent(pa.concat_tables(candidates))
+    file_paths = pa.DictionaryArray.from_arrays(winners.column('file_index').combine_chunks(), pa.array(parquet_files))
+    return winners.append_column('file_path', pc.cast(file_paths, pa.string())), schema
+
+def output_schema(winners, schema, filesystem=None):
+    """
+    Pick the schema every winning record can be saved with, before anything is written.
 
-    # Process each parquet file
-    for file_path in parquet_files:
-        print(f"Processing file: {file_path}")
+    The schema of the source files is used when every file the winners come from has all of
+    its columns with the same types. Otherwise the schemas of those files are combined, and
+    the records from files without a column are saved with it empty.
 
-        # Extract date from filename
-        file_date_str = extract_date_from_filename(file_path)
+    Args:
+        winners (Table): Output of find_most_recent_records
+        schema: Schema of the source files, from find_most_recent_records
+        filesystem (FileSystem, optional): Filesystem to read the files from, the local disk if not given
 
-        if not file_date_str:
-            print(f"Warning: Could not extract date from filename {file_path}. Skipping.")
-            continue
+    Returns:
+        Schema: The schema to save the records with
+    """
+    source_schemas = [pq.read_schema(file_path, filesystem=filesystem).remove_metadata()
+                      for file_path in pc.unique(winners.column('file_path')).to_pylist()]
 
-        try:
-            # Read the parquet file
-            df = pd.read_parquet(file_path)
-
-            # Store the schema from the first valid parquet file
-            if schema is None:
-                # Get the schema from the parquet file
-                parquet_file = pq.ParquetFile(file_path)
-                # Convert ParquetSchema to pyarrow.lib.Schema
-                schema = parquet_file.schema_arrow
-
-            # Check if the dataframe has the necessary column
-            if 'nhs_number' not in df.columns:
-                print(f"Warning: File {file_path} does not have an 'nhs_number' column. Skipping.")
-                continue
+    if schema is not None:
+        if all(name in source.names and source.field(name).type == schema.field(name).type
+               for source in source_schemas for name in schema.names):
+            return schema
+        print("Warning: Could not use provided schema, the matched records come from files with different schemas.")
+        print("Falling back to the combined schema of the matched records.")
 
-            # Filter for records with matching NHS numbers
-            matching_records = df[df['nhs_number'].astype(str).isin(list(nhs_set))]
-
-            # Process each matching record
-            for _, record in matching_records.iterrows():
-                nhs = str(record['nhs_number'])
-
-                # Check if this is the most recent record for this NHS number
-                # based on the file date
-                if nhs not in most_recent_records or file_date_str > most_recent_records[nhs]['file_date']:
-                    most_recent_records[nhs] = {
-                        'record': record,
-                        'file_date': file_date_str,
-                        'file_path': file_path
-                    }
-
-        except Exception as e:
-            print(f"Error processing file {file_path}: {e}")
-
-    # Create a DataFrame from the most recent records
-    if most_recent_records:
-        records_list = [record_data['record'] for record_data in most_recent_records.values()]
-        result_df = pd.DataFrame(records_list)
-        return result_df, schema, most_recent_records
-    else:
-        return pd.DataFrame(), schema, {}
+    return pa.unify_schemas(source_schemas, promote_options='permissive')
 
-def save_to_parquet(df, schema, output_file='most_recent_records.parquet'):
+def conform(rows, schema):
+    """
+    Cast rows to the output schema, adding any columns their file does not have as nulls.
     """
-    Save the DataFrame to a parquet file with the same schema as the source files.
+    return pa.Table.from_arrays(
+        [rows.column(field.name).cast(field.type) if field.name in rows.column_names else pa.nulls(rows.num_rows, field.type)
+         for field in schema],
+        schema=schema)
+
+def save_to_parquet(winners, schema, output_file='most_recent_records.parquet', filesystem=None):
+    """
+    Save the winning records to a parquet file with the same schema as the source files.
+
+    The records are streamed from the source files into the output file one row group
+    at a time, so memory use does not grow with the number of records. They are written
+    to a temporary file next to output_file, which only replaces it once every record has
+    been written, so a failed save leaves any earlier output as it was.
 
     Args:
-        df (DataFrame): DataFrame to save
+        winners (Table): Output of find_most_recent_records
         schema: Schema to use for the parquet file
         output_file (str): Path to save the parquet file
+        filesystem (FileSystem, optional): Filesystem to read the source files from, the local disk if not given
     """
-    if df.empty:
+    if winners.num_rows == 0:
         print("No records to save.")
         return False
 
+    temp_file = f"{output_file}.tmp"
+    saved = 0
     try:
-        # Save the DataFrame to a parquet file
-        if schema is not None:
-            try:
-                # Try to use the provided schema
-                table = pyarrow.Table.from_pandas(df, schema=schema)
-            except Exception as schema_error:
-                print(f"Warning: Could not use provided schema: {schema_error}")
-                print("Falling back to inferred schema.")
-                table = pyarrow.Table.from_pandas(df)
-        else:
-            # No schema provided, let pyarrow infer it
-            table = pyarrow.Table.from_pandas(df)
-
-        pq.write_table(table, output_file)
-        print(f"Saved {len(df)} records to {output_file}")
+        schema = output_schema(winners, schema, filesystem)
+        with pq.ParquetWriter(temp_file, schema) as writer:
+            for rows in read_winning_rows(winners, filesystem):
+                writer.write_table(conform(rows, schema))
+                saved += rows.num_rows
+        os.replace(temp_file, output_file)
+
+        print(f"Saved {saved} records to {output_file}")
         return True
     except Exception as e:
         print(f"Error saving to parquet file: {e}")
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
         return False
 
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Find the most recent records for a list of NHS numbers from the parquet files in the current directory."
+    )
+
+    parser.add_argument(
+        "nhs_numbers_file",
+        nargs="?",
+        help="File containing one NHS number per line (uses example NHS numbers if omitted)"
+    )
+
+    parser.add_argument(
+        "output_file",
+        nargs="?",
+        default="most_recent_records.parquet",
+        help="Parquet file to save the most recent records to"
+    )
+
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of parquet files to scan concurrently (default: 1)"
+    )
+
+    parser.add_argument(
+        "--index",
+        nargs="?",
+        const=".nhs_record_index",
+        help="Use the NHS number index built by nhs_record_index.py (default: .nhs_record_index)"
+    )
+
+    parser.add_argument(
+        "--container",
+        help="Read the parquet files from a blob container instead of the current directory, "
+             "given as a container URL or as a container name with --connection-string"
+    )
+
+    parser.add_argument(
+        "--connection-string",
+        help="Storage connection string for --container (default: AZURITE_CONNECTION_STRING)"
+    )
+
+    parser.add_argument(
+        "--cache-dir",
+        default=".blob_cache",
+        help="Directory to cache blocks downloaded from --container in (default: .blob_cache)"
+    )
+
+    return parser.parse_args()
+
 def main():
     """
     Main function to find the most recent records for NHS numbers and save them to a parquet file.
     """
+    args = parse_args()
+
     # Check if a file path was provided as a command-line argument
-    if len(sys.argv) > 1:
-        file_path = sys.argv[1]
-        print(f"Reading NHS numbers from {file_path}...")
-        nhs_numbers = read_nhs_numbers(file_path)
+    if args.nhs_numbers_file:
+        print(f"Reading NHS numbers from {args.nhs_numbers_file}...")
+        nhs_numbers = read_nhs_numbers(args.nhs_numbers_file)
     else:
         nhs_numbers = read_nhs_numbers()
-        print(f"Using example NHS numbers: {nhs_numbers}")
+        print(f"Using example NHS numbers: {nhs_numbers.tolist()}")
 
-    # Find all parquet files in the current directory
-    parquet_files = find_parquet_files()
+    if len(nhs_numbers) == 0:
+        print("No valid NHS numbers to search for.")
+        sys.exit(1)
+
+    filesystem = None
+    if args.container:
+        if args.index:
+            print("Error: --index can only be used with parquet files in the current directory.")
+            sys.exit(1)
+
+        # Imported here so the Azure SDK is only needed when reading from blob storage
+        import blob_source
+        filesystem = blob_source.connect(args.container, args.connection_string, args.cache_dir)
+        parquet_files = blob_source.find_blob_parquet_files(filesystem)
+    else:
+        # Find all parquet files in the current directory, apart from the output of an earlier run
+        parquet_files = [file_path for file_path in find_parquet_files()
+                         if os.path.abspath(file_path) != os.path.abspath(args.output_file)]
     print(f"Found {len(parquet_files)} parquet files.")
 
     if not parquet_files:
-        print("No parquet files found in the current directory.")
+        print("No parquet files found.")
         sys.exit(1)
 
+    index = None
+    if args.index:
+        # Imported here as nhs_record_index builds on this module
+        from nhs_record_index import NhsRecordIndex
+        index = NhsRecordIndex.load(args.index)
+        if index is None:
+            print(f"No index found in {args.index}, run 'python nhs_record_index.py build' to create one.")
+            sys.exit(1)
+
     # Find the most recent records
-    result_df, schema, most_recent_records = find_most_recent_records(nhs_numbers, parquet_files)
+    winners, schema = find_most_recent_records(nhs_numbers, parquet_files, args.workers, index, filesystem)
 
     # Print summary of results
-    if not result_df.empty:
-        print(f"\nFound most recent records for {len(result_df)} NHS numbers.")
-
-        # Get the output file name
-        output_file = 'most_recent_records.parquet'
-        if len(sys.argv) > 2:
-            output_file = sys.argv[2]
+    if winners.num_rows > 0:
+        print(f"\nFound most recent records for {winners.num_rows} NHS numbers.")
 
         # Print source files for each NHS number
         print("\nSource files for each NHS number:")
-        for nhs, data in most_recent_records.items():
-            print(f"NHS {nhs}: {data['file_path']} (Date: {data['file_date']})")
+        for batch in winners.to_batches():
+            for nhs, file_path, file_date in zip(
+                    batch.column(NHS_NUMBER_COLUMN).to_pylist(),
+                    batch.column('file_path').to_pylist(),
+                    batch.column('file_date').to_pylist()):
+                print(f"NHS {nhs}: {file_path} (Date: {file_date})")
 
         # Save the results to a parquet file
-        save_to_parquet(result_df, schema, output_file)
+        save_to_parquet(winners, schema, args.output_file, filesystem)
     else:
         print("No matching records found for the provided NHS numbers.")
 
+    if filesystem is not None:
+        blob_source.print_transfer_stats(filesystem)
+
 if __name__ == "__main__":
     main()
 
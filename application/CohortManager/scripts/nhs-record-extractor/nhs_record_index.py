@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""
+NHS Record Index
+
+This script builds and maintains an index of where each NHS number is stored in the
+parquet files in a directory, so the NHS Record Extractor can go straight to the
+matching rows instead of scanning every file.
+
+The index is kept in a directory next to the parquet files:
+    manifest.json           The indexed files with their date, size and modification time,
+                            and the names of the two arrays
+    nhs_numbers.<id>.npy    Every NHS number found in the indexed files, sorted
+    locations.<id>.npy      The file, row group and row index of each NHS number
+
+Each save writes the arrays under a new id and then replaces the manifest, so the
+manifest always names a complete pair of arrays.
+
+The arrays are memory-mapped when the index is loaded, so a lookup only reads the
+parts of the index it needs.
+"""
+
+import os
+import json
+import uuid
+import argparse
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from nhs_record_extractor import NHS_NUMBER_COLUMN, extract_date_from_filename, find_parquet_files
+
+INDEX_DIRECTORY = '.nhs_record_index'
+MANIFEST_FILE = 'manifest.json'
+NHS_NUMBERS_FILE = 'nhs_numbers.npy'
+LOCATIONS_FILE = 'locations.npy'
+
+LOCATION_DTYPE = np.dtype([('file_id', '<i4'), ('row_group', '<i4'), ('row_index', '<i8')])
+
+def file_signature(file_path):
+    """
+    Get the size and modification time of a file, used to tell if it has changed.
+
+    Args:
+        file_path (str): Path to the file
+
+    Returns:
+        dict: The size and modification time of the file
+    """
+    stat = os.stat(file_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+def index_parquet_file(file_path, file_id):
+    """
+    Read the nhs_number column of a parquet file and record where each NHS number is.
+
+    Args:
+        file_path (str): Path to the parquet file
+        file_id (int): Id of the file in the index manifest
+
+    Returns:
+        tuple: (array of NHS numbers, array of locations), or None if the file cannot be indexed
+    """
+    parquet_file = pq.ParquetFile(file_path)
+
+    if NHS_NUMBER_COLUMN not in parquet_file.schema_arrow.names:
+        print(f"Warning: File {file_path} does not have an '{NHS_NUMBER_COLUMN}' column. Skipping.")
+        return None
+
+    nhs_numbers = []
+    locations = []
+    for row_group in range(parquet_file.num_row_groups):
+        column = parquet_file.read_row_group(row_group, columns=[NHS_NUMBER_COLUMN]).column(NHS_NUMBER_COLUMN)
+        row_indexes = pc.indices_nonzero(pc.is_valid(column))
+
+        group_locations = np.empty(len(row_indexes), dtype=LOCATION_DTYPE)
+        group_locations['file_id'] = file_id
+        group_locations['row_group'] = row_group
+        group_locations['row_index'] = row_indexes.to_numpy()
+
+        nhs_numbers.append(pc.cast(column.take(row_indexes), pa.int64()).to_numpy())
+        locations.append(group_locations)
+
+    if not nhs_numbers:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=LOCATION_DTYPE)
+    return np.concatenate(nhs_numbers), np.concatenate(locations)
+
+class NhsRecordIndex:
+    """
+    An index from NHS number to the files, row groups and rows that hold it.
+    """
+
+    def __init__(self, directory, files, nhs_numbers, locations):
+        self.directory = directory
+        self.files = files
+        self.nhs_numbers = nhs_numbers
+        self.locations = locations
+
+    @classmethod
+    def empty(cls, directory):
+        return cls(directory, [], np.empty(0, dtype=np.int64), np.empty(0, dtype=LOCATION_DTYPE))
+
+    @classmethod
+    def load(cls, index_directory, directory='.'):
+        """
+        Load an index, memory-mapping the NHS number and location arrays.
+
+        Args:
+            index_directory (str): Directory the index is stored in
+            directory (str): Directory holding the indexed parquet files
+
+        Returns:
+            NhsRecordIndex: The loaded index, or None if there is no index in the directory
+        """
+        manifest_path = os.path.join(index_directory, MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            return None
+
+        with open(manifest_path, 'r') as file:
+            manifest = json.load(file)
+
+        return cls(
+            directory,
+            manifest['files'],
+            np.load(os.path.join(index_directory, manifest.get('nhs_numbers', NHS_NUMBERS_FILE)), mmap_mode='r'),
+            np.load(os.path.join(index_directory, manifest.get('locations', LOCATIONS_FILE)), mmap_mode='r'))
+
+    def save(self, index_directory):
+        """
+        Save the index, replacing any index already in the directory.
+
+        Args:
+            index_directory (str): Directory to store the index in
+        """
+        os.makedirs(index_directory, exist_ok=True)
+
+        # The arrays get new names and the manifest is replaced last, so until then the old
+        # manifest still names the old arrays, and a failed save leaves the old index intact
+        save_id = uuid.uuid4().hex
+        array_files = {}
+        for key, file_name, array in [('nhs_numbers', NHS_NUMBERS_FILE, self.nhs_numbers), ('locations', LOCATIONS_FILE, self.locations)]:
+            array_files[key] = file_name.replace('.npy', f'.{save_id}.npy')
+            with open(os.path.join(index_directory, array_files[key]), 'wb') as file:
+                np.save(file, np.ascontiguousarray(array))
+
+        temp_path = os.path.join(index_directory, f"{MANIFEST_FILE}.tmp")
+        with open(temp_path, 'w') as file:
+            json.dump({'files': self.files, **array_files}, file, indent=2)
+        os.replace(temp_path, os.path.join(index_directory, MANIFEST_FILE))
+
+        # Remove the arrays of earlier saves, and of any save that failed part way
+        for file_name in os.listdir(index_directory):
+            if file_name.endswith('.npy') and file_name not in array_files.values():
+                try:
+                    os.remove(os.path.join(index_directory, file_name))
+                except OSError as e:
+                    print(f"Warning: Could not remove old index file {file_name}: {e}")
+
+    def is_current(self, file_name):
+        """
+        Check whether a parquet file is in the index and has not changed since it was indexed.
+
+        Args:
+            file_name (str): Name of the parquet file in the indexed directory
+
+        Returns:
+            bool: True if the index entries for the file can be trusted
+        """
+        file_path = os.path.join(self.directory, file_name)
+        for entry in self.files:
+            if entry['name'] == file_name:
+                return os.path.exists(file_path) and entry['signature'] == file_signature(file_path)
+        return False
+
+    def update(self, parquet_files):
+        """
+        Bring the index up to date with the parquet files in the directory.
+
+        Files that are unchanged keep their entries, new or changed files are indexed,
+        and entries for files that no longer exist are dropped.
+
+        Args:
+            parquet_files (list): List of parquet file paths in the indexed directory
+
+        Returns:
+            tuple: (number of files indexed, number of files dropped)
+        """
+        file_names = [os.path.basename(file_path) for file_path in parquet_files]
+
+        # Renumber the files that are kept, dropping the entries for every other file
+        kept_files = []
+        new_ids = np.full(len(self.files), -1, dtype=np.int32)
+        for file_id, entry in enumerate(self.files):
+            if entry['name'] in file_names and self.is_current(entry['name']):
+                new_ids[file_id] = len(kept_files)
+                kept_files.append(entry)
+        kept_names = {entry['name'] for entry in kept_files}
+        dropped = len(self.files) - len(kept_files)
+
+        locations = np.array(self.locations)
+        keep = new_ids[locations['file_id']] >= 0 if len(locations) else np.empty(0, dtype=bool)
+        nhs_numbers = [np.asarray(self.nhs_numbers)[keep]]
+        locations = locations[keep]
+        locations['file_id'] = new_ids[locations['file_id']]
+        locations = [locations]
+
+        indexed = 0
+        for file_path, file_name in zip(parquet_files, file_names):
+            if file_name in kept_names:
+                continue
+
+            file_date_str = extract_date_from_filename(file_path)
+            if not file_date_str:
+                print(f"Warning: Could not extract date from filename {file_path}. Skipping.")
+                continue
+
+            print(f"Indexing file: {file_path}")
+            try:
+                entries = index_parquet_file(file_path, len(kept_files))
+            except Exception as e:
+                print(f"Error indexing file {file_path}: {e}")
+                continue
+            if entries is None:
+                continue
+
+            kept_files.append({'name': file_name, 'file_date': file_date_str, 'signature': file_signature(file_path)})
+            nhs_numbers.append(entries[0])
+            locations.append(entries[1])
+            indexed += 1
+
+        nhs_numbers = np.concatenate(nhs_numbers)
+        locations = np.concatenate(locations)
+        order = np.argsort(nhs_numbers, kind='stable')
+
+        self.files = kept_files
+        self.nhs_numbers = nhs_numbers[order]
+        self.locations = locations[order]
+        return indexed, dropped
+
+    def lookup(self, nhs_numbers, parquet_files):
+        """
+        Find where the NHS numbers are stored in the parquet files that are still current.
+
+        Args:
+            nhs_numbers (ndarray): NHS numbers to look up as int64
+            parquet_files (list): List of parquet file paths, indexed by file_index
+
+        Returns:
+            Table: Matches with nhs_number, row_group, row_index, file_date and file_index columns
+        """
+        # Map each indexed file to its position in parquet_files, or -1 if it cannot be used
+        file_indexes = np.full(len(self.files), -1, dtype=np.int32)
+        positions = {os.path.basename(file_path): position for position, file_path in enumerate(parquet_files)}
+        for file_id, entry in enumerate(self.files):
+            if entry['name'] in positions and self.is_current(entry['name']):
+                file_indexes[file_id] = positions[entry['name']]
+
+        values = np.unique(nhs_numbers)
+        starts = np.searchsorted(self.nhs_numbers, values, side='left')
+        counts = np.searchsorted(self.nhs_numbers, values, side='right') - starts
+
+        # Expand each [start, start + count) range into the positions it covers
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        entry_positions = np.repeat(starts, counts) + offsets
+
+        locations = np.asarray(self.locations[entry_positions])
+        matched_numbers = np.repeat(values, counts)
+        matched_indexes = file_indexes[locations['file_id']] if len(locations) else np.empty(0, dtype=np.int32)
+        usable = matched_indexes >= 0
+        file_dates = np.array([entry['file_date'] for entry in self.files] or [''], dtype=object)
+
+        return pa.table({
+            NHS_NUMBER_COLUMN: pa.array(matched_numbers[usable], pa.int64()),
+            'row_group': pa.array(locations['row_group'][usable], pa.int32()),
+            'row_index': pa.array(locations['row_index'][usable], pa.int64()),
+            'file_date': pa.array(file_dates[locations['file_id'][usable]] if usable.any() else [], pa.string()),
+            'file_index': pa.array(matched_indexes[usable], pa.int32()),
+        })
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Build or update the index of NHS numbers used by the NHS Record Extractor."
+    )
+
+    parser.add_argument(
+        "command",
+        choices=["build", "update"],
+        help="'build' indexes every parquet file from scratch, 'update' only indexes new or changed files"
+    )
+
+    parser.add_argument(
+        "--directory",
+        default=".",
+        help="Directory containing the parquet files (default: current directory)"
+    )
+
+    parser.add_argument(
+        "--index",
+        help=f"Directory to store the index in (default: {INDEX_DIRECTORY} in the parquet file directory)"
+    )
+
+    return parser.parse_args()
+
+def main():
+    """
+    Main function to build or update the NHS number index.
+    """
+    args = parse_args()
+    index_directory = args.index or os.path.join(args.directory, INDEX_DIRECTORY)
+
+    parquet_files = find_parquet_files(args.directory)
+    print(f"Found {len(parquet_files)} parquet files.")
+
+    index = None
+    if args.command == "update":
+        index = NhsRecordIndex.load(index_directory, args.directory)
+        if index is None:
+            print(f"No index found in {index_directory}, building a new one.")
+    if index is None:
+        index = NhsRecordIndex.empty(args.directory)
+
+    indexed, dropped = index.update(parquet_files)
+    index.save(index_directory)
+    print(f"Indexed {indexed} files and dropped {dropped} files. "
+          f"The index holds {len(index.nhs_numbers)} records from {len(index.files)} files in {index_directory}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+"""An asyncio client for the PreviewParticipant, BlockParticipant and DeleteParticipant functions
+    Calls share one pool of keep-alive connections and at most max_concurrency run at once.
+    Throttled and failed previews are retried with exponential backoff. Blocks and deletes are only
+    retried when the function cannot have acted on them, so none is made twice. After
+    failure_threshold failures in a row an endpoint's circuit opens and calls to it fail straight
+    away until reset_timeout has passed. The latency of every call is kept in a histogram for each endpoint.
+
+    Example:
+        async with ParticipantManagementClient.from_environment(max_concurrency=16) as client:
+            records = await client.preview("9000000009", "19600111", "Smith")
+            await client.block("9000000009", "19600111", "Smith")
+            await client.delete("9000000009", "19600111", "Smith")
+            print(client.latency_report())
+
+    Requirements:
+        aiohttp"""
+
+import asyncio
+import bisect
+import json
+import os
+import random
+import time
+
+import aiohttp
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Statuses that mean the request was turned away before it was processed
+REFUSED_STATUSES = (429, 503)
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.02, 0.03, 0.05, 0.075, 0.1, 0.15, 0.2, 0.3, 0.5, 0.75, 1, 1.5, 2, 3, 5, 10, 30, 60)
+
+
+class ParticipantManagementError(Exception):
+    """A call that failed, with the status and body of the last response if there was one"""
+
+    def __init__(self, endpoint, message, status=None, body=None):
+        super().__init__(f"Error calling {endpoint}: {message}" + (f"\nResponse: {body}" if body else ""))
+        self.endpoint = endpoint
+        self.status = status
+        self.body = body
+
+
+class CircuitOpenError(ParticipantManagementError):
+    """A call that was not made because the endpoint has been failing"""
+
+
+class LatencyHistogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, percent):
+        # The upper bound of the bucket the percentile falls in
+        if not self.count:
+            return 0.0
+        target = self.count * percent / 100
+        seen = 0
+        for bound, count in zip(self.buckets + (self.max,), self.counts):
+            seen += count
+            if seen >= target:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "max": self.max,
+            "buckets": {str(bound): count for bound, count in zip(self.buckets + ("+Inf",), self.counts)},
+        }
+
+
+class CircuitBreaker:
+    """Opens after failure_threshold failures in a row, then lets one trial call through after reset_timeout"""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.reset_timeout else "open"
+
+    def allow(self):
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self.trial_running:
+            self.trial_running = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_running = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+
+def participant_payload(nhs_number, dob, family_name):
+    """The request body the functions expect, from a YYYYMMDD date of birth"""
+    return {
+        "NhsNumber": nhs_number,
+        "DateOfBirth": f"{dob[:4]}-{dob[4:6]}-{dob[6:8]}",
+        "FamilyName": family_name
+    }
+
+
+class ParticipantManagementClient:
+    def __init__(self, preview_url, block_url, delete_url, max_concurrency=8, timeout=60.0, retries=5,
+                 backoff_factor=0.5, failure_threshold=5, reset_timeout=30.0):
+        self.urls = {"PreviewParticipant": preview_url, "BlockParticipant": block_url, "DeleteParticipant": delete_url}
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.breakers = {endpoint: CircuitBreaker(failure_threshold, reset_timeout) for endpoint in self.urls}
+        self.histograms = {endpoint: LatencyHistogram() for endpoint in self.urls}
+        self.semaphore = None
+        self.session = None
+
+    @classmethod
+    def from_environment(cls, **kwargs):
+        """Create a client for the function URLs in PREVIEW_PARTICIPANT_URL, BLOCK_PARTICIPANT_URL and DELETE_PARTICIPANT_URL"""
+        return cls(os.getenv("PREVIEW_PARTICIPANT_URL"), os.getenv("BLOCK_PARTICIPANT_URL"), os.getenv("DELETE_PARTICIPANT_URL"), **kwargs)
+
+    async def __aenter__(self):
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_concurrency),
+            timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    async def preview(self, nhs_number, dob, family_name):
+        """Return the records PreviewParticipant finds for the participant"""
+        return await self._post("PreviewParticipant", participant_payload(nhs_number, dob, family_name), json_response=True, idempotent=True)
+
+    async def block(self, nhs_number, dob, family_name):
+        # BlockParticipant reads the NHS number as a number
+        payload = participant_payload(nhs_number, dob, family_name)
+        payload["NhsNumber"] = int(nhs_number)
+        return await self._post("BlockParticipant", payload)
+
+    async def delete(self, nhs_number, dob, family_name):
+        return await self._post("DeleteParticipant", participant_payload(nhs_number, dob, family_name))
+
+    def backoff(self, attempt, retry_after=None):
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+        # Exponential backoff with jitter, so calls that failed together do not retry together
+        return self.backoff_factor * (2 ** attempt) * random.uniform(0.5, 1.5)
+
+    async def _post(self, endpoint, payload, json_response=False, idempotent=False):
+        breaker = self.breakers[endpoint]
+        for attempt in range(self.retries + 1):
+            if not breaker.allow():
+                raise CircuitOpenError(endpoint, f"circuit open after {breaker.failures} failures in a row")
+
+            retry_after = None
+            sent = True
+            async with self.semaphore:
+                start = time.perf_counter()
+                try:
+                    async with self.session.post(self.urls[endpoint], json=payload) as response:
+                        body = await response.text()
+                        status = response.status
+                        retry_after = response.headers.get("Retry-After")
+                    error = None
+                except aiohttp.ClientConnectorError as e:
+                    status, body, error, sent = None, None, str(e) or type(e).__name__, False
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    status, body, error = None, None, str(e) or type(e).__name__
+                self.histograms[endpoint].record(time.perf_counter() - start)
+
+            if status is not None and status < 400:
+                breaker.record_success()
+                if not json_response:
+                    return body
+                try:
+                    return json.loads(body)
+                except json.JSONDecodeError:
+                    raise ParticipantManagementError(endpoint, "invalid JSON response", status, body) from None
+            if status is not None and status not in RETRY_STATUSES:
+                # The function answered, the request was wrong
+                breaker.record_success()
+                raise ParticipantManagementError(endpoint, f"{status}", status, body)
+
+            breaker.record_failure()
+            if not idempotent and sent and status not in REFUSED_STATUSES:
+                # The function may have acted on a call that timed out or failed part way, so calling again could act twice
+                raise ParticipantManagementError(endpoint, f"{status or error}, not retried as it may have been processed", status, body)
+            if attempt == self.retries:
+                raise ParticipantManagementError(endpoint, f"{status or error} after {attempt + 1} attempts", status, body)
+            await asyncio.sleep(self.backoff(attempt, retry_after))
+
+    def latency_summary(self):
+        return {endpoint: histogram.summary() for endpoint, histogram in self.histograms.items() if histogram.count}
+
+    def latency_report(self):
+        lines = [f"{'Endpoint':<20}{'Calls':>8}{'Mean':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'Max':>9}"]
+        for endpoint, summary in self.latency_summary().items():
+            lines.append(f"{endpoint:<20}{summary['count']:>8}" + "".join(
+                f"{summary[key] * 1000:>7.0f}ms" for key in ("mean", "p50", "p95", "p99", "max")))
+        return "\n".join(lines)
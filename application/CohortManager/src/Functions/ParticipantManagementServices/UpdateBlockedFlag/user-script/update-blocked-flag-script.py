@@ -1,10 +1,16 @@
 #!/usr/bin/env python3
+import argparse
+import asyncio
+import csv
 import requests
 import os
 import json
-from datetime import datetime
-from pprint import pprint
+import sys
+import threading
+from datetime import datetime, timezone
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 class Colors:
     RED = '\033[91m'
@@ -20,6 +26,37 @@ BLOCK_PARTICIPANT_URL = os.getenv("BLOCK_PARTICIPANT_URL")
 PREVIEW_PARTICIPANT_URL = os.getenv("PREVIEW_PARTICIPANT_URL")
 DELETE_PARTICIPANT_URL = os.getenv("DELETE_PARTICIPANT_URL")
 
+# Seconds to wait to connect and for a response
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 60
+DEFAULT_WORKERS = 4
+
+# Throttled and failed calls are retried, waiting 0.5s, 1s, 2s... between attempts, or as long as Retry-After asks
+RETRIES = 5
+BACKOFF_FACTOR = 0.5
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Statuses that mean the request was turned away before it was processed
+REFUSED_STATUSES = (429, 503)
+
+def create_session(pool_size=1, retries=RETRIES):
+    """Create a session that keeps up to pool_size connections open to each function and retries failed calls"""
+    session = requests.Session()
+    # A block or delete that timed out or failed part way may have been done, so it is only retried if it could not connect or was turned away
+    retry = Retry(total=retries, read=0, other=0, backoff_factor=BACKOFF_FACTOR, status_forcelist=REFUSED_STATUSES,
+                  allowed_methods=None, raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=3, pool_maxsize=pool_size, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    if PREVIEW_PARTICIPANT_URL:
+        # A preview only reads, so it is retried however it failed
+        preview_retry = Retry(total=retries, backoff_factor=BACKOFF_FACTOR, status_forcelist=RETRY_STATUSES,
+                              allowed_methods=None, raise_on_status=False)
+        session.mount(PREVIEW_PARTICIPANT_URL, HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=preview_retry))
+    return session
+
+session = create_session()
+timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)
+
 def validate_environment():
     """Validate that required environment variables are set"""
     required_vars = [
@@ -47,36 +84,55 @@ def format_dob_for_display(dob):
     """Convert YYYYMMDD to YYYY-MM-DD for display purposes"""
     return f"{dob[:4]}-{dob[4:6]}-{dob[6:8]}"
 
+def participant_payload(nhs_number, dob, family_name):
+    """Build the request body the participant management functions expect"""
+    return {
+        "NhsNumber": nhs_number,
+        "DateOfBirth": format_dob_for_display(dob),
+        "FamilyName": family_name
+    }
+
+def request_error(name, e):
+    """Describe a failed call, with the response body when there is one"""
+    message = f"Error calling {name}: {e}"
+    if e.response is not None and e.response.text:
+        message += f"\nResponse: {e.response.text}"
+    return message
+
+def post(url, payload):
+    """Post a participant to one of the functions, raising an error if the call fails"""
+    response = session.post(url, json=payload, timeout=timeout)
+    response.raise_for_status()
+    return response
+
+def fetch_preview(nhs_number, dob, family_name):
+    """Return the records PreviewParticipant finds for the participant"""
+    return post(PREVIEW_PARTICIPANT_URL, participant_payload(nhs_number, dob, family_name)).json()
+
+def send_block(nhs_number, dob, family_name):
+    # BlockParticipant reads the NHS number as a number
+    payload = participant_payload(nhs_number, dob, family_name)
+    payload["NhsNumber"] = int(nhs_number)
+    return post(BLOCK_PARTICIPANT_URL, payload)
+
+def send_delete(nhs_number, dob, family_name):
+    return post(DELETE_PARTICIPANT_URL, participant_payload(nhs_number, dob, family_name))
+
 def block_participant(nhs_number, dob, family_name):
     try:
-        params = {
-            "NhsNumber": nhs_number,
-            "DateOfBirth": dob,
-            "FamilyName": family_name
-        }
-        response = requests.post(BLOCK_PARTICIPANT_URL, params=params)
-        response.raise_for_status()
+        send_block(nhs_number, dob, family_name)
         print(f"{Colors.GREEN}Blocked flag updated successfully{Colors.END}")
         return True
     except requests.exceptions.RequestException as e:
-        print(f"{Colors.RED}Error calling BlockParticipant: {e}{Colors.END}")
-        if e.response:
-            print(f"{Colors.RED}Response: {e.response.text}{Colors.END}")
+        print(f"{Colors.RED}{request_error('BlockParticipant', e)}{Colors.END}")
+        return False
+    except ValueError:
+        print(f"{Colors.RED}Invalid NHS Number: {nhs_number}{Colors.END}")
         return False
 
 def preview_participant(nhs_number, dob, family_name):
     try:
-        formatted_dob = f"{dob[:4]}-{dob[4:6]}-{dob[6:8]}"
-
-        payload = {
-            "NhsNumber": nhs_number,
-            "DateOfBirth": formatted_dob,
-            "FamilyName": family_name
-        }
-        response = requests.post(PREVIEW_PARTICIPANT_URL, json=payload)
-        response.raise_for_status()
-
-        data = response.json()
+        data = fetch_preview(nhs_number, dob, family_name)
         print(f"\n{Colors.GREEN}Preview Results:{Colors.END}")
         for record in data:
             print(json.dumps(record, indent=2))
@@ -84,37 +140,202 @@ def preview_participant(nhs_number, dob, family_name):
         confirm = input("\nDo you want to block the participant and delete these records? (Y/N): ").strip().upper()
         return confirm == "Y"
     except requests.exceptions.RequestException as e:
-        print(f"{Colors.RED}Error calling PreviewParticipant: {e}{Colors.END}")
-        if e.response:
-            print(f"{Colors.RED}Response: {e.response.text}{Colors.END}")
+        print(f"{Colors.RED}{request_error('PreviewParticipant', e)}{Colors.END}")
         return False
 
 def delete_participant(nhs_number, dob, family_name):
     try:
-        formatted_dob = f"{dob[:4]}-{dob[4:6]}-{dob[6:8]}"
-
-        payload = {
-            "NhsNumber": nhs_number,
-            "DateOfBirth": formatted_dob,
-            "FamilyName": family_name
-        }
-        response = requests.post(DELETE_PARTICIPANT_URL, json=payload)
-        response.raise_for_status()
+        send_delete(nhs_number, dob, family_name)
         print(f"{Colors.GREEN}Participants deleted successfully{Colors.END}")
         return True
     except requests.exceptions.RequestException as e:
-        print(f"{Colors.RED}Error calling DeleteParticipant: {e}{Colors.END}")
-        if e.response:
-            print(f"{Colors.RED}Response: {e.response.text}{Colors.END}")
+        print(f"{Colors.RED}{request_error('DeleteParticipant', e)}{Colors.END}")
+        return False
+
+class Journal:
+    """An append only JSON lines record of each step done for each participant, so a batch can be resumed"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.completed = {}
+        if os.path.exists(path):
+            with open(path, "r") as file:
+                for line in file:
+                    if line.strip():
+                        entry = json.loads(line)
+                        if entry["ok"]:
+                            self.completed.setdefault(entry["nhs_number"], {})[entry["step"]] = entry["detail"]
+        self.file = open(path, "a")
+
+    def done(self, nhs_number, step):
+        return step in self.completed.get(nhs_number, {})
+
+    def detail(self, nhs_number, step):
+        return self.completed.get(nhs_number, {}).get(step)
+
+    def record(self, nhs_number, step, ok, detail=None):
+        entry = {
+            "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "nhs_number": nhs_number,
+            "step": step,
+            "ok": ok,
+            "detail": detail
+        }
+        with self.lock:
+            self.file.write(json.dumps(entry) + "\n")
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            if ok:
+                self.completed.setdefault(nhs_number, {})[step] = detail
+
+    def close(self):
+        self.file.close()
+
+def read_participants(path):
+    """Read NHS number, DOB (YYYYMMDD) and family name from a CSV with a header row"""
+    with open(path, "r", newline="") as file:
+        reader = csv.reader(file)
+        next(reader, None)
+        return [tuple(value.strip() for value in (row + ["", ""])[:3]) for row in reader if row]
+
+async def preview_step(client, error_class, participant, journal):
+    """Preview one participant, or take the preview from the journal, and return its line of the preview report"""
+    nhs_number, dob, family_name = participant
+    row = {"nhs_number": nhs_number, "date_of_birth": dob, "family_name": family_name, "status": "found", "records": 0, "detail": ""}
+    if not nhs_number.isdigit() or not validate_dob_format(dob):
+        row.update(status="invalid", detail=f"Invalid NHS number {nhs_number} or date of birth {dob}, expected YYYYMMDD")
+        journal.record(nhs_number, "validate", False, row["detail"])
+        return row
+
+    if not journal.done(nhs_number, "preview"):
+        try:
+            records = await client.preview(nhs_number, dob, family_name)
+            journal.record(nhs_number, "preview", True, {"records": len(records)})
+        except error_class as e:
+            row.update(status="not found" if e.status == 404 else "preview failed", detail=str(e))
+            journal.record(nhs_number, "preview", False, row["detail"])
+            return row
+    row["records"] = journal.detail(nhs_number, "preview")["records"]
+    return row
+
+async def block_and_delete_step(client, error_class, participant, journal):
+    """Block then delete one participant, skipping the steps the journal has as done. Returns the error or None"""
+    nhs_number, dob, family_name = participant
+    for step, call in [("block", client.block), ("delete", client.delete)]:
+        if journal.done(nhs_number, step):
+            continue
+        try:
+            await call(nhs_number, dob, family_name)
+            journal.record(nhs_number, step, True)
+        except error_class as e:
+            # A participant blocked by an earlier run that did not get to record it
+            if step == "block" and e.body and "Already Blocked" in e.body:
+                journal.record(nhs_number, step, True, "Already blocked")
+                continue
+            journal.record(nhs_number, step, False, str(e))
+            return str(e)
+    return None
+
+def write_report(path, rows):
+    """Write the preview report as JSON lines if the path ends in .jsonl, otherwise as CSV"""
+    with open(path, "w", newline="") as file:
+        if path.endswith(".jsonl"):
+            file.writelines(json.dumps(row) + "\n" for row in rows)
+        else:
+            writer = csv.DictWriter(file, fieldnames=["nhs_number", "date_of_birth", "family_name", "status", "records", "detail"])
+            writer.writeheader()
+            writer.writerows(rows)
+
+def sign_off(count, records, report_path):
+    """Ask once whether to block and delete every participant that was found"""
+    try:
+        confirm = input(f"\nDo you want to block {count} participants and delete their {records} records, as listed in {report_path}? (Y/N): ")
+    except EOFError:
         return False
+    return confirm.strip().upper() == "Y"
+
+async def run_batch(path, journal_path, report_path, workers, retries, confirm, preview_only):
+    """Preview every participant in a CSV, then once signed off block and delete the ones found, several at a time"""
+    # Only batch mode uses the asyncio client, so only batch mode needs aiohttp
+    try:
+        from participant_management_client import ParticipantManagementClient, ParticipantManagementError
+    except ModuleNotFoundError:
+        sys.exit("Requirements not installed, please run 'pip install aiohttp'")
+
+    participants = read_participants(path)
+    journal = Journal(journal_path)
+    try:
+        async with ParticipantManagementClient.from_environment(max_concurrency=workers, timeout=timeout[1], retries=retries) as client:
+            # Phase 1: preview everyone and write one report to check
+            print(f"Step 1: Previewing {len(participants)} participants, {workers} at a time...")
+            rows = await asyncio.gather(*(preview_step(client, ParticipantManagementError, participant, journal) for participant in participants))
+            write_report(report_path, rows)
+
+            found = [(participant, row) for participant, row in zip(participants, rows) if row["status"] == "found"]
+            records = sum(row["records"] for _, row in found)
+            print(f"{Colors.GREEN}{len(found)} participants found with {records} records, preview written to {report_path}{Colors.END}")
+            for row in rows:
+                if row["status"] != "found":
+                    print(f"{Colors.RED}{row['nhs_number']}: {row['status']}{Colors.END}")
+
+            if not found or preview_only:
+                return len(found) == len(rows)
+            if not confirm and not sign_off(len(found), records, report_path):
+                print(f"\n{Colors.YELLOW}Blocking and Deletion cancelled.{Colors.END}")
+                return False
+
+            # Phase 2: block and delete everyone found
+            print(f"\nStep 2: Blocking and deleting {len(found)} participants, {workers} at a time...")
+            errors = await asyncio.gather(*(block_and_delete_step(client, ParticipantManagementError, participant, journal) for participant, _ in found))
+            print(f"\n{client.latency_report()}")
+    finally:
+        journal.close()
+
+    failures = [(participant, error) for (participant, _), error in zip(found, errors) if error]
+    for participant, error in failures:
+        print(f"{Colors.RED}{participant[0]}: {error}{Colors.END}")
+    print(f"\n{len(found) - len(failures)} of {len(found)} participants blocked and deleted, {len(failures)} failed")
+    if failures:
+        print(f"{Colors.YELLOW}Run the same command again to retry the failed steps, the journal is in {journal_path}{Colors.END}")
+    return not failures and len(found) == len(rows)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Block participants and delete their records",
+                                     formatter_class=argparse.RawTextHelpFormatter,
+                                     epilog="""Examples:
+    python update-blocked-flag-script.py
+    python update-blocked-flag-script.py --batch participants.csv
+    python update-blocked-flag-script.py --batch participants.csv --preview-only --report preview.jsonl
+    python update-blocked-flag-script.py --batch participants.csv --confirm --workers 8""")
+    parser.add_argument("--batch", metavar="CSV", help="(OPTIONAL) Preview the participants in this CSV of NHS number, DOB (YYYYMMDD) and family name,\nthen block and delete them after one confirmation")
+    parser.add_argument("--confirm", action="store_true", help="(OPTIONAL) In batch mode, block and delete without asking for confirmation")
+    parser.add_argument("--preview-only", action="store_true", help="(OPTIONAL) In batch mode, stop after writing the preview report")
+    parser.add_argument("--report", help="(OPTIONAL) The preview report, JSON lines if it ends in .jsonl (default: <CSV>.preview.csv)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help=f"Participants processed at the same time in batch mode (default: {DEFAULT_WORKERS})")
+    parser.add_argument("--journal", help="(OPTIONAL) The journal of completed steps, a batch is resumed from it when run again (default: <CSV>.journal.jsonl)")
+    parser.add_argument("--timeout", type=float, default=READ_TIMEOUT, help=f"Seconds to wait for each response (default: {READ_TIMEOUT})")
+    parser.add_argument("--retries", type=int, default=RETRIES, help=f"Times to retry a call that is throttled or fails, blocks and deletes are not retried if they may have been done (default: {RETRIES})")
+    return parser.parse_args()
 
 def main():
+    global session, timeout
+    args = parse_args()
+    timeout = (CONNECT_TIMEOUT, args.timeout)
+    session = create_session(retries=args.retries)
+
     # Validate environment before proceeding
     if not validate_environment():
         return
 
     print("\nParticipant Management Script\n")
 
+    if args.batch:
+        if not asyncio.run(run_batch(args.batch, args.journal or f"{args.batch}.journal.jsonl", args.report or f"{args.batch}.preview.csv",
+                                     args.workers, args.retries, args.confirm, args.preview_only)):
+            sys.exit(1)
+        return
+
     # Get user input
     nhs_number = input("Enter NHS Number: ")
 
@@ -146,4 +367,3 @@ def main():
 
 if __name__ == "__main__":
     main()
-
@@ -3,7 +3,16 @@ import glob
 import os
 import logging
 import argparse
+import shutil
+import tempfile
 import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from xml.sax.saxutils import quoteattr
+
+try:
+  import ijson
+except ImportError:
+  ijson = None
 
 
 logging.basicConfig(
@@ -11,6 +20,9 @@ logging.basicConfig(
   format="[%(levelname)s] %(message)s"
 )
 
+ALERT_PREFIX = "site.item.alerts.item"
+ALERT_FIELDS = ("pluginid", "alert", "riskdesc", "desc", "count")
+
 
 
 def load_json(file):
@@ -24,6 +36,143 @@ def load_json(file):
 
 
 
+def stream_alerts(file):
+  """
+  Yield (site name, alert) for each alert in a ZAP JSON report without loading the whole report.
+  Only the alert fields the report needs are kept, so instance lists are never held in memory.
+  """
+  site_name = "ZAP"
+  alert = None
+  instances = 0
+
+  with open(file, "rb") as f:
+    for prefix, event, value in ijson.parse(f):
+      if prefix == "site.item" and event == "start_map":
+        site_name = "ZAP"
+      elif prefix in ("site.item.@name", "site.item.name"):
+        site_name = value
+      elif prefix == ALERT_PREFIX and event == "start_map":
+        alert = {}
+        instances = 0
+      elif prefix == ALERT_PREFIX + ".instances.item" and event == "start_map":
+        instances += 1
+      elif prefix == ALERT_PREFIX and event == "end_map":
+        if instances and "count" not in alert:
+          alert["count"] = str(instances)
+        yield site_name, alert
+      elif alert is not None and prefix.startswith(ALERT_PREFIX + ".") and prefix[len(ALERT_PREFIX) + 1:] in ALERT_FIELDS:
+        alert[prefix[len(ALERT_PREFIX) + 1:]] = value
+
+
+
+def site_alerts(data):
+  for site in data.get("site", []):
+    site_name = site.get("@name", site.get("name", "ZAP"))
+    for alert in site.get("alerts", []):
+      yield site_name, alert
+
+
+
+def alert_key(alert):
+  return alert.get("pluginid") or alert.get("alert", "Unknown Alert")
+
+
+
+def risk(severity):
+  """
+  The risk from a ZAP riskdesc, which is followed by the confidence, e.g. "High" from "High (Medium)".
+  """
+  return severity.split(" (")[0]
+
+
+
+def instance_count(alert):
+  try:
+    return int(alert["count"])
+  except (KeyError, TypeError, ValueError):
+    return len(alert.get("instances", [])) or 1
+
+
+
+def dedupe_alerts(alerts):
+  """
+  Merge alerts from the same plugin with the same risk into one, wherever they were found.
+  The instances are added up, the sites kept, and the description is kept once.
+  """
+  merged = {}
+  for site_name, alert in alerts:
+    key = (alert_key(alert), risk(alert.get("riskdesc", "")))
+    if key not in merged:
+      merged[key] = {field: alert[field] for field in ALERT_FIELDS if field in alert}
+      merged[key]["count"] = 0
+      merged[key]["sites"] = {}
+    merged[key]["count"] += instance_count(alert)
+    merged[key]["sites"][site_name] = None
+
+  for alert in merged.values():
+    alert["sites"] = list(alert["sites"])
+    yield alert["sites"][0] if len(alert["sites"]) == 1 else "ZAP", alert
+
+
+
+def load_baseline(baseline_file):
+  if not os.path.exists(baseline_file):
+    logging.warning(f"Baseline file {baseline_file} not found, reporting all alerts")
+    return {}
+  try:
+    with open(baseline_file, "r", encoding="utf-8") as f:
+      return json.load(f).get("alerts", {})
+  except Exception as e:
+    logging.error(f"Failed to read baseline file {baseline_file}: {e}")
+    return None
+
+
+
+def new_alerts(alerts, baseline, stats):
+  """
+  Leave out alerts that are in the baseline with the same risk, so only new alerts and alerts whose risk changed are reported.
+  """
+  for site_name, alert in alerts:
+    known = baseline.get(alert_key(alert))
+    if known and risk(alert.get("riskdesc", "")) in known["risks"]:
+      stats["baselined"] += 1
+    else:
+      yield site_name, alert
+
+
+
+def track_alerts(alerts, seen):
+  for site_name, alert in alerts:
+    entry = seen.setdefault(alert_key(alert), {"alert": alert.get("alert", "Unknown Alert"), "risks": []})
+    if risk(alert.get("riskdesc", "")) not in entry["risks"]:
+      entry["risks"].append(risk(alert.get("riskdesc", "")))
+    yield site_name, alert
+
+
+
+def select_alerts(alerts, dedupe, baseline, stats, seen):
+  if seen is not None:
+    alerts = track_alerts(alerts, seen)
+  if baseline is not None:
+    alerts = new_alerts(alerts, baseline, stats)
+  if dedupe:
+    alerts = dedupe_alerts(alerts)
+  return alerts
+
+
+
+def classify(severity):
+  """
+  The JUnit outcome for a ZAP risk: High alerts fail, Medium alerts are skipped and the rest pass.
+  """
+  if risk(severity) == "High":
+    return "failure", "failures"
+  if risk(severity) == "Medium":
+    return "skipped", "skipped"
+  return None, None
+
+
+
 def process_alert(testcase_parent, site_name, alert, counters):
   counters["total"] += 1
 
@@ -38,27 +187,28 @@ def process_alert(testcase_parent, site_name, alert, counters):
     name=f"{alert_name} ({severity})"
   )
 
-  if "High" in severity:
-    counters["failures"] += 1
-    failure = ET.SubElement(testcase, "failure", message=severity)
-    failure.text = description
+  outcome, counter = classify(severity)
+  if outcome:
+    counters[counter] += 1
+    result = ET.SubElement(testcase, outcome, message=severity)
+    result.text = description
+
+  if "sites" in alert:
+    output = ET.SubElement(testcase, "system-out")
+    sites = len(alert["sites"])
+    output.text = f"{alert['count']} instances on {sites} site{'s' if sites != 1 else ''}:\n" + "\n".join(alert["sites"])
 
-  elif "Medium" in severity:
-    counters["skipped"] += 1
-    skipped = ET.SubElement(testcase, "skipped", message=severity)
-    skipped.text = description
+  return testcase
 
 
 
-def build_testsuite(data, file):
+def build_testsuite(alerts, file):
   testsuite = ET.Element("testsuite", name=f"ZAP Security Scan ({file})")
   counters = {"total": 0, "failures": 0, "skipped": 0}
 
   try:
-    for site in data.get("site", []):
-      site_name = site.get("name", "ZAP")
-      for alert in site.get("alerts", []):
-        process_alert(testsuite, site_name, alert, counters)
+    for site_name, alert in alerts:
+      process_alert(testsuite, site_name, alert, counters)
   except Exception as e:
     logging.error(f"Error processing alerts in {file}: {e}")
 
@@ -82,6 +232,106 @@ def write_xml(output_file, testsuite):
 
 
 
+def write_testsuite_streaming(alerts, file, output_file):
+  """
+  Write the JUnit testsuite for a ZAP report one testcase at a time.
+  The testcases go to a temporary file first, as the counts in the testsuite element are only known at the end,
+  so a report that cannot be read raises before anything is written.
+  """
+  counters = {"total": 0, "failures": 0, "skipped": 0}
+
+  parent = ET.Element("testsuite")
+
+  with tempfile.TemporaryFile("w+", encoding="utf-8") as body:
+    for site_name, alert in alerts:
+      testcase = process_alert(parent, site_name, alert, counters)
+      parent.remove(testcase)
+      body.write(ET.tostring(testcase, encoding="unicode") + "\n")
+
+    body.seek(0)
+    with open(output_file, "w", encoding="utf-8") as f:
+      f.write("<?xml version='1.0' encoding='utf-8'?>\n")
+      f.write(f"<testsuite name={quoteattr(f'ZAP Security Scan ({file})')} tests=\"{counters['total']}\" "
+              f"failures=\"{counters['failures']}\" skipped=\"{counters['skipped']}\">\n")
+      shutil.copyfileobj(body, f)
+      f.write("</testsuite>\n")
+
+  return counters
+
+
+
+def convert_file(file, output_dir, stream, dedupe=False, baseline=None, track=False):
+  """
+  Convert one ZAP report, returning its summary or None if it could not be converted.
+  With track the summary also has the alerts found, for updating the baseline.
+  Runs in a worker process.
+  """
+  xml_file = os.path.join(output_dir, os.path.basename(file).replace(".json", ".xml"))
+  stats = {"baselined": 0}
+  seen = {} if track else None
+
+  if stream:
+    logging.info(f"Processing {file}")
+    try:
+      counters = write_testsuite_streaming(select_alerts(stream_alerts(file), dedupe, baseline, stats, seen), file, xml_file)
+    except Exception as e:
+      logging.error(f"Failed to read JSON file {file}: {e}")
+      return None
+  else:
+    data = load_json(file)
+    if data is None:
+      return None
+    testsuite, counters = build_testsuite(select_alerts(site_alerts(data), dedupe, baseline, stats, seen), file)
+    if not write_xml(xml_file, testsuite):
+      return None
+
+  result = {"input": file, "output": xml_file, "total": counters["total"], "high": counters["failures"], "medium": counters["skipped"]}
+  if baseline is not None:
+    result["baselined"] = stats["baselined"]
+  if track:
+    result["alerts"] = seen
+  return result
+
+
+
+def write_baseline(baseline_file, results):
+  alerts = {}
+  for result in results:
+    for key, found in result["alerts"].items():
+      entry = alerts.setdefault(key, {"alert": found["alert"], "risks": []})
+      entry["risks"] = sorted(set(entry["risks"]) | set(found["risks"]))
+
+  try:
+    with open(baseline_file, "w", encoding="utf-8") as f:
+      json.dump({"alerts": dict(sorted(alerts.items()))}, f, indent=2)
+    logging.info(f"Baseline of {len(alerts)} alerts written to {baseline_file}")
+  except Exception as e:
+    logging.error(f"Failed to write baseline file {baseline_file}: {e}")
+
+
+
+def write_combined(combined_file, results):
+  """
+  Write every testsuite into one testsuites document, copying each suite across without parsing it.
+  """
+  try:
+    with open(combined_file, "w", encoding="utf-8") as f:
+      f.write("<?xml version='1.0' encoding='utf-8'?>\n")
+      f.write(f"<testsuites name=\"ZAP Security Scan\" tests=\"{sum(result['total'] for result in results)}\" "
+              f"failures=\"{sum(result['high'] for result in results)}\" skipped=\"{sum(result['medium'] for result in results)}\">\n")
+      for result in results:
+        with open(result["output"], "r", encoding="utf-8") as suite:
+          declaration = suite.readline()
+          if not declaration.startswith("<?xml"):
+            f.write(declaration)
+          shutil.copyfileobj(suite, f)
+        f.write("\n")
+      f.write("</testsuites>\n")
+  except Exception as e:
+    logging.error(f"Failed to write combined XML file {combined_file}: {e}")
+
+
+
 def create_summary_file(summary_file: str, text: str):
   """
   Create summary file with the provided text in the current folder.
@@ -94,7 +344,9 @@ def create_summary_file(summary_file: str, text: str):
 
 
 
-def generate_junit_reports(input_dir: str, output_dir: str, summary_file: str):
+def generate_junit_reports(input_dir: str, output_dir: str, summary_file: str, stream: bool = False, workers: int = None,
+                           combined_file: str = None, summary_json: str = None, dedupe: bool = False,
+                           baseline_file: str = None, update_baseline: bool = False):
   """
   Convert ZAP JSON scan reports to JUnit XML.
 
@@ -102,34 +354,74 @@ def generate_junit_reports(input_dir: str, output_dir: str, summary_file: str):
     input_dir (str): Directory containing ZAP JSON reports.
     output_dir (str): Directory to write JUnit XML files.
     summary_file (str): File to write the summary.
+    stream (bool): Read the reports and write the XML incrementally, needs ijson.
+    workers (int): Number of reports converted at the same time, defaults to the number of CPUs.
+    combined_file (str): Optional file to also write all the testsuites to as one testsuites document.
+    summary_json (str): Optional file to write the summary to as JSON.
+    dedupe (bool): Report each plugin and risk once per file, with the instances added up.
+    baseline_file (str): Optional baseline of known alerts, only new alerts and alerts whose risk changed are reported.
+    update_baseline (bool): Write the alerts found to the baseline file afterwards.
   """
 
   if not os.path.isdir(input_dir):
     logging.error(f"Input directory not found: {input_dir}")
     return
 
+  if stream and ijson is None:
+    logging.warning("ijson is not installed, reading reports without streaming. Run 'pip install ijson' to stream them")
+    stream = False
+
+  baseline = None
+  if baseline_file:
+    baseline = load_baseline(baseline_file)
+    if baseline is None:
+      return
+
   os.makedirs(output_dir, exist_ok=True)
 
-  json_files = glob.glob(os.path.join(input_dir, "*.json"))
+  json_files = sorted(glob.glob(os.path.join(input_dir, "*.json")))
   if not json_files:
     logging.warning(f"No JSON files found in {input_dir}")
     return
 
-  summary_text = ""
+  track = bool(baseline_file and update_baseline)
+  count = len(json_files)
+  with ProcessPoolExecutor(max_workers=workers) as executor:
+    results = [result for result in executor.map(convert_file, json_files, [output_dir] * count, [stream] * count,
+                                                  [dedupe] * count, [baseline] * count, [track] * count) if result]
 
-  for file in json_files:
-    data = load_json(file)
-    if data is None:
-      continue
+  if track:
+    if len(results) < count:
+      logging.warning(f"Not updating baseline file {baseline_file} as some reports could not be read")
+    else:
+      write_baseline(baseline_file, results)
+    for result in results:
+      del result["alerts"]
 
-    testsuite, counters = build_testsuite(data, file)
-    xml_file = os.path.join(output_dir, os.path.basename(file).replace(".json", ".xml"))
-
-    if write_xml(xml_file, testsuite):
-      summary_text += f"{xml_file} (Total: {counters['total']}, High: {counters['failures']}, Medium: {counters['skipped']}) "
+  summary_text = ""
+  for result in results:
+    summary_text += f"{result['output']} (Total: {result['total']}, High: {result['high']}, Medium: {result['medium']}) "
 
   create_summary_file(summary_file, summary_text)
 
+  if combined_file:
+    write_combined(combined_file, results)
+
+  if summary_json:
+    summary = {
+      "total": sum(result["total"] for result in results),
+      "high": sum(result["high"] for result in results),
+      "medium": sum(result["medium"] for result in results),
+      **({"baselined": sum(result["baselined"] for result in results)} if baseline is not None else {}),
+      "failed_files": sorted(set(json_files) - {result["input"] for result in results}),
+      "files": results
+    }
+    try:
+      with open(summary_json, "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2)
+    except Exception as e:
+      logging.error(f"Failed to write summary JSON file {summary_json}: {e}")
+
 
 
 def parse_args():
@@ -155,12 +447,55 @@ def parse_args():
     help="File to write the summary"
   )
 
-  return parser.parse_args()
+  parser.add_argument(
+    "--stream",
+    action="store_true",
+    help="Read reports and write XML incrementally to keep memory use flat, needs ijson"
+  )
+
+  parser.add_argument(
+    "--workers",
+    type=int,
+    help="Number of reports converted at the same time (default: number of CPUs)"
+  )
+
+  parser.add_argument(
+    "--combined",
+    help="Also write all testsuites to this file as one testsuites document"
+  )
+
+  parser.add_argument(
+    "--summary-json",
+    help="Also write the summary to this file as JSON"
+  )
+
+  parser.add_argument(
+    "--dedupe",
+    action="store_true",
+    help="Report each alert once per file for each risk, with the instances on every site added up"
+  )
+
+  parser.add_argument(
+    "--baseline",
+    help="Baseline file of known alerts, only new alerts and alerts whose risk changed are reported"
+  )
+
+  parser.add_argument(
+    "--update-baseline",
+    action="store_true",
+    help="Write the alerts found to the baseline file, creating it if it does not exist"
+  )
+
+  args = parser.parse_args()
+  if args.update_baseline and not args.baseline:
+    parser.error("--update-baseline needs --baseline")
+  return args
 
 
 def main():
   args = parse_args()
-  generate_junit_reports(args.input, args.output, args.summary)
+  generate_junit_reports(args.input, args.output, args.summary, args.stream, args.workers, args.combined, args.summary_json,
+                         args.dedupe, args.baseline, args.update_baseline)
 
 
 if __name__ == "__main__":